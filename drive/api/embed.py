@@ -3,6 +3,7 @@ from werkzeug.wrappers import Response
 from werkzeug.wsgi import wrap_file
 from pathlib import Path
 from drive.utils.files import FileManager, get_home_folder
+from contextlib import closing
 from io import BytesIO
 import time
 import threading
@@ -163,54 +164,53 @@ def get_file_content(embed_name, parent_entity_name):
                 # ⚠️ FIX: Sử dụng FileManager.get_file() nhưng với logging chi tiết hơn
                 # FileManager đã được tối ưu để check local trước, nhưng chúng ta đã check rồi
                 # nên sẽ fetch từ S3
-                file_buffer = manager.get_file(embed_path)
-
-                file_content = None
-                file_size = 0
-
-                s3_get_duration = time.time() - s3_fetch_start
-
-                if hasattr(file_buffer, "read"):
-                    # S3 stream object - đọc với chunks để tránh timeout và tối ưu memory
-                    chunk_size = 1024 * 1024  # 1MB chunks
-                    file_content = b""
-
-                    read_start = time.time()
-                    while True:
-                        chunk = file_buffer.read(chunk_size)
-                        if not chunk:
-                            break
-                        file_content += chunk
-                        if len(file_content) > MAX_EMBED_SIZE:
-                            frappe.logger().error(
-                                f"[get_file_content] File too large: {embed_name} (> {MAX_EMBED_SIZE})"
-                            )
-                            frappe.throw(
-                                "Embed file is too large", frappe.ValidationError
-                            )
-
-                    file_size = len(file_content)
-                    read_duration = time.time() - read_start
-
-                    frappe.logger().info(
-                        f"[get_file_content] S3 file read: total={time.time() - s3_fetch_start:.3f}s "
-                        f"(get_object={s3_get_duration:.3f}s, read_stream={read_duration:.3f}s, "
-                        f"{file_size} bytes)"
-                    )
-                elif isinstance(file_buffer, bytes):
-                    file_content = file_buffer
-                    file_size = len(file_content)
-                    frappe.logger().info(
-                        f"[get_file_content] S3 file read: {time.time() - s3_fetch_start:.3f}s "
-                        f"(get_object={s3_get_duration:.3f}s, {file_size} bytes)"
-                    )
-                else:
-                    file_content = bytes(file_buffer)
-                    file_size = len(file_content)
-                    frappe.logger().info(
-                        f"[get_file_content] S3 file read: {time.time() - s3_fetch_start:.3f}s "
-                        f"(get_object={s3_get_duration:.3f}s, {file_size} bytes)"
-                    )
+                with closing(manager.get_file(embed_path)) as file_buffer:
+                    file_content = None
+                    file_size = 0
+
+                    s3_get_duration = time.time() - s3_fetch_start
+
+                    if hasattr(file_buffer, "read"):
+                        # S3 stream object - đọc với chunks để tránh timeout và tối ưu memory
+                        chunk_size = 1024 * 1024  # 1MB chunks
+                        file_content = b""
+
+                        read_start = time.time()
+                        while True:
+                            chunk = file_buffer.read(chunk_size)
+                            if not chunk:
+                                break
+                            file_content += chunk
+                            if len(file_content) > MAX_EMBED_SIZE:
+                                frappe.logger().error(
+                                    f"[get_file_content] File too large: {embed_name} (> {MAX_EMBED_SIZE})"
+                                )
+                                frappe.throw(
+                                    "Embed file is too large", frappe.ValidationError
+                                )
+
+                        file_size = len(file_content)
+                        read_duration = time.time() - read_start
+
+                        frappe.logger().info(
+                            f"[get_file_content] S3 file read: total={time.time() - s3_fetch_start:.3f}s "
+                            f"(get_object={s3_get_duration:.3f}s, read_stream={read_duration:.3f}s, "
+                            f"{file_size} bytes)"
+                        )
+                    elif isinstance(file_buffer, bytes):
+                        file_content = file_buffer
+                        file_size = len(file_content)
+                        frappe.logger().info(
+                            f"[get_file_content] S3 file read: {time.time() - s3_fetch_start:.3f}s "
+                            f"(get_object={s3_get_duration:.3f}s, {file_size} bytes)"
+                        )
+                    else:
+                        file_content = bytes(file_buffer)
+                        file_size = len(file_content)
+                        frappe.logger().info(
+                            f"[get_file_content] S3 file read: {time.time() - s3_fetch_start:.3f}s "
+                            f"(get_object={s3_get_duration:.3f}s, {file_size} bytes)"
+                        )
 
                 if file_size > MAX_EMBED_SIZE:
                     frappe.logger().error(
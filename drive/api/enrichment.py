@@ -0,0 +1,183 @@
+"""
+Enrichment stage shared by the listing endpoints.
+
+Listing endpoints select the page of Drive Files first and then call
+`enrich_entities` once on that page. Per-entity counters and flags (children,
+share badges, pins, favourites) come back from a single UNION ALL query over
+the page's names only; team titles and owner names/avatars are served from
+short-TTL Redis entries. Clients can skip fields they do not render with
+`exclude_fields`.
+"""
+
+import json
+
+import frappe
+
+from drive.utils.files import get_file_type
+
+ENRICH_CACHE_TTL = 300
+
+# Field groups a client can opt out of
+ALL_FIELDS = ("children", "share_count", "is_pinned", "is_favourite", "owner", "team_name")
+DEFAULT_FIELDS = ("children", "share_count", "is_pinned", "owner", "team_name")
+
+
+def parse_fields(exclude_fields=None, fields=DEFAULT_FIELDS):
+    if isinstance(exclude_fields, str):
+        exclude_fields = json.loads(exclude_fields) if exclude_fields.startswith("[") else [exclude_fields]
+    return [f for f in fields if f not in set(exclude_fields or [])]
+
+
+def _cached_rows(prefix, names, loader):
+    """{name: row} for `names`, reading Redis first and loading the misses in one query"""
+    if not names:
+        return {}
+    cache = frappe.cache()
+    keys = [cache.make_key(f"{prefix}:{n}") for n in names]
+    with cache.pipeline() as pipe:
+        for key in keys:
+            pipe.get(key)
+        cached = pipe.execute()
+
+    result = {n: json.loads(v) for n, v in zip(names, cached) if v is not None}
+    missing = [n for n in names if n not in result]
+    if missing:
+        loaded = loader(missing)
+        with cache.pipeline() as pipe:
+            for name in missing:
+                pipe.set(
+                    cache.make_key(f"{prefix}:{name}"),
+                    json.dumps(loaded.get(name), default=str),
+                    ex=ENRICH_CACHE_TTL,
+                )
+            pipe.execute()
+        result.update(loaded)
+    return result
+
+
+def get_user_cards(users):
+    """{user: {"full_name", "user_image"}}, cached briefly"""
+    return _cached_rows(
+        "drive_user_card",
+        list(users),
+        lambda missing: {
+            u.name: {"full_name": u.full_name, "user_image": u.user_image}
+            for u in frappe.get_all(
+                "User",
+                filters={"name": ["in", missing]},
+                fields=["name", "full_name", "user_image"],
+            )
+        },
+    )
+
+
+def get_team_titles(teams):
+    """{team: title}, cached briefly"""
+    return _cached_rows(
+        "drive_team_title",
+        list(teams),
+        lambda missing: dict(
+            frappe.get_all(
+                "Drive Team", filters={"name": ["in", missing]}, fields=["name", "title"], as_list=True
+            )
+        ),
+    )
+
+
+def _page_flags(names, fields, user, child_is_active):
+    """children / share / public / team / pinned / favourite values for `names` in one query"""
+    parts = []
+    if "children" in fields:
+        parts.append(
+            """
+            SELECT 'children' AS kind, parent_entity AS entity, COUNT(*) AS value
+            FROM `tabDrive File`
+            WHERE parent_entity IN %(names)s AND is_active = %(child_is_active)s
+            GROUP BY parent_entity
+            """
+        )
+    if "share_count" in fields:
+        parts.append(
+            """
+            SELECT CASE user WHEN '' THEN 'public' WHEN '$TEAM' THEN 'team' ELSE 'share' END AS kind,
+                   entity, COUNT(*) AS value
+            FROM `tabDrive Permission`
+            WHERE entity IN %(names)s AND (valid_until IS NULL OR valid_until > %(now)s)
+            GROUP BY entity, kind
+            """
+        )
+    if "is_pinned" in fields:
+        parts.append(
+            """
+            SELECT 'pinned' AS kind, drive_file AS entity, 1 AS value
+            FROM `tabDrive Pin File`
+            WHERE user = %(user)s AND drive_file IN %(names)s
+            """
+        )
+    if "is_favourite" in fields:
+        parts.append(
+            """
+            SELECT 'favourite' AS kind, entity, 1 AS value
+            FROM `tabDrive Favourite`
+            WHERE user = %(user)s AND entity IN %(names)s
+            """
+        )
+    flags = {}
+    if not parts:
+        return flags
+    rows = frappe.db.sql(
+        " UNION ALL ".join(parts),
+        {
+            "names": tuple(names),
+            "user": user,
+            "child_is_active": child_is_active,
+            "now": frappe.utils.now_datetime(),
+        },
+    )
+    for kind, entity, value in rows:
+        flags.setdefault(kind, {})[entity] = value
+    return flags
+
+
+def enrich_entities(rows, fields=DEFAULT_FIELDS, user=None, child_is_active=1):
+    """
+    Add listing fields to a page of Drive File rows in place.
+
+    :param rows: dicts with at least name, owner, team, mime_type, is_group
+    :param fields: field groups to compute (see ALL_FIELDS); `file_type` is always set
+    :param child_is_active: is_active value counted for `children` (0 in the trash view)
+    :return: `rows`
+    """
+    if not rows:
+        return rows
+    user = user or frappe.session.user
+    fields = set(fields)
+    names = [r["name"] for r in rows]
+    flags = _page_flags(names, fields, user, child_is_active)
+
+    owners = get_user_cards({r["owner"] for r in rows if r.get("owner")}) if "owner" in fields else {}
+    teams = get_team_titles({r["team"] for r in rows if r.get("team")}) if "team_name" in fields else {}
+
+    for r in rows:
+        name = r["name"]
+        r["file_type"] = get_file_type(r)
+        if "children" in fields:
+            r["children"] = flags.get("children", {}).get(name, 0)
+        if "is_pinned" in fields:
+            r["is_pinned"] = name in flags.get("pinned", {})
+        if "is_favourite" in fields:
+            r["is_favourite"] = name in flags.get("favourite", {})
+        if "share_count" in fields:
+            if name in flags.get("public", {}):
+                r["share_count"] = -2
+            elif name in flags.get("team", {}):
+                r["share_count"] = -1
+            else:
+                r["share_count"] = flags.get("share", {}).get(name, 0)
+        if "owner" in fields:
+            owner = owners.get(r.get("owner")) or {}
+            r["owner_full_name"] = owner.get("full_name") or r.get("owner")
+            r["owner_user_image"] = owner.get("user_image") or ""
+        if "team_name" in fields and r.get("team"):
+            r["team_name"] = teams.get(r["team"]) or r["team"]
+    return rows
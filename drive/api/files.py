@@ -1,14 +1,21 @@
-import os, re, json, mimetypes
+import os, re, io, json, mimetypes
 import unicodedata
 from frappe.utils import get_files_path
 import frappe
 from frappe import _
 from pypika import Order, functions as fn
-from .permissions import get_teams, get_user_access, user_has_permission, is_admin
+from .permissions import (
+    current_grant,
+    get_teams,
+    get_user_access,
+    user_has_permission,
+    is_admin,
+)
 from pathlib import Path
 from werkzeug.wrappers import Response
 from werkzeug.utils import secure_filename, send_file
 from io import BytesIO
+from contextlib import closing
 import mimemapper
 import jwt
 import boto3
@@ -28,11 +35,15 @@ from drive.utils.files import (
     if_folder_exists,
     FileManager,
 )
-from datetime import date, timedelta
+from datetime import timedelta
 import magic
 from datetime import datetime
 from drive.api.notifications import notify_mentions, notify_team_file_upload
-from drive.api.storage import storage_bar_data
+from drive.search.index import match_entities, queue_index, rank_key, title_position
+from drive.api.storage import storage_bar_data, track_usage
+from drive.api.trash import publish_trash_events, toggle_subtree
+from drive.api.purge import purge_entities
+from drive.utils.lineage import count_descendants, get_descendants, get_lineage, split_lineage
 from pathlib import Path
 from io import BytesIO
 from werkzeug.wrappers import Response
@@ -337,12 +348,12 @@ def get_thumbnail(entity_name):
     manager = FileManager()
 
     try:
-        thumbnail = manager.get_thumbnail(drive_file.team, entity_name)
-        thumbnail_data = BytesIO(thumbnail.read())
+        with closing(manager.get_thumbnail(drive_file.team, entity_name)) as thumbnail:
+            thumbnail_data = BytesIO(thumbnail.read())
     except FileNotFoundError:
         if drive_file.mime_type and drive_file.mime_type.startswith("text"):
             try:
-                with manager.get_file(drive_file.path) as f:
+                with closing(manager.get_file(drive_file.path)) as f:
                     thumbnail_data = (
                         f.read()[:1000].decode("utf-8").replace("\n", "<br/>")
                     )
@@ -660,9 +671,11 @@ def save_doc(
         frappe.db.get_value("Drive File", entity_name, "file_size") != int(file_size)
         and write_perms
     ):
-        frappe.db.set_value("Drive File", entity_name, "file_size", file_size)
+        with track_usage([entity_name]):
+            frappe.db.set_value("Drive File", entity_name, "file_size", file_size)
 
     create_new_entity_activity_log(entity_name, "edit")
+    queue_index([entity_name])
     if json.dumps(mentions):
         frappe.enqueue(
             notify_mentions,
@@ -794,6 +807,10 @@ def get_file_content(entity_name, trigger_download=0, jwt_token=None):
     else:
         manager = FileManager()
         file_path = manager.get_file(drive_file.path)
+        if isinstance(file_path, io.BufferedReader):
+            # Local blob: let send_file stat the path for Content-Length, ETag and Range
+            file_path.close()
+            file_path = file_path.name
 
         # ✅ FIX: Add X-Accel-Redirect for nginx to serve file directly
         # This sends response headers immediately, triggering "Save As" dialog
@@ -1114,38 +1131,13 @@ def delete_files_bulk(files, user):
 
 def get_all_descendants_recursive(parent_name, max_depth=50):
     """
-    Get ALL descendants in one recursive query - VERY FAST
-    Uses MySQL recursive CTE (Common Table Expression)
+    Get ALL descendants in one range query on the lineage index
+    (drive.utils.lineage); falls back to walking levels if the lineage is missing
     """
-    try:
-        # Use recursive query to get all descendants at once
-        result = frappe.db.sql(
-            """
-            WITH RECURSIVE descendants AS (
-                -- Base case: direct children
-                SELECT name, parent_entity, is_group
-                FROM `tabDrive File`
-                WHERE parent_entity = %(parent)s
-                
-                UNION ALL
-                
-                -- Recursive case: children of children
-                SELECT f.name, f.parent_entity, f.is_group
-                FROM `tabDrive File` f
-                INNER JOIN descendants d ON f.parent_entity = d.name
-                WHERE d.is_group = 1
-            )
-            SELECT name FROM descendants
-        """,
-            {"parent": parent_name},
-            as_list=True,
-        )
-
-        return [row[0] for row in result]
-
-    except Exception as e:
-        # Fallback to iterative approach if recursive CTE not supported
-        return get_all_descendants_iterative(parent_name, max_depth)
+    descendants = get_descendants(parent_name)
+    if descendants or get_lineage(parent_name):
+        return descendants
+    return get_all_descendants_iterative(parent_name, max_depth)
 
 
 def get_all_descendants_iterative(parent_name, max_depth=50):
@@ -1181,12 +1173,13 @@ def get_all_descendants_iterative(parent_name, max_depth=50):
 
 def bulk_delete_files(file_names, batch_size=500):
     """
-    BULK DELETE files using raw SQL - SUPER FAST
-    Deletes in batches to avoid too large queries
+    BULK DELETE files in batches: blobs, thumbnails and dependent rows go with
+    the Drive File rows (drive.api.purge.purge_entities)
     """
     if not file_names:
         return 0
 
+    manager = FileManager()
     total_deleted = 0
 
     # Delete in batches
@@ -1194,41 +1187,25 @@ def bulk_delete_files(file_names, batch_size=500):
         batch = file_names[i : i + batch_size]
 
         try:
-            # Delete from Drive File table
-            frappe.db.sql(
-                """
-                DELETE FROM `tabDrive File`
-                WHERE name IN %(names)s
-            """,
-                {"names": batch},
-            )
-
-            # Delete from Drive Entity table (if exists)
-            frappe.db.sql(
+            # Thư mục ở batch trước đã kéo theo cả cây con, chỉ lấy các dòng còn lại
+            rows = frappe.db.sql(
                 """
-                DELETE FROM `tabDrive Entity`
+                SELECT name, team, path, document, is_group
+                FROM `tabDrive File`
                 WHERE name IN %(names)s
             """,
                 {"names": batch},
-                ignore_ddl=True,
-            )
-
-            # Delete related permissions
-            frappe.db.sql(
-                """
-                DELETE FROM `tabDrive DocShare`
-                WHERE share_name IN %(names)s
-            """,
-                {"names": batch},
-                ignore_ddl=True,
+                as_dict=True,
             )
-
-            total_deleted += len(batch)
+            if rows:
+                deleted, _, _ = purge_entities(rows, manager)
+                total_deleted += deleted
 
             # Commit after each batch
             frappe.db.commit()
 
         except Exception as e:
+            frappe.db.rollback()
             frappe.log_error(
                 f"Bulk delete batch failed: {str(e)[:100]}", "Bulk Delete Batch"
             )
@@ -1484,214 +1461,13 @@ def remove_or_restore(team=None, entity_shortcuts=None, entity_names=None):
     :type entity_shortcuts: list[str]
     :param team: Team name
     """
-    if team:
-        storage_data = storage_bar_data(team)
-
     success_files = []  # Danh sách file xử lý thành công
     failed_files = []  # Danh sách file không có quyền
     storage_error_files = []  # Danh sách file lỗi do hết storage
     is_restore_operation = False  # Flag để track operation type
 
-    # ✅ Hàm đệ quy để lấy tất cả children
-    def get_all_children(entity_name):
-        """
-        Lấy tất cả children (files và folders) của một entity
-        Returns: list of entity names
-        """
-        children = frappe.db.get_all(
-            "Drive File", filters={"parent_entity": entity_name}, pluck="name"
-        )
-
-        all_descendants = list(children)  # Copy list
-
-        # Đệ quy lấy children của children
-        for child in children:
-            all_descendants.extend(get_all_children(child))
-
-        return all_descendants
-
-    # ✅ Hàm toggle is_active cho một entity và tất cả children của nó
-    def toggle_entity_and_children(doc, flag):
-        """
-        Toggle is_active cho entity và tất cả children
-        :param doc: Drive File document
-        :param flag: 0 (move to trash) hoặc 1 (restore)
-        """
-        nonlocal is_restore_operation
-        is_restore_operation = flag == 1
-
-        # ✅ Lấy danh sách users có permission TRƯỚC KHI move to trash
-        # (để emit event sau khi commit)
-        users_with_access = []
-        if flag == 0:  # Chỉ lấy khi move to trash
-            users_with_access = frappe.db.get_all(
-                "Drive Permission",
-                filters={"entity": doc.name},
-                fields=["user"],
-            )
-            # Thêm owner vào danh sách
-            all_users = set()
-            for perm in users_with_access:
-                if perm.user:
-                    all_users.add(perm.user)
-            if doc.owner:
-                all_users.add(doc.owner)
-            users_with_access = list(all_users)
-
-        # Xử lý entity hiện tại
-        if flag == 0:  # Move to trash
-            # Thêm vào global trash
-            existing_trash = frappe.db.exists(
-                {
-                    "doctype": "Drive Trash",
-                    "entity": doc.name,
-                    "user": frappe.session.user,
-                }
-            )
-            if not existing_trash:
-                frappe.get_doc(
-                    {
-                        "doctype": "Drive Trash",
-                        "entity": doc.name,
-                        "user": frappe.session.user,
-                        "team": doc.team,
-                        "path": doc.path,
-                        "trashed_on": frappe.utils.now(),
-                    }
-                ).insert()
-        else:  # Restore
-            # ✅ FIX: Lấy team từ doc để kiểm tra storage limit
-            file_team = doc.team
-            file_storage_data = storage_bar_data(file_team)
-
-            # ✅ FIX: Chuyển đổi đơn vị đúng
-            # limit từ storage_bar_data là GB, total_size là bytes
-            # Cần chuyển limit từ GB sang bytes: GB * 1024^3 = bytes
-            storage_data_limit_bytes = file_storage_data["limit"] * 1024 * 1024 * 1024
-
-            # Kiểm tra: (limit_bytes - total_size_bytes) < file_size_bytes
-            available_space = storage_data_limit_bytes - file_storage_data["total_size"]
-            if available_space < doc.file_size:
-                frappe.throw("You're out of storage!", ValueError)
-
-            # Xóa khỏi global trash
-            existing_trash = frappe.db.exists(
-                {
-                    "doctype": "Drive Trash",
-                    "entity": doc.name,
-                    "user": frappe.session.user,
-                }
-            )
-            if existing_trash:
-                frappe.delete_doc("Drive Trash", existing_trash)
-
-        # Update is_active
-        doc.is_active = flag
-
-        # Update parent folder size
-        if doc.parent_entity:
-            folder_size = frappe.db.get_value(
-                "Drive File", doc.parent_entity, "file_size"
-            )
-            if folder_size is not None:
-                frappe.db.set_value(
-                    "Drive File",
-                    doc.parent_entity,
-                    "file_size",
-                    folder_size + doc.file_size * (1 if flag else -1),
-                )
-
-        doc.flags.ignore_links = True
-        if flag == 1:  # Restore operation
-            doc.save(ignore_permissions=True)
-        else:
-            doc.save()
-
-        # ✅ Emit socket event khi file bị move to trash (flag=0)
-        if flag == 0 and users_with_access:
-            try:
-                message = {
-                    "entity_name": doc.name,
-                    "action": "moved_to_trash",
-                    "deleted": False,  # Not permanently deleted, just moved to trash
-                    "unshared": False,
-                    "reason": "File has been moved to trash",
-                    "timestamp": frappe.utils.now(),
-                }
-                frappe.publish_realtime(
-                    event="permission_revoked",
-                    message=message,
-                    after_commit=True,
-                )
-                print(f"📡 Emitted moved_to_trash event for file {doc.name}")
-                print(f"   Message: {message}")
-                print(f"   Users notified: {len(users_with_access)} users")
-            except Exception as e:
-                print(f"❌ Failed to emit moved_to_trash event: {str(e)}")
-                import traceback
-
-                traceback.print_exc()
-
-        # ✅ Nếu là folder, xử lý tất cả children
-        if doc.is_group:
-            all_children = get_all_children(doc.name)
-
-            for child_name in all_children:
-                try:
-                    child_doc = frappe.get_doc("Drive File", child_name)
-
-                    # Toggle is_active cho child
-                    if flag == 0:  # Move to trash
-                        # Thêm child vào trash
-                        existing_trash = frappe.db.exists(
-                            {
-                                "doctype": "Drive Trash",
-                                "entity": child_doc.name,
-                                "user": frappe.session.user,
-                            }
-                        )
-                        if not existing_trash:
-                            frappe.get_doc(
-                                {
-                                    "doctype": "Drive Trash",
-                                    "entity": child_doc.name,
-                                    "user": frappe.session.user,
-                                    "team": child_doc.team,
-                                    "path": child_doc.path,
-                                    "trashed_on": frappe.utils.now(),
-                                }
-                            ).insert()
-                    else:  # Restore
-                        # Xóa child khỏi trash
-                        existing_trash = frappe.db.exists(
-                            {
-                                "doctype": "Drive Trash",
-                                "entity": child_doc.name,
-                                "user": frappe.session.user,
-                            }
-                        )
-                        if existing_trash:
-                            frappe.delete_doc("Drive Trash", existing_trash)
-
-                    child_doc.is_active = flag
-
-                    if flag == 1:
-                        child_doc.flags.ignore_links = True
-                        child_doc.save(ignore_permissions=True)
-                    else:
-                        # Khi xóa children (cascade), KHÔNG update modified
-                        # Để giữ timestamp cũ hơn parent → logic trash phân biệt được
-                        frappe.db.set_value(
-                            "Drive File",
-                            child_doc.name,
-                            "is_active",
-                            flag,
-                            update_modified=False,  # ← Quan trọng!
-                        )
-
-                except Exception as e:
-                    frappe.log_error(f"Error processing child {child_name}: {str(e)}")
-                    continue
+    # Người dùng cần được báo khi file bị đưa vào thùng rác: {user: {entity names}}
+    recipients = {}
 
     # Process files
     if entity_names:
@@ -1744,14 +1520,13 @@ def remove_or_restore(team=None, entity_shortcuts=None, entity_names=None):
                     )
                 if has_permission:
                     # Toggle entity và tất cả children
+                    is_restore_operation = flag == 1
+                    frappe.db.savepoint("drive_trash_entity")
                     try:
-                        print(
-                            f"🔄 Starting toggle_entity_and_children for {doc.name} (flag={flag})"
-                        )
-                        toggle_entity_and_children(doc, flag)
-                        print(f"✅ Successfully processed {doc.name}")
+                        toggle_subtree(doc, flag, frappe.session.user, recipients)
                         success_files.append(doc.name)
                     except ValueError as e:
+                        frappe.db.rollback(save_point="drive_trash_entity")
                         # ✅ FIX: Phân biệt lỗi "out of storage" với các lỗi khác
                         error_str = str(e)
                         if "out of storage" in error_str.lower():
@@ -1769,6 +1544,7 @@ def remove_or_restore(team=None, entity_shortcuts=None, entity_names=None):
                             failed_files.append(failed_name)
                             print(f"❌ ValueError for {doc.name}: {error_str}")
                     except Exception as e:
+                        frappe.db.rollback(save_point="drive_trash_entity")
                         # Log lỗi chi tiết khi restore/xóa
                         import traceback
 
@@ -1889,6 +1665,7 @@ def remove_or_restore(team=None, entity_shortcuts=None, entity_names=None):
                 failed_files.append(failed_name)
                 continue
 
+    publish_trash_events(recipients)
     frappe.db.commit()
 
     # ✅ FIX: Trả về message phù hợp với operation và loại lỗi
@@ -2039,7 +1816,11 @@ def get_recent_files():
         .left_join(DriveFile)
         .on(DriveRecentFile.entity == DriveFile.name)
         .left_join(DrivePermission)
-        .on((DrivePermission.entity == DriveFile.name) & (DrivePermission.user == user))
+        .on(
+            (DrivePermission.entity == DriveFile.name)
+            & (DrivePermission.user == user)
+            & current_grant(DrivePermission)
+        )
         .select(
             DriveFile.name,
             DriveFile.title,
@@ -2419,37 +2200,6 @@ def does_entity_exist(name=None, parent_entity=None):
     return bool(result)
 
 
-def auto_delete_from_trash():
-    days_before = (date.today() - timedelta(days=30)).isoformat()
-    result = frappe.db.get_all(
-        "Drive File",
-        filters={"is_active": 0, "last_modified": ["<", days_before]},
-        fields=["name"],
-    )
-    delete_entities(result)
-
-
-def clear_deleted_files():
-    days_before = (date.today() - timedelta(days=30)).isoformat()
-    result = frappe.db.get_all(
-        "Drive File",
-        filters={"is_active": -1, "modified": ["<", days_before]},
-        fields=["name"],
-    )
-
-    result_shortcut = frappe.db.get_all(
-        "Drive Shortcut",
-        filters={"is_active": -1, "modified": ["<", days_before]},
-        fields=["name"],
-    )
-    for entity in result:
-        doc = frappe.get_doc("Drive File", entity, ignore_permissions=True)
-        doc.delete()
-    for entity in result_shortcut:
-        doc = frappe.get_doc("Drive Shortcut", entity, ignore_permissions=True)
-        doc.delete()
-
-
 @frappe.whitelist()
 def get_title(entity_name):
     """
@@ -2497,42 +2247,42 @@ def move(entities, new_parent=None, is_private=None, team=None):
 @frappe.whitelist()
 def search(query, team):
     """
-    Search với LIKE (hỗ trợ số và từ ngắn)
+    Search titles and contents through the inverted index (drive.search.index).
+    Khớp theo token/tiền tố, không phân biệt dấu; hỗ trợ số và từ ngắn.
     """
-    user = frappe.db.escape(frappe.session.user)
-    team = frappe.db.escape(team)
-    like_query = frappe.db.escape(f"%{query}%")
+    user = frappe.session.user
 
     try:
-        result = frappe.db.sql(
-            f"""
-        SELECT  `tabDrive File`.name,
-                `tabDrive File`.title,
-                `tabDrive File`.is_group,
-                `tabDrive File`.is_link,
-                `tabDrive File`.mime_type,
-                `tabDrive File`.document,
-                `tabDrive File`.color,
-                `tabUser`.name AS user_name,
-                `tabUser`.user_image,
-                `tabUser`.full_name
-        FROM `tabDrive File`
-        LEFT JOIN `tabUser` ON `tabDrive File`.`owner` = `tabUser`.`name`
-        WHERE `tabDrive File`.team = {team}
-            AND `tabDrive File`.`is_active` = 1
-            AND (`tabDrive File`.`owner` = {user} OR `tabDrive File`.is_private = 0)
-            AND `tabDrive File`.`parent_entity` <> ''
-            AND `tabDrive File`.`title` LIKE {like_query}
-        GROUP BY `tabDrive File`.`name`
-        ORDER BY 
-            CASE WHEN `tabDrive File`.`title` = {frappe.db.escape(query)} THEN 0
-                 WHEN `tabDrive File`.`title` LIKE {frappe.db.escape(f"{query}%")} THEN 1
-                 ELSE 2 END,
-            `tabDrive File`.`modified` DESC
-        LIMIT 50
-        """,
-            as_dict=1,
+        matches = match_entities(query, [team], user=user, member_teams=[team])
+        if not matches:
+            return []
+
+        DriveFile = frappe.qb.DocType("Drive File")
+        User = frappe.qb.DocType("User")
+        result = (
+            frappe.qb.from_(DriveFile)
+            .left_join(User)
+            .on(DriveFile.owner == User.name)
+            .select(
+                DriveFile.name,
+                DriveFile.title,
+                DriveFile.is_group,
+                DriveFile.is_link,
+                DriveFile.mime_type,
+                DriveFile.document,
+                DriveFile.color,
+                DriveFile.modified,
+                User.name.as_("user_name"),
+                User.user_image,
+                User.full_name,
+            )
+            .where(DriveFile.name.isin(list(matches)) & (DriveFile.team == team))
+        ).run(as_dict=True)
+
+        result.sort(
+            key=lambda r: rank_key(query, r.title, matches[r.name][0], r.modified)
         )
+        result = result[:50]
         for r in result:
             r["file_type"] = get_file_type(r)
         return result
@@ -2541,11 +2291,122 @@ def search(query, team):
         return {"error": str(e)}
 
 
+SHARED_TEAMS_TTL = 60
+
+
+def get_shared_teams(user):
+    """
+    Teams holding something shared with `user` directly or publicly. Grants are
+    inherited down the subtree and a subtree stays in its root's team, so these
+    teams bound where shared files can be; `$TEAM` grants only reach members,
+    whose teams are searched anyway. Cached briefly so every keystroke of a
+    typeahead does not re-read the permission table.
+    """
+    cache_key = f"drive_shared_teams:{user}"
+    teams = frappe.cache().get_value(cache_key)
+    if teams is None:
+        teams = frappe.db.sql_list(
+            """
+            SELECT DISTINCT f.team FROM `tabDrive Permission` p
+            JOIN `tabDrive File` f ON f.name = p.entity
+            WHERE p.user IN (%(user)s, '') AND p.read = 1 AND IFNULL(f.team, '') != ''
+              AND (p.valid_until IS NULL OR p.valid_until > %(now)s)
+            """,
+            {"user": user, "now": frappe.utils.now_datetime()},
+        )
+        frappe.cache().set_value(cache_key, teams, expires_in_sec=SHARED_TEAMS_TTL)
+    return teams
+
+
+@frappe.whitelist()
+def search_all(query, limit=20):
+    """
+    Typeahead search over every team of the user plus files shared with them.
+
+    Khớp tiền tố trên token của tiêu đề; xếp hạng theo: trùng khớp tiêu đề,
+    tiền tố, yêu thích, lần truy cập gần nhất (Drive Entity Log), điểm index.
+    """
+    user = frappe.session.user
+    limit = min(int(limit or 20), 50)
+
+    teams = get_teams(user)
+    scope = list(dict.fromkeys(teams + get_shared_teams(user)))
+    # Quyền (team, $TEAM, public, kế thừa từ thư mục cha) được lọc ngay trong truy vấn index
+    matches = match_entities(query, teams=scope, title_only=True, user=user, member_teams=teams)
+    if not matches:
+        return []
+
+    DriveFile = frappe.qb.DocType("Drive File")
+    DriveTeam = frappe.qb.DocType("Drive Team")
+    result = (
+        frappe.qb.from_(DriveFile)
+        .left_join(DriveTeam)
+        .on(DriveFile.team == DriveTeam.name)
+        .select(
+            DriveFile.name,
+            DriveFile.title,
+            DriveFile.team,
+            DriveTeam.title.as_("team_name"),
+            DriveFile.is_group,
+            DriveFile.is_link,
+            DriveFile.mime_type,
+            DriveFile.document,
+            DriveFile.color,
+            DriveFile.owner,
+            DriveFile.modified,
+        )
+        .where(DriveFile.name.isin(list(matches)))
+    ).run(as_dict=True)
+    if not result:
+        return []
+
+    names = [r.name for r in result]
+    last_seen = dict(
+        frappe.get_all(
+            "Drive Entity Log",
+            filters={"user": user, "entity_name": ["in", names]},
+            fields=["entity_name", "max(last_interaction) as last_interaction"],
+            group_by="entity_name",
+            as_list=True,
+        )
+    )
+    favourites = set(
+        frappe.get_all(
+            "Drive Favourite",
+            filters={"user": user, "entity": ["in", names]},
+            pluck="entity",
+        )
+    )
+
+    def sort_key(r):
+        seen = last_seen.get(r.name)
+        return (
+            title_position(query, r.title),
+            r.name not in favourites,
+            -(seen.timestamp() if seen else 0),
+            -matches[r.name][0],
+            -r.modified.timestamp(),
+        )
+
+    result.sort(key=sort_key)
+    result = result[:limit]
+    for r in result:
+        r["file_type"] = get_file_type(r)
+        r["is_favourite"] = r.name in favourites
+        r["shared"] = r.team not in teams
+        r["accessed"] = last_seen.get(r.name)
+    return result
+
+
 @frappe.whitelist()
 def get_ancestors_of(entity_name):
     """
     Return all parent nodes till the root node
     """
+    lineage = get_lineage(entity_name)
+    if lineage:
+        return split_lineage(lineage)[1:]
+
     # CONCAT_WS('/', t.title, gp.path),
     entity_name = frappe.db.escape(entity_name)
     result = frappe.db.sql(
@@ -2591,10 +2452,19 @@ def export_media(entity_name):
 
 
 def get_s3_signed_url(path, mime_type, expires_in=3600):
+    """
+    Presigned GET URL cho file trên S3.
+    URL được cache và dùng lại cho đến khi còn SIGNED_URL_REFRESH_MARGIN giây là hết hạn.
+    """
     from botocore.client import Config
 
+    cache_key = f"drive_s3_signed_url:{path}:{mime_type}:{expires_in}"
+    cached = frappe.cache().get_value(cache_key)
+    if cached:
+        return cached
+
     # Lấy settings từ Drive S3 Settings
-    settings = frappe.get_doc("Drive S3 Settings")
+    settings = frappe.get_cached_doc("Drive S3 Settings")
 
     s3 = boto3.client(
         "s3",
@@ -2608,11 +2478,37 @@ def get_s3_signed_url(path, mime_type, expires_in=3600):
     )
     bucket_name = settings.bucket  # SỬA từ frappe.conf.s3_bucket
 
-    return s3.generate_presigned_url(
+    signed_url = s3.generate_presigned_url(
         ClientMethod="get_object",
         Params={"Bucket": bucket_name, "Key": path, "ResponseContentType": mime_type},
         ExpiresIn=expires_in,
     )
+    reuse_for = expires_in - SIGNED_URL_REFRESH_MARGIN
+    if reuse_for > 0:
+        frappe.cache().set_value(cache_key, signed_url, expires_in_sec=reuse_for)
+    return signed_url
+
+
+SIGNED_URL_REFRESH_MARGIN = 600
+SIGNED_URL_MIME_TYPES = [
+    # Word
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "application/vnd.oasis.opendocument.text",
+    # Excel
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "application/vnd.oasis.opendocument.spreadsheet",
+    "link/googlesheets",
+    "application/vnd.apple.numbers",
+    "text/csv",
+    # PowerPoint
+    "application/vnd.ms-powerpoint",
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation",
+    "application/vnd.openxmlformats-officedocument.presentationml.slideshow",
+    "application/vnd.oasis.opendocument.presentation",
+    "application/vnd.ms-powerpoint.presentation.macroEnabled.12",
+]
 
 
 @frappe.whitelist()
@@ -2620,27 +2516,7 @@ def get_file_signed_url(docname: str):
     doc = frappe.get_doc("Drive File", docname)
     mime_type = doc.mime_type or ""
 
-    allowed_types = [
-        # Word
-        "application/msword",
-        "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-        "application/vnd.oasis.opendocument.text",
-        # Excel
-        "application/vnd.ms-excel",
-        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        "application/vnd.oasis.opendocument.spreadsheet",
-        "link/googlesheets",
-        "application/vnd.apple.numbers",
-        "text/csv",
-        # PowerPoint
-        "application/vnd.ms-powerpoint",
-        "application/vnd.openxmlformats-officedocument.presentationml.presentation",
-        "application/vnd.openxmlformats-officedocument.presentationml.slideshow",
-        "application/vnd.oasis.opendocument.presentation",
-        "application/vnd.ms-powerpoint.presentation.macroEnabled.12",
-    ]
-
-    if mime_type not in allowed_types:
+    if mime_type not in SIGNED_URL_MIME_TYPES:
         frappe.throw(_("Only .docx, .xlsx, .csv and .pptx files are supported."))
 
     # Tạo signed URL
@@ -2876,8 +2752,8 @@ def copy_file_or_folder(entity_name, is_private, new_parent=None, team=None):
                             print(f"🔄 Fallback: download + upload...")
 
                             # Download
-                            file_obj = manager.get_file(source_path)
-                            file_content = file_obj.read()
+                            with closing(manager.get_file(source_path)) as file_obj:
+                                file_content = file_obj.read()
 
                             print(f"✓ Downloaded {len(file_content)} bytes")
 
@@ -3039,8 +2915,8 @@ def copy_file_or_folder_background(
                             )
                         except Exception:
                             # Fallback
-                            file_obj = manager.get_file(source_path)
-                            file_content = file_obj.read()
+                            with closing(manager.get_file(source_path)) as file_obj:
+                                file_content = file_obj.read()
                             file_buffer = BytesIO(file_content)
 
                             manager.conn.put_object(
@@ -3124,20 +3000,7 @@ def count_items_recursive(entity_name):
     if not source.is_group:
         return 1
 
-    count = 1
-    children = frappe.get_all(
-        "Drive File",
-        filters={"parent_entity": entity_name, "is_active": 1},
-        fields=["name", "is_group"],
-    )
-
-    for child in children:
-        if child.is_group:
-            count += count_items_recursive(child.name)
-        else:
-            count += 1
-
-    return count
+    return 1 + count_descendants(entity_name, is_active=1)
 
 
 @frappe.whitelist()
@@ -3268,12 +3131,11 @@ def download_folder_as_zip(entity_name):
                             if child.get("path"):
                                 try:
                                     # For S3 files, download content and add to ZIP
-                                    file_content = manager.get_file(child["path"])
-                                    if file_content:
-                                        zf.writestr(arcname, file_content.read())
-                                        files_added_count += 1
-                                        print(f"  ✅ Added file from S3: {arcname}")
-                                        continue
+                                    with closing(manager.get_file(child["path"])) as source:
+                                        zf.writestr(arcname, source.read())
+                                    files_added_count += 1
+                                    print(f"  ✅ Added file from S3: {arcname}")
+                                    continue
                                 except Exception as e:
                                     print(
                                         f"  ⚠️ Error getting S3 file {child['title']}: {e}"
@@ -1,8 +1,10 @@
 import frappe
 import json
 import unicodedata
-from drive.utils.files import get_home_folder, MIME_LIST_MAP, get_file_type
-from .permissions import ENTITY_FIELDS, get_user_access, get_teams
+from drive.utils.files import get_home_folder, MIME_LIST_MAP
+from .permissions import ENTITY_FIELDS, current_grant, get_user_access, get_teams
+from .enrichment import enrich_entities, parse_fields
+from .shared_roots import ensure_shared_roots
 from pypika import Order, Criterion, functions as fn, CustomFunction
 from datetime import datetime, timedelta
 from frappe.query_builder import Case
@@ -36,28 +38,6 @@ DrivePinFile = frappe.qb.DocType("Drive Pin File")
 Binary = CustomFunction("BINARY", ["expression"])
 
 
-def get_pinned_files_set(user):
-    """
-    Get set of pinned file names for a user
-
-    Args:
-        user: User email
-
-    Returns:
-        set: Set of pinned file names
-    """
-    try:
-        pinned_query = (
-            frappe.qb.from_(DrivePinFile)
-            .where(DrivePinFile.user == user)
-            .select(DrivePinFile.drive_file)
-        )
-        return set(k[0] for k in pinned_query.run())
-    except Exception as e:
-        frappe.logger("pinned_files").error(f"Error getting pinned files set: {e}")
-        return set()
-
-
 @frappe.whitelist(allow_guest=True)
 def calculate_days_remaining(modified_date):
     """Calculate remaining time before permanent deletion
@@ -101,6 +81,7 @@ def files(
     only_parent=1,
     page=None,
     page_size=20,
+    exclude_fields=None,
 ):
     home = get_home_folder(team)["name"]
     field, ascending = order_by.split(" ")
@@ -134,7 +115,11 @@ def files(
         frappe.qb.from_(DriveFile)
         .where(DriveFile.is_active == is_active)
         .left_join(DrivePermission)
-        .on((DrivePermission.entity == DriveFile.name) & (DrivePermission.user == user))
+        .on(
+            (DrivePermission.entity == DriveFile.name)
+            & (DrivePermission.user == user)
+            & current_grant(DrivePermission)
+        )
         # Give defaults as a team member
         .select(
             *ENTITY_FIELDS,
@@ -267,63 +252,7 @@ def files(
     if folders:
         query = query.where(DriveFile.is_group == 1)
 
-    child_count_query = (
-        frappe.qb.from_(DriveFile)
-        .where((DriveFile.team == team) & (DriveFile.is_active == 1))
-        .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DriveFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DriveFile)
-        .right_join(DrivePermission)
-        .on(DrivePermission.entity == DriveFile.name)
-        .where((DrivePermission.user != "") & (DrivePermission.user != "$TEAM"))
-        .select(DriveFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DriveFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "")
-        .select(DrivePermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "$TEAM")
-        .select(DrivePermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
-
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
-
     res = query.run(as_dict=True)
-    for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in res if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in res:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
 
     if field in ["modified", "creation", "title", "file_size", "accessed"]:
         reverse = not ascending
@@ -357,7 +286,7 @@ def files(
 
             # Return paginated response with total count
             return {
-                "data": paginated_results,
+                "data": enrich_entities(paginated_results, parse_fields(exclude_fields)),
                 "total": total_count,
                 "page": page,
                 "page_size": page_size,
@@ -366,7 +295,7 @@ def files(
             # If page/page_size conversion fails, return all results as list
             pass
 
-    return res
+    return enrich_entities(res, parse_fields(exclude_fields))
 
 
 @frappe.whitelist()
@@ -376,6 +305,7 @@ def shared(
     limit=1000,
     tag_list=[],
     mime_type_list=[],
+    exclude_fields=None,
 ):
     """
     Returns the highest level of shared items shared with/by the current user, group or org
@@ -397,7 +327,11 @@ def shared(
             )
         )
         .limit(limit)
-        .where((DrivePermission.read == 1) & (DriveFile.is_active == 1))
+        .where(
+            (DrivePermission.read == 1)
+            & (DriveFile.is_active == 1)
+            & current_grant(DrivePermission)
+        )
         .select(
             *ENTITY_FIELDS,
             DriveFile.team,
@@ -431,68 +365,10 @@ def shared(
             )
         )
 
-    # Extremely inefficient
-    child_count_query = (
-        frappe.qb.from_(DriveFile)
-        .where((DriveFile.is_active == 1))
-        .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-        .groupby(DriveFile.parent_entity)
-    )
-    share_query = (
-        frappe.qb.from_(DriveFile)
-        .right_join(DrivePermission)
-        .on(DrivePermission.entity == DriveFile.name)
-        .where((DrivePermission.user != "") & (DrivePermission.user != "$TEAM"))
-        .select(DriveFile.name, fn.Count("*").as_("share_count"))
-        .groupby(DriveFile.name)
-    )
-    public_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "")
-        .select(DrivePermission.entity)
-    )
-    team_files_query = (
-        frappe.qb.from_(DrivePermission)
-        .where(DrivePermission.user == "$TEAM")
-        .select(DrivePermission.entity)
-    )
-    public_files = set(k[0] for k in public_files_query.run())
-    team_files = set(k[0] for k in team_files_query.run())
-
-    children_count = dict(child_count_query.run())
-    share_count = dict(share_query.run())
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(frappe.session.user)
-
     res = query.run(as_dict=True)
     parents = {r["name"] for r in res}
-
-    for r in res:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in res if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in res:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
-
-    return [r for r in res if r["parent_entity"] not in parents]
+    res = [r for r in res if r["parent_entity"] not in parents]
+    return enrich_entities(res, parse_fields(exclude_fields))
 
 
 def apply_favourite_join(query, favourites_only=False, has_shortcut_join=False):
@@ -577,6 +453,7 @@ def files_multi_team(
     page=None,
     page_size=50,
     search=None,
+    exclude_fields=None,
 ):
     """
     Lấy tệp từ nhiều nhóm với logic giống Google Drive
@@ -702,6 +579,7 @@ def files_multi_team(
                     .on(
                         (DrivePermission.entity == DriveFile.name)
                         & (DrivePermission.user == user)
+                        & current_grant(DrivePermission)
                     )
                     .select(
                         *ENTITY_FIELDS,
@@ -743,6 +621,7 @@ def files_multi_team(
                     .on(
                         (DrivePermission.entity == DriveFile.name)
                         & (DrivePermission.user == user)
+                        & current_grant(DrivePermission)
                     )
                     .select(
                         *ENTITY_FIELDS,
@@ -803,6 +682,7 @@ def files_multi_team(
                     .on(
                         (DrivePermission.entity == DriveFile.name)
                         & (DrivePermission.user == user)
+                        & current_grant(DrivePermission)
                     )
                     .select(
                         *ENTITY_FIELDS,
@@ -843,6 +723,7 @@ def files_multi_team(
                     .on(
                         (DrivePermission.entity == DriveFile.name)
                         & (DrivePermission.user == user)
+                        & current_grant(DrivePermission)
                     )
                     .select(
                         *ENTITY_FIELDS,
@@ -1162,84 +1043,9 @@ def files_multi_team(
 
     print(f"DEBUG - Total all_results: {len(all_results)}")
 
-    # Get child counts and share counts for all teams
-    if user_teams:
-        team_condition = Criterion.any(DriveFile.team == team for team in user_teams)
-        if personal == -3:
-            child_condition = DriveFile.is_active == 0
-        else:
-            child_condition = DriveFile.is_active == 1
-
-        child_count_query = (
-            frappe.qb.from_(DriveFile)
-            .where(team_condition & child_condition)
-            .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-            .groupby(DriveFile.parent_entity)
-        )
-        share_query = (
-            frappe.qb.from_(DriveFile)
-            .right_join(DrivePermission)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where(
-                (DrivePermission.user != "")
-                & (DrivePermission.user != "$TEAM")
-                & team_condition
-            )
-            .select(DriveFile.name, fn.Count("*").as_("share_count"))
-            .groupby(DriveFile.name)
-        )
-        public_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "") & team_condition)
-            .select(DrivePermission.entity)
-        )
-        team_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "$TEAM") & team_condition)
-            .select(DrivePermission.entity)
-        )
-
-        public_files = set(k[0] for k in public_files_query.run())
-        team_files = set(k[0] for k in team_files_query.run())
-        children_count = dict(child_count_query.run())
-        share_count = dict(share_query.run())
-    else:
-        public_files = set()
-        team_files = set()
-        children_count = {}
-        share_count = {}
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
-
-    # Add computed fields
-    for r in all_results:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in all_results if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in all_results:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
+    # Trash view counts trashed children
+    child_is_active = 0 if personal == -3 else 1
+    fields = parse_fields(exclude_fields)
 
     # Sort results - always prioritize folders first, regardless of sort direction
     reverse = not ascending
@@ -1327,7 +1133,9 @@ def files_multi_team(
 
             # Return paginated response with total count
             return {
-                "data": paginated_results,
+                "data": enrich_entities(
+                    paginated_results, fields, user=user, child_is_active=child_is_active
+                ),
                 "total": total_count,
                 "page": page,
                 "page_size": page_size,
@@ -1343,7 +1151,7 @@ def files_multi_team(
     print(f"DEBUG - Final all_results count: {len(all_results)}")
 
     # Return list for backward compatibility (when no pagination)
-    return all_results
+    return enrich_entities(all_results, fields, user=user, child_is_active=child_is_active)
 
 
 @frappe.whitelist()
@@ -1358,6 +1166,7 @@ def get_recent_files_multi_team(
     folders=0,
     page=None,
     page_size=20,
+    exclude_fields=None,
 ):
     """
     Lấy danh sách file gần đây mà user đã access
@@ -1414,7 +1223,11 @@ def get_recent_files_multi_team(
     query = (
         frappe.qb.from_(DriveFile)
         .left_join(DrivePermission)
-        .on((DrivePermission.entity == DriveFile.name) & (DrivePermission.user == user))
+        .on(
+            (DrivePermission.entity == DriveFile.name)
+            & (DrivePermission.user == user)
+            & current_grant(DrivePermission)
+        )
         .select(
             *ENTITY_FIELDS,
             DrivePermission.read,
@@ -1482,109 +1295,8 @@ def get_recent_files_multi_team(
         result["accessed"] = recent_dict.get(result["name"])
         result["_source"] = "recent"
 
-    # ✅ BƯỚC 4: Add team info cho mỗi file
-    team_names = list(set(r["team"] for r in all_results if r.get("team")))
-    team_info_map = {}
-
-    if team_names:
-        team_infos = frappe.get_all(
-            "Drive Team", filters={"name": ["in", team_names]}, fields=["name", "title"]
-        )
-        team_info_map = {t["name"]: t for t in team_infos}
-
-    for result in all_results:
-        team_name = result.get("team")
-        if team_name and team_name in team_info_map:
-            result["team_name"] = team_info_map[team_name]["title"]
-        else:
-            result["team_name"] = team_name
-
-    print(f"DEBUG - Results after adding team info: {len(all_results)}")
+    fields = parse_fields(exclude_fields)
 
-    # ✅ BƯỚC 5: Get child counts and share counts
-    if all_results:
-        result_teams = list(set(r["team"] for r in all_results if r.get("team")))
-
-        if result_teams:
-            team_condition = Criterion.any(
-                DriveFile.team == team for team in result_teams
-            )
-
-            child_count_query = (
-                frappe.qb.from_(DriveFile)
-                .where(team_condition & (DriveFile.is_active == 1))
-                .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-                .groupby(DriveFile.parent_entity)
-            )
-            share_query = (
-                frappe.qb.from_(DriveFile)
-                .right_join(DrivePermission)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where(
-                    (DrivePermission.user != "")
-                    & (DrivePermission.user != "$TEAM")
-                    & team_condition
-                )
-                .select(DriveFile.name, fn.Count("*").as_("share_count"))
-                .groupby(DriveFile.name)
-            )
-            public_files_query = (
-                frappe.qb.from_(DrivePermission)
-                .inner_join(DriveFile)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where((DrivePermission.user == "") & team_condition)
-                .select(DrivePermission.entity)
-            )
-            team_files_query = (
-                frappe.qb.from_(DrivePermission)
-                .inner_join(DriveFile)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where((DrivePermission.user == "$TEAM") & team_condition)
-                .select(DrivePermission.entity)
-            )
-
-            public_files = set(k[0] for k in public_files_query.run())
-            team_files = set(k[0] for k in team_files_query.run())
-            children_count = dict(child_count_query.run())
-            share_count = dict(share_query.run())
-        else:
-            public_files = set()
-            team_files = set()
-            children_count = {}
-            share_count = {}
-    else:
-        public_files = set()
-        team_files = set()
-        children_count = {}
-        share_count = {}
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
-
-    # Add computed fields
-    for r in all_results:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in all_results if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in all_results:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
 
     # ✅ BƯỚC 6: Sort by accessed time
     if field == "accessed":
@@ -1637,7 +1349,7 @@ def get_recent_files_multi_team(
 
             # Return paginated response with total count
             return {
-                "data": paginated_results,
+                "data": enrich_entities(paginated_results, fields, user=user),
                 "total": total_count,
                 "page": page,
                 "page_size": page_size,
@@ -1651,7 +1363,7 @@ def get_recent_files_multi_team(
         all_results = all_results[: int(limit)]
 
     print(f"DEBUG - Final results: {len(all_results)}")
-    return all_results
+    return enrich_entities(all_results, fields, user=user)
 
 
 @frappe.whitelist()
@@ -1666,6 +1378,7 @@ def get_favourites_multi_team(
     folders=0,
     page=None,
     page_size=20,
+    exclude_fields=None,
 ):
     """
     Lấy danh sách file/folder yêu thích của user
@@ -1732,6 +1445,7 @@ def get_favourites_multi_team(
             .on(
                 (DrivePermission.entity == DriveFile.name)
                 & (DrivePermission.user == user)
+                & current_grant(DrivePermission)
             )
             .select(
                 *ENTITY_FIELDS,
@@ -1821,6 +1535,7 @@ def get_favourites_multi_team(
             .on(
                 (DrivePermission.entity == DriveFile.name)
                 & (DrivePermission.user == user)
+                & current_grant(DrivePermission)
             )
             .select(
                 *ENTITY_FIELDS,
@@ -1903,107 +1618,8 @@ def get_favourites_multi_team(
 
     print(f"DEBUG - Total results before metadata: {len(all_results)}")
 
-    # ✅ BƯỚC 3: Add team info cho mỗi file
-    team_names = list(set(r["team"] for r in all_results if r.get("team")))
-    team_info_map = {}
+    fields = parse_fields(exclude_fields)
 
-    if team_names:
-        team_infos = frappe.get_all(
-            "Drive Team", filters={"name": ["in", team_names]}, fields=["name", "title"]
-        )
-        team_info_map = {t["name"]: t for t in team_infos}
-
-    for result in all_results:
-        team_name = result.get("team")
-        if team_name and team_name in team_info_map:
-            result["team_name"] = team_info_map[team_name]["title"]
-        else:
-            result["team_name"] = team_name
-
-    # ✅ BƯỚC 4: Get child counts and share counts
-    if all_results:
-        result_teams = list(set(r["team"] for r in all_results if r.get("team")))
-
-        if result_teams:
-            team_condition = Criterion.any(
-                DriveFile.team == team for team in result_teams
-            )
-
-            child_count_query = (
-                frappe.qb.from_(DriveFile)
-                .where(team_condition & (DriveFile.is_active == 1))
-                .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-                .groupby(DriveFile.parent_entity)
-            )
-            share_query = (
-                frappe.qb.from_(DriveFile)
-                .right_join(DrivePermission)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where(
-                    (DrivePermission.user != "")
-                    & (DrivePermission.user != "$TEAM")
-                    & team_condition
-                )
-                .select(DriveFile.name, fn.Count("*").as_("share_count"))
-                .groupby(DriveFile.name)
-            )
-            public_files_query = (
-                frappe.qb.from_(DrivePermission)
-                .inner_join(DriveFile)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where((DrivePermission.user == "") & team_condition)
-                .select(DrivePermission.entity)
-            )
-            team_files_query = (
-                frappe.qb.from_(DrivePermission)
-                .inner_join(DriveFile)
-                .on(DrivePermission.entity == DriveFile.name)
-                .where((DrivePermission.user == "$TEAM") & team_condition)
-                .select(DrivePermission.entity)
-            )
-
-            public_files = set(k[0] for k in public_files_query.run())
-            team_files = set(k[0] for k in team_files_query.run())
-            children_count = dict(child_count_query.run())
-            share_count = dict(share_query.run())
-        else:
-            public_files = set()
-            team_files = set()
-            children_count = {}
-            share_count = {}
-    else:
-        public_files = set()
-        team_files = set()
-        children_count = {}
-        share_count = {}
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
-
-    # Add computed fields
-    for r in all_results:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in all_results if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in all_results:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
 
     # ✅ BƯỚC 5: Sort results
     if field in ["modified", "creation", "title", "file_size", "favourite_date"]:
@@ -2050,7 +1666,7 @@ def get_favourites_multi_team(
 
             # Return paginated response with total count
             return {
-                "data": paginated_results,
+                "data": enrich_entities(paginated_results, fields, user=user),
                 "total": total_count,
                 "page": page,
                 "page_size": page_size,
@@ -2064,7 +1680,7 @@ def get_favourites_multi_team(
         all_results = all_results[: int(limit)]
 
     print(f"DEBUG - Final results: {len(all_results)}")
-    return all_results
+    return enrich_entities(all_results, fields, user=user)
 
 
 @frappe.whitelist()
@@ -2077,26 +1693,25 @@ def shared_multi_team(
     mime_type_list=[],
     page=None,
     page_size=20,
+    exclude_fields=None,
 ):
+    """
+    Shared view: top-level entities shared by (`by`=1) or with (`by`=0) the current user.
+
+    Đọc từ Drive Shared Root (drive.api.shared_roots) nên sắp xếp dùng index,
+    tổng số là chính xác và mỗi trang chỉ đọc đúng số dòng của trang đó.
+    """
     by = int(by)
     limit = int(limit)
+    current_user = frappe.session.user
+    ensure_shared_roots(current_user, by)
 
-    # Adjust limit if pagination is requested
-    # Need to fetch enough records to cover pagination offset AND account for top-level filtering
-    # Top-level filtering may remove some items, so we need extra buffer
-    # For better accuracy, fetch more records when pagination is used
     if page is not None:
         try:
             page = int(page)
             page_size = int(page_size) if page_size else 50
-            # Fetch enough records: (page * page_size) + large buffer for top-level filtering
-            # Use larger buffer (3x) to ensure we have enough after filtering
-            # Cap at 10000 to avoid performance issues
-            required_limit = min((page * page_size) + (page_size * 3), 10000)
-            if limit < required_limit:
-                limit = required_limit
         except (ValueError, TypeError):
-            pass
+            page = None
 
     # Parse tag_list và mime_type_list
     if tag_list and isinstance(tag_list, str):
@@ -2104,124 +1719,58 @@ def shared_multi_team(
     if mime_type_list and isinstance(mime_type_list, str):
         mime_type_list = json.loads(mime_type_list)
 
-    # Xây dựng WHERE conditions
-    where_conditions = []
-    query_params = {"current_user": frappe.session.user, "limit": limit}
-
-    # Tag filter
-    tag_join = ""
+    query_params = {"current_user": current_user, "by": by}
+    where_conditions = [
+        "sr.user = %(current_user)s",
+        "sr.shared_by = %(by)s",
+        "df.is_active = 1",
+        # Ẩn file có thư mục cha đã bị xoá
+        "(parent.name IS NULL OR parent.is_active = 1)",
+    ]
     if tag_list:
-        tag_join = "INNER JOIN `tabDrive Entity Tag` det ON det.parent = df.name"
-        tag_placeholders = ", ".join([f"%(tag_{i})s" for i in range(len(tag_list))])
-        where_conditions.append(f"det.tag IN ({tag_placeholders})")
-        for i, tag in enumerate(tag_list):
-            query_params[f"tag_{i}"] = tag
-
-    # MIME type filter
-    if mime_type_list:
-        mime_placeholders = ", ".join(
-            [f"%(mime_{i})s" for i in range(len(mime_type_list))]
+        where_conditions.append(
+            "EXISTS (SELECT 1 FROM `tabDrive Entity Tag` det"
+            " WHERE det.parent = df.name AND det.tag IN %(tags)s)"
         )
-        where_conditions.append(f"df.mime_type IN ({mime_placeholders})")
-        for i, mime in enumerate(mime_type_list):
-            query_params[f"mime_{i}"] = mime
-
-    where_clause = ""
-    if where_conditions:
-        where_clause = "AND " + " AND ".join(where_conditions)
+        query_params["tags"] = tuple(tag_list)
+    if mime_type_list:
+        where_conditions.append("df.mime_type IN %(mime_types)s")
+        query_params["mime_types"] = tuple(mime_type_list)
 
-    # Xử lý ORDER BY
-    order_clause = "ORDER BY accessed DESC"
+    # Xử lý ORDER BY: cột của Drive Shared Root có index, các cột khác lấy từ Drive File
+    order_field, direction = "accessed", "DESC"
     if order_by:
         order_parts = order_by.split()
-        order_field = order_parts[0]
+        order_field = order_parts[0].split("+")[0]
         is_desc = len(order_parts) > 1 and order_parts[1].lower() == "0"
         direction = "DESC" if is_desc else "ASC"
+    order_column = {
+        "accessed": "sr.accessed",
+        "title": "sr.title",
+        "modified": "sr.file_modified",
+        "creation": "df.creation",
+        "file_size": "df.file_size",
+    }.get(order_field, "sr.accessed")
+
+    from_clause = f"""
+        FROM `tabDrive Shared Root` sr
+        JOIN `tabDrive File` df ON df.name = sr.entity
+        LEFT JOIN `tabDrive File` parent ON parent.name = df.parent_entity
+        WHERE {" AND ".join(where_conditions)}
+    """
 
-        if "+" in order_field:
-            base_field = order_field.split("+")[0]
-            if order_field != "accessed":
-                order_clause = f"ORDER BY {base_field} + 0 {direction}"
-            else:
-                order_clause = f"ORDER BY accessed {direction}"
-        else:
-            order_clause = f"ORDER BY {order_field} {direction}"
-
-    # ✅ QUERY TỐI ƯU: Tách Entity Log ra để tránh GROUP BY toàn bộ bảng
-    # Trên server có nhiều data, GROUP BY toàn bộ tabDrive Entity Log rất chậm (50-60s)
-    # Giải pháp: Query chính trước, sau đó chỉ query Entity Log cho các entity đã lấy được
-    # Thay vì GROUP BY toàn bộ bảng, chỉ GROUP BY các entity trong kết quả (rất nhanh)
-
-    # Kiểm tra xem có cần Entity Log không (khi ORDER BY accessed)
-    # Chỉ query Entity Log khi ORDER BY accessed để tối ưu performance
-    need_entity_log = order_by and "accessed" in order_by.lower()
-
-    # Query chính không có Entity Log JOIN (nhanh hơn)
-    if by:
-        # by=1: Lấy files mà current_user là owner (share cho người khác)
-        # ✅ Tối ưu: Dùng subquery để tránh GROUP BY nhiều cột
-        main_query = f"""
-        SELECT 
-            df.name,
-            df.team,
-            df.title,
-            df.creation,
-            df.modified,
-            df.owner,
-            df.mime_type,
-            df.file_size,
-            df.parent_entity,
-            df.is_group,
-            df.is_active,
-            df.is_link,
-            df.document,
-            df.color,
-            df.is_private,
-            df.modified as accessed,
-            dp_sub.user,
-            dp_sub.owner as sharer,
-            dp_sub.`read`,
-            dp_sub.`share`,
-            dp_sub.`comment`,
-            dp_sub.`write`
-        FROM `tabDrive File` df
-        INNER JOIN (
-            SELECT 
-                entity,
-                MIN(user) as user,
-                MIN(owner) as owner,
-                MAX(`read`) as `read`,
-                MAX(`share`) as `share`,
-                MAX(`comment`) as `comment`,
-                MAX(`write`) as `write`
-            FROM `tabDrive Permission`
-            WHERE `read` = 1
-              AND owner = %(current_user)s
-            GROUP BY entity
-        ) dp_sub ON dp_sub.entity = df.name
-        {tag_join}
-        WHERE df.is_active = 1
-          {where_clause}
-        """
-        # Nếu không cần Entity Log, có thể ORDER BY và LIMIT ngay
-        if not need_entity_log:
-            main_query += f"""
-        {order_clause}
-        LIMIT %(limit)s
-        """
-        else:
-            # Cần Entity Log, lấy nhiều hơn để sau khi merge và sort vẫn đủ
-            # Fetch 3x limit để đảm bảo có đủ sau khi filter
-            adjusted_limit = limit * 3
-            main_query += f"""
-        LIMIT %(adjusted_limit)s
-        """
-            query_params["adjusted_limit"] = adjusted_limit
+    total_count = None
+    if page is not None:
+        query_params["offset"] = (page - 1) * page_size
+        query_params["limit"] = page_size
+        total_count = frappe.db.sql(f"SELECT COUNT(*) {from_clause}", query_params)[0][0]
     else:
-        # by=0: Lấy files được share cho current_user
-        # ✅ Tối ưu: Không cần GROUP BY vì mỗi user chỉ có 1 permission record
-        main_query = f"""
-        SELECT 
+        query_params["offset"] = 0
+        query_params["limit"] = limit
+
+    res = frappe.db.sql(
+        f"""
+        SELECT
             df.name,
             df.team,
             df.title,
@@ -2237,275 +1786,55 @@ def shared_multi_team(
             df.document,
             df.color,
             df.is_private,
-            df.modified as accessed,
-            dp.user,
-            dp.owner as sharer,
-            dp.`read`,
-            dp.`share`,
-            dp.`comment`,
-            dp.`write`
-        FROM `tabDrive File` df
-        INNER JOIN `tabDrive Permission` dp 
-            ON dp.entity = df.name 
-            AND dp.`read` = 1
-            AND dp.user = %(current_user)s
-        {tag_join}
-        WHERE df.is_active = 1
-          {where_clause}
-        """
-        # Nếu không cần Entity Log, có thể ORDER BY và LIMIT ngay
-        if not need_entity_log:
-            main_query += f"""
-        {order_clause}
-        LIMIT %(limit)s
-        """
-        else:
-            # Cần Entity Log, lấy nhiều hơn để sau khi merge và sort vẫn đủ
-            adjusted_limit = limit * 3
-            main_query += f"""
-        LIMIT %(adjusted_limit)s
-        """
-            query_params["adjusted_limit"] = adjusted_limit
-
-    # Execute main query
-    res = frappe.db.sql(main_query, query_params, as_dict=True)
-
-    # Nếu cần Entity Log, query chỉ cho các entity đã lấy được (rất nhanh)
-    if need_entity_log and res:
-        entity_names = tuple(r["name"] for r in res)
-        entity_log_query = """
-        SELECT 
-            entity_name,
-            MAX(last_interaction) as max_last_interaction
-        FROM `tabDrive Entity Log`
-        WHERE entity_name IN %(entity_names)s
-        GROUP BY entity_name
-        """
-        entity_log_results = frappe.db.sql(
-            entity_log_query, {"entity_names": entity_names}, as_dict=True
-        )
-
-        # Tạo dict để lookup nhanh
-        entity_log_map = {
-            row["entity_name"]: row["max_last_interaction"]
-            for row in entity_log_results
-        }
-
-        # Update accessed field cho các file có Entity Log
-        for r in res:
-            if r["name"] in entity_log_map:
-                r["accessed"] = entity_log_map[r["name"]]
-
-        # Sort lại theo accessed
-        order_parts = order_by.split()
-        order_field = order_parts[0]
-        is_desc = len(order_parts) > 1 and order_parts[1].lower() == "0"
-
-        res.sort(
-            key=lambda x: x.get("accessed") or x.get("modified") or "", reverse=is_desc
-        )
-
-        # Apply limit sau khi sort
-        res = res[:limit]
+            sr.accessed
+        {from_clause}
+        ORDER BY {order_column} {direction}, sr.entity
+        LIMIT %(offset)s, %(limit)s
+        """,
+        query_params,
+        as_dict=True,
+    )
 
     if not res:
+        if page is not None:
+            return {"data": [], "total": total_count, "page": page, "page_size": page_size}
         return []
 
-    print(f"🔍 Query returned {len(res)} files in main query")
-
-    # ✅ HIERARCHY CHECK SIÊU TỐI ƯU: Chỉ check parent trực tiếp, không recursive
-    # Lấy tất cả parent entities cần check
-    parent_entities = {r["parent_entity"] for r in res if r.get("parent_entity")}
-
-    if parent_entities:
-        # Chỉ check 1 level parent, không recursive (nhanh hơn rất nhiều)
-        parent_check_query = """
-        SELECT name, is_active
-        FROM `tabDrive File`
-        WHERE name IN %(parents)s
-        """
-
-        parent_status = frappe.db.sql(
-            parent_check_query, {"parents": list(parent_entities)}, as_dict=True
+    # Quyền của từng dòng trong trang
+    perm_column = DrivePermission.owner if by else DrivePermission.user
+    perms = (
+        frappe.qb.from_(DrivePermission)
+        .select(
+            DrivePermission.entity,
+            fn.Min(DrivePermission.user).as_("user"),
+            fn.Min(DrivePermission.owner).as_("sharer"),
+            fn.Max(DrivePermission.read).as_("read"),
+            fn.Max(DrivePermission.share).as_("share"),
+            fn.Max(DrivePermission.comment).as_("comment"),
+            fn.Max(DrivePermission.write).as_("write"),
         )
-
-        inactive_parents = {p["name"] for p in parent_status if not p.get("is_active")}
-
-        # Lọc bỏ các file có parent inactive
-        if inactive_parents:
-            print(
-                f"❌ Filtering out files with inactive parents: {len(inactive_parents)}"
-            )
-            res = [r for r in res if r.get("parent_entity") not in inactive_parents]
-
-    print(f"✅ Total files after hierarchy check: {len(res)}")
-
-    if not res:
-        return []
-
-    # ✅ BATCH QUERIES: Lấy tất cả thông tin bổ sung trong 1 lần
-    entity_names = tuple(r["name"] for r in res)
-    team_ids = tuple({r.get("team") for r in res if r.get("team")})
-
-    # Single mega query để lấy tất cả info cùng lúc
-    batch_query = """
-    SELECT 
-        'child' as info_type,
-        parent_entity as entity_name,
-        COUNT(*) as count_value
-    FROM `tabDrive File`
-    WHERE parent_entity IN %(entities)s
-      AND is_active = 1
-    GROUP BY parent_entity
-    
-    UNION ALL
-    
-    SELECT 
-        'share' as info_type,
-        entity as entity_name,
-        COUNT(*) as count_value
-    FROM `tabDrive Permission`
-    WHERE entity IN %(entities)s
-      AND user != ''
-      AND user != '$TEAM'
-    GROUP BY entity
-    
-    UNION ALL
-    
-    SELECT 
-        'public' as info_type,
-        entity as entity_name,
-        1 as count_value
-    FROM `tabDrive Permission`
-    WHERE entity IN %(entities)s
-      AND user = ''
-    
-    UNION ALL
-    
-    SELECT 
-        'team_shared' as info_type,
-        entity as entity_name,
-        1 as count_value
-    FROM `tabDrive Permission`
-    WHERE entity IN %(entities)s
-      AND user = '$TEAM'
-    """
-
-    batch_results = frappe.db.sql(batch_query, {"entities": entity_names}, as_dict=True)
-
-    # Map results
-    child_count = {}
-    share_count = {}
-    public_files = set()
-    team_shared_files = set()
-
-    for row in batch_results:
-        entity = row["entity_name"]
-        info_type = row["info_type"]
-
-        if info_type == "child":
-            child_count[entity] = row["count_value"]
-        elif info_type == "share":
-            share_count[entity] = row["count_value"]
-        elif info_type == "public":
-            public_files.add(entity)
-        elif info_type == "team_shared":
-            team_shared_files.add(entity)
-
-    # Get team info nếu cần
-    team_info = {}
-    if team_ids:
-        team_data = frappe.db.sql(
-            """
-            SELECT name, title
-            FROM `tabDrive Team`
-            WHERE name IN %(teams)s
-        """,
-            {"teams": team_ids},
-            as_dict=True,
+        .where(
+            DrivePermission.entity.isin([r["name"] for r in res])
+            & (perm_column == current_user)
+            & (DrivePermission.read == 1)
+            & current_grant(DrivePermission)
         )
-
-        team_info = {t["name"]: t for t in team_data}
-
-    # Get pinned files for current user
-    current_user = frappe.session.user if frappe.session.user != "Guest" else ""
-    pinned_files = get_pinned_files_set(current_user)
-
-    # Add additional information to results
+        .groupby(DrivePermission.entity)
+    ).run(as_dict=True)
+    perm_map = {p.pop("entity"): p for p in perms}
     for r in res:
-        r["children"] = child_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_shared_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
+        r.update(perm_map.get(r["name"], {}))
 
-        # Add team info
-        current_team = r.get("team")
-        if current_team and current_team in team_info:
-            r["team"] = team_info[current_team]["name"]
-            r["team_name"] = team_info[current_team]["title"]
-        else:
-            r["team"] = current_team
-            r["team_name"] = current_team
-
-    unique_owners = list(set(r.get("owner") for r in res if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in res:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
-
-    # Return only top-level items
-    parents = {r["name"] for r in res}
-    all_results = [
-        r
-        for r in res
-        if not r.get("parent_entity") or r["parent_entity"] not in parents
-    ]
-
-    # Calculate total count before pagination
-    total_count = len(all_results)
+    enrich_entities(res, parse_fields(exclude_fields))
 
-    # Apply page-based pagination if specified
     if page is not None:
-        try:
-            page = int(page)
-            page_size = int(page_size) if page_size else 50
-
-            # Calculate offset
-            offset = (page - 1) * page_size
-
-            # Apply pagination
-            paginated_results = all_results[offset : offset + page_size]
-
-            # Return paginated response with total count
-            return {
-                "data": paginated_results,
-                "total": total_count,
-                "page": page,
-                "page_size": page_size,
-            }
-        except (ValueError, TypeError):
-            # If page/page_size conversion fails, return all results as list
-            pass
-
-    # Apply limit if specified (for backward compatibility)
-    if limit:
-        all_results = all_results[: int(limit)]
-
-    # Return list for backward compatibility (when no pagination)
-    return all_results
+        return {
+            "data": res,
+            "total": total_count,
+            "page": page,
+            "page_size": page_size,
+        }
+    return res
 
 
 @frappe.whitelist()
@@ -2521,6 +1850,7 @@ def get_personal_files(
     file_kinds=[],
     folders=0,
     only_parent=1,
+    exclude_fields=None,
 ):
     """
     Lấy file cá nhân (My Drive) - file gốc và shortcuts thuộc về user
@@ -2623,6 +1953,7 @@ def get_personal_files(
                 .on(
                     (DrivePermission.entity == DriveFile.name)
                     & (DrivePermission.user == user)
+                    & current_grant(DrivePermission)
                 )
                 .select(
                     *ENTITY_FIELDS,
@@ -2654,6 +1985,7 @@ def get_personal_files(
                 .on(
                     (DrivePermission.entity == DriveFile.name)
                     & (DrivePermission.user == user)
+                    & current_grant(DrivePermission)
                 )
                 .select(
                     *ENTITY_FIELDS,
@@ -2835,82 +2167,8 @@ def get_personal_files(
     if not all_results:
         return []
 
-    # ✅ Get child counts and share counts
-    team_names = list(set(r["team"] for r in all_results if r.get("team")))
-
-    if team_names:
-        team_condition = Criterion.any(DriveFile.team == team for team in team_names)
-
-        child_count_query = (
-            frappe.qb.from_(DriveFile)
-            .where(team_condition & (DriveFile.is_active == 1))
-            .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-            .groupby(DriveFile.parent_entity)
-        )
-        share_query = (
-            frappe.qb.from_(DriveFile)
-            .right_join(DrivePermission)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where(
-                (DrivePermission.user != "")
-                & (DrivePermission.user != "$TEAM")
-                & team_condition
-            )
-            .select(DriveFile.name, fn.Count("*").as_("share_count"))
-            .groupby(DriveFile.name)
-        )
-        public_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "") & team_condition)
-            .select(DrivePermission.entity)
-        )
-        team_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "$TEAM") & team_condition)
-            .select(DrivePermission.entity)
-        )
-
-        public_files = set(k[0] for k in public_files_query.run())
-        team_files = set(k[0] for k in team_files_query.run())
-        children_count = dict(child_count_query.run())
-        share_count = dict(share_query.run())
-    else:
-        public_files = set()
-        team_files = set()
-        children_count = {}
-        share_count = {}
+    fields = parse_fields(exclude_fields)
 
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
-
-    # Add computed fields
-    for r in all_results:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in all_results if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in all_results:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
 
     # ✅ Sort results
     if field in ["modified", "creation", "title", "file_size", "accessed"]:
@@ -2955,7 +2213,7 @@ def get_personal_files(
         all_results = all_results[: int(limit)]
 
     print(f"DEBUG - Final results count after limit: {len(all_results)}")
-    return all_results
+    return enrich_entities(all_results, fields, user=user)
 
 
 @frappe.whitelist()
@@ -2972,6 +2230,7 @@ def get_trash_files(
     page=None,
     page_size=20,
     search=None,
+    exclude_fields=None,
 ):
     """
     Lấy file trong thùng rác (is_active=0) của user
@@ -3178,100 +2437,8 @@ def get_trash_files(
     if not all_results:
         return []
 
-    # ✅ BƯỚC 5: Add team info
-    team_names = list(set(r["team"] for r in all_results if r.get("team")))
-    team_info_map = {}
-
-    if team_names:
-        team_infos = frappe.get_all(
-            "Drive Team", filters={"name": ["in", team_names]}, fields=["name", "title"]
-        )
-        team_info_map = {t["name"]: t for t in team_infos}
-
-    for result in all_results:
-        team_name = result.get("team")
-        if team_name and team_name in team_info_map:
-            result["team_name"] = team_info_map[team_name]["title"]
-        else:
-            result["team_name"] = team_name
-
-    # ✅ BƯỚC 6: Get child counts and share counts
-    result_teams = list(set(r["team"] for r in all_results if r.get("team")))
-
-    if result_teams:
-        team_condition = Criterion.any(DriveFile.team == team for team in result_teams)
-
-        # Child count for trash: count deleted children
-        child_count_query = (
-            frappe.qb.from_(DriveFile)
-            .where(team_condition & (DriveFile.is_active == 0))
-            .select(DriveFile.parent_entity, fn.Count("*").as_("child_count"))
-            .groupby(DriveFile.parent_entity)
-        )
-        share_query = (
-            frappe.qb.from_(DriveFile)
-            .right_join(DrivePermission)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where(
-                (DrivePermission.user != "")
-                & (DrivePermission.user != "$TEAM")
-                & team_condition
-            )
-            .select(DriveFile.name, fn.Count("*").as_("share_count"))
-            .groupby(DriveFile.name)
-        )
-        public_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "") & team_condition)
-            .select(DrivePermission.entity)
-        )
-        team_files_query = (
-            frappe.qb.from_(DrivePermission)
-            .inner_join(DriveFile)
-            .on(DrivePermission.entity == DriveFile.name)
-            .where((DrivePermission.user == "$TEAM") & team_condition)
-            .select(DrivePermission.entity)
-        )
-
-        public_files = set(k[0] for k in public_files_query.run())
-        team_files = set(k[0] for k in team_files_query.run())
-        children_count = dict(child_count_query.run())
-        share_count = dict(share_query.run())
-    else:
-        public_files = set()
-        team_files = set()
-        children_count = {}
-        share_count = {}
-
-    # Get pinned files for current user
-    pinned_files = get_pinned_files_set(user)
+    fields = parse_fields(exclude_fields)
 
-    # Add computed fields
-    for r in all_results:
-        r["children"] = children_count.get(r["name"], 0)
-        r["file_type"] = get_file_type(r)
-        r["is_pinned"] = r["name"] in pinned_files
-        if r["name"] in public_files:
-            r["share_count"] = -2
-        elif r["name"] in team_files:
-            r["share_count"] = -1
-        else:
-            r["share_count"] = share_count.get(r["name"], 0)
-
-    unique_owners = list(set(r.get("owner") for r in all_results if r.get("owner")))
-    if unique_owners:
-        owner_names = frappe.get_all(
-            "User",
-            filters={"name": ["in", unique_owners]},
-            fields=["name", "full_name", "user_image"],
-        )
-        owner_map = {u["name"]: u for u in owner_names}
-        for r in all_results:
-            owner_info = owner_map.get(r.get("owner"), {})
-            r["owner_full_name"] = owner_info.get("full_name", r.get("owner"))
-            r["owner_user_image"] = owner_info.get("user_image", "")
 
     for r in all_results:
         # ✅ Calculate days remaining before permanent deletion
@@ -3332,7 +2499,7 @@ def get_trash_files(
                 f"DEBUG - Final trash results count: {len(paginated_results)}, total: {total_count}, total_pages: {total_pages}"
             )
             return {
-                "data": paginated_results,
+                "data": enrich_entities(paginated_results, fields, user=user, child_is_active=0),
                 "total": total_count,
                 "total_pages": total_pages,
                 "page": page,
@@ -3357,7 +2524,7 @@ def get_trash_files(
         all_results = all_results[: int(limit)]
 
     print(f"DEBUG - Final trash results count: {len(all_results)}")
-    return all_results
+    return enrich_entities(all_results, fields, user=user, child_is_active=0)
 
 
 def calculate_days_remaining(modified_datetime):
@@ -3551,6 +2718,7 @@ def get_all_accessible_folders(team=None):
                 .on(
                     (DrivePermission.entity == DriveFile.name)
                     & (DrivePermission.user == user)
+                    & current_grant(DrivePermission)
                 )
                 .select(
                     DriveFile.name,
@@ -3618,6 +2786,7 @@ def get_all_accessible_folders(team=None):
             .on(DrivePermission.entity == DriveFile.name)
             .where(
                 (DrivePermission.user == user)
+                & current_grant(DrivePermission)
                 & (DrivePermission.read == 1)
                 & (DriveFile.is_group == 1)
                 & (DriveFile.is_active == 1)
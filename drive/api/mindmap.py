@@ -6,13 +6,16 @@ from frappe import _
 import json
 import html
 
+from drive.utils import mindmap_codec
+
 
 @frappe.whitelist()
-def get_mindmap_data(entity_name):
+def get_mindmap_data(entity_name, encoding=None):
     """
     Lấy dữ liệu mindmap từ Drive File entity
 
     :param entity_name: Drive File entity name (NOT Drive Mindmap name)
+    :param encoding: "columnar-zlib" để nhận mindmap_data dạng nén (optional)
     :return: Mindmap data
     """
     try:
@@ -36,29 +39,15 @@ def get_mindmap_data(entity_name):
             frappe.throw(_("Mindmap document not found"), frappe.DoesNotExistError)
 
         # Parse mindmap_data
-        mindmap_data = doc.mindmap_data
-        if mindmap_data and isinstance(mindmap_data, str):
-            try:
-                mindmap_data = json.loads(mindmap_data)
-            except:
-                mindmap_data = None
+        mindmap_data = mindmap_codec.loads(doc.mindmap_data)
 
         if mindmap_data and mindmap_data.get("nodes"):
+            from drive.api.mindmap_comment import get_open_comment_counts
+
+            comment_counts = get_open_comment_counts(doc_drive.name)
             for node in mindmap_data.get("nodes", []):
                 node_id = node.get("id")
-                open_sessions = frappe.get_all(
-                    "Drive Mindmap Comment Session",
-                    filters={
-                        "mindmap_id": doc_drive.name,
-                        "node_id": node_id,
-                        "is_closed": 0,
-                    },
-                    fields=["comment_count"],
-                )
-
-                total = sum(s.get("comment_count", 0) for s in open_sessions)
-
-                node["count"] = total
+                node["count"] = comment_counts.get(node_id, 0)
 
                 # ⚠️ NEW: Sync trạng thái task với node nếu có taskLink
                 task_link = node.get("data", {}).get("taskLink") or node.get("taskLink")
@@ -140,6 +129,11 @@ def get_mindmap_data(entity_name):
             except:
                 collapsed_nodes = []
 
+        if mindmap_data and encoding:
+            if encoding != mindmap_codec.COMPACT_ENCODING:
+                frappe.throw(_("Unsupported mindmap encoding: {0}").format(encoding))
+            mindmap_data = mindmap_codec.encode(mindmap_data)
+
         return {
             "name": doc.name,
             "title": doc.title,
@@ -164,12 +158,13 @@ def get_mindmap_data(entity_name):
 
 
 @frappe.whitelist()
-def save_mindmap_data(entity_name, mindmap_data, **kwargs):
+def save_mindmap_data(entity_name, mindmap_data, encoding=None, **kwargs):
     """
     Lưu dữ liệu mindmap
 
     :param entity_name: Drive File entity name
     :param mindmap_data: JSON string hoặc dict
+    :param encoding: "columnar-zlib" nếu mindmap_data được gửi dạng nén (optional)
     """
     try:
         # Get Drive File
@@ -185,18 +180,9 @@ def save_mindmap_data(entity_name, mindmap_data, **kwargs):
         # Get Drive Mindmap
         doc = frappe.get_doc("Drive Mindmap", doc_drive.mindmap)
 
-        # Convert dict to JSON string
-        if isinstance(mindmap_data, dict):
-            mindmap_data_json = json.dumps(mindmap_data, ensure_ascii=False)
-        else:
-            mindmap_data_json = mindmap_data
-            mindmap_data = (
-                json.loads(mindmap_data)
-                if isinstance(mindmap_data, str)
-                else mindmap_data
-            )
+        mindmap_data = mindmap_codec.decode(mindmap_data, encoding)
 
-        doc.mindmap_data = mindmap_data_json
+        doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
         doc.save(ignore_permissions=True)
         frappe.db.commit()
 
@@ -393,7 +379,7 @@ def save_mindmap_layout(entity_name, nodes, edges, layout="vertical"):
         # Save as mindmap_data
         mindmap_data = {"nodes": nodes, "edges": edges, "layout": layout}
 
-        mindmap_doc.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+        mindmap_doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
         mindmap_doc.save(ignore_permissions=True)
         frappe.db.commit()
 
@@ -458,13 +444,7 @@ def save_mindmap_node(entity_name, node_id, node_data, edge_data=None):
             if edge_data and isinstance(edge_data, str):
                 edge_data = json.loads(edge_data)
 
-            current_data = {}
-            if mindmap_doc.mindmap_data:
-                current_data = (
-                    json.loads(mindmap_doc.mindmap_data)
-                    if isinstance(mindmap_doc.mindmap_data, str)
-                    else mindmap_doc.mindmap_data
-                )
+            current_data = mindmap_codec.loads(mindmap_doc.mindmap_data, {})
 
             nodes = current_data.get("nodes", [])
             edges = current_data.get("edges", [])
@@ -499,7 +479,7 @@ def save_mindmap_node(entity_name, node_id, node_data, edge_data=None):
                     edges.append(edge_data)
 
             mindmap_data = {"nodes": nodes, "edges": edges, "layout": layout}
-            mindmap_doc.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+            mindmap_doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
             mindmap_doc.save(ignore_permissions=True)
             frappe.db.commit()
 
@@ -591,13 +571,14 @@ def broadcast_node_editing(entity_name, node_id, is_editing):
 
 
 @frappe.whitelist()
-def save_mindmap_nodes_batch(entity_name, nodes_data, edges_data=None):
+def save_mindmap_nodes_batch(entity_name, nodes_data, edges_data=None, encoding=None):
     """
     Lưu nhiều nodes cùng lúc (batch operation)
 
     :param entity_name: Drive File entity name
     :param nodes_data: List các nodes cần lưu (JSON string hoặc list)
     :param edges_data: List các edges mới (optional, JSON string hoặc list)
+    :param encoding: "columnar-zlib" nếu nodes_data là payload nén chứa cả nodes và edges
     """
     max_retries = 3
     retry_count = 0
@@ -616,19 +597,17 @@ def save_mindmap_nodes_batch(entity_name, nodes_data, edges_data=None):
 
             mindmap_doc.reload()
 
-            if isinstance(nodes_data, str):
+            if encoding:
+                compact = mindmap_codec.decode(nodes_data, encoding)
+                nodes_data = compact["nodes"]
+                edges_data = compact["edges"] or None
+            elif isinstance(nodes_data, str):
                 nodes_data = json.loads(nodes_data)
 
             if edges_data and isinstance(edges_data, str):
                 edges_data = json.loads(edges_data)
 
-            current_data = {}
-            if mindmap_doc.mindmap_data:
-                current_data = (
-                    json.loads(mindmap_doc.mindmap_data)
-                    if isinstance(mindmap_doc.mindmap_data, str)
-                    else mindmap_doc.mindmap_data
-                )
+            current_data = mindmap_codec.loads(mindmap_doc.mindmap_data, {})
 
             nodes = current_data.get("nodes", [])
             edges = current_data.get("edges", [])
@@ -670,7 +649,7 @@ def save_mindmap_nodes_batch(entity_name, nodes_data, edges_data=None):
                         edges.append(edge_data)
 
             mindmap_data = {"nodes": nodes, "edges": edges, "layout": layout}
-            mindmap_doc.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+            mindmap_doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
             mindmap_doc.save(ignore_permissions=True)
             frappe.db.commit()
 
@@ -747,13 +726,7 @@ def delete_mindmap_nodes(entity_name, node_ids):
             if isinstance(node_ids, str):
                 node_ids = json.loads(node_ids)
 
-            current_data = {}
-            if mindmap_doc.mindmap_data:
-                current_data = (
-                    json.loads(mindmap_doc.mindmap_data)
-                    if isinstance(mindmap_doc.mindmap_data, str)
-                    else mindmap_doc.mindmap_data
-                )
+            current_data = mindmap_codec.loads(mindmap_doc.mindmap_data, {})
 
             nodes = current_data.get("nodes", [])
             edges = current_data.get("edges", [])
@@ -771,7 +744,7 @@ def delete_mindmap_nodes(entity_name, node_ids):
             ]
 
             mindmap_data = {"nodes": nodes, "edges": edges, "layout": layout}
-            mindmap_doc.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+            mindmap_doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
             mindmap_doc.save(ignore_permissions=True)
             frappe.db.commit()
 
@@ -814,55 +787,50 @@ def delete_mindmap_nodes(entity_name, node_ids):
             frappe.throw(str(e))
 
 
-@frappe.whitelist()
-def get_mindmap_tree_with_positions(parent_mindmap=None, layout="vertical"):
-    """
-    Lấy tree structure với positions tự động tính toán
+TREE_CACHE_PREFIX = "drive_mindmap_tree"
+TREE_FIELDS = ["name", "title", "is_group", "parent_mindmap", "color", "owner"]
 
-    :param parent_mindmap: Parent mindmap name
-    :param layout: "vertical" hoặc "horizontal"
-    :return: {nodes: [], edges: []} for VueFlow
+
+def _tree_cache_key(parent_mindmap):
+    return f"{TREE_CACHE_PREFIX}:{parent_mindmap or '__root__'}"
+
+
+def _get_tree_children(parent_mindmap):
     """
-    try:
-        # Get all mindmap nodes
+    Lấy các mindmap con trực tiếp của parent_mindmap (cached)
+    """
+
+    def fetch():
         if parent_mindmap:
-            nodes_data = frappe.db.get_all(
-                "Drive Mindmap",
-                filters={"parent_mindmap": parent_mindmap},
-                fields=[
-                    "name",
-                    "title",
-                    "is_group",
-                    "parent_mindmap",
-                    "color",
-                    "owner",
-                ],
-                order_by="title",
-            )
+            filters = {"parent_mindmap": parent_mindmap}
         else:
-            nodes_data = frappe.db.get_all(
-                "Drive Mindmap",
-                filters=[["parent_mindmap", "in", ["", None]]],
-                fields=[
-                    "name",
-                    "title",
-                    "is_group",
-                    "parent_mindmap",
-                    "color",
-                    "owner",
-                ],
-                order_by="title",
-            )
+            filters = [["parent_mindmap", "in", ["", None]]]
+        return frappe.db.get_all(
+            "Drive Mindmap", filters=filters, fields=TREE_FIELDS, order_by="title"
+        )
 
-        # Simple layout - vertical
-        nodes = []
-        edges = []
-        x_spacing = 250
-        y_spacing = 150
+    return frappe.cache().hget(
+        _tree_cache_key(parent_mindmap), "children", generator=fetch
+    )
 
-        for idx, node_data in enumerate(nodes_data):
-            # Create node
-            node = {
+
+def _compute_tree_positions(nodes_data, layout):
+    """
+    Tính positions cho các node con (pure function, không truy vấn DB)
+    """
+    nodes = []
+    edges = []
+    x_spacing = 250
+    y_spacing = 150
+
+    for idx, node_data in enumerate(nodes_data):
+        if layout == "horizontal":
+            position = {"x": 0, "y": idx * y_spacing}
+        else:
+            position = {"x": idx * x_spacing, "y": 0}
+
+        nodes.append(
+            {
                 "id": node_data["name"],
                 "type": "default",
                 "data": {
@@ -870,7 +838,7 @@ def get_mindmap_tree_with_positions(parent_mindmap=None, layout="vertical"):
                     "is_group": node_data["is_group"],
                     "color": node_data.get("color"),
                 },
-                "position": {"x": idx * x_spacing, "y": 0},
+                "position": position,
                 "style": {
                     "padding": "10px",
                     "borderRadius": "8px",
@@ -879,26 +847,90 @@ def get_mindmap_tree_with_positions(parent_mindmap=None, layout="vertical"):
                     "borderColor": "#0149C1",
                 },
             }
-            nodes.append(node)
+        )
 
-            # Create edge if has parent
-            if node_data.get("parent_mindmap"):
-                edge = {
+        # Create edge if has parent
+        if node_data.get("parent_mindmap"):
+            edges.append(
+                {
                     "id": f"edge-{node_data['parent_mindmap']}-{node_data['name']}",
                     "source": node_data["parent_mindmap"],
                     "target": node_data["name"],
                     "type": "smoothstep",
                     "animated": False,
                 }
-                edges.append(edge)
+            )
+
+    return {"nodes": nodes, "edges": edges, "layout": layout}
+
+
+def invalidate_mindmap_tree_cache(parent_mindmap):
+    """
+    Xóa cache tree/layout của parent_mindmap và tất cả ancestors.
+    Các subtree khác vẫn giữ cache.
+    """
+    seen = set()
+    current = parent_mindmap
+    while True:
+        frappe.cache().delete_key(_tree_cache_key(current))
+        if not current or current in seen:
+            break
+        seen.add(current)
+        current = frappe.db.get_value("Drive Mindmap", current, "parent_mindmap")
+
+
+@frappe.whitelist()
+def get_mindmap_tree_with_positions(parent_mindmap=None, layout="vertical"):
+    """
+    Lấy tree structure với positions tự động tính toán
 
-        return {"nodes": nodes, "edges": edges, "layout": layout}
+    :param parent_mindmap: Parent mindmap name
+    :param layout: "vertical" hoặc "horizontal"
+    :return: {nodes: [], edges: []} for VueFlow
+    """
+    try:
+        return frappe.cache().hget(
+            _tree_cache_key(parent_mindmap),
+            f"layout:{layout}",
+            generator=lambda: _compute_tree_positions(
+                _get_tree_children(parent_mindmap), layout
+            ),
+        )
 
     except Exception as e:
         frappe.log_error(f"Get tree positions error: {str(e)}")
         return {"nodes": [], "edges": [], "layout": layout}
 
 
+def _build_tree_structure(parent_mindmap):
+    tree = []
+    for child in _get_tree_children(parent_mindmap):
+        node = {
+            "name": child["name"],
+            "title": child["title"],
+            "is_group": child["is_group"],
+            "parent": child.get("parent_mindmap"),
+            "color": child.get("color"),
+            "owner": child["owner"],
+            "children": [],
+        }
+
+        # Get children recursively
+        if child["is_group"]:
+            node["children"] = _get_tree_structure(child["name"])
+
+        tree.append(node)
+    return tree
+
+
+def _get_tree_structure(parent_mindmap):
+    return frappe.cache().hget(
+        _tree_cache_key(parent_mindmap),
+        "structure",
+        generator=lambda: _build_tree_structure(parent_mindmap),
+    )
+
+
 @frappe.whitelist()
 def get_mindmap_tree_structure(parent_mindmap=None):
     """
@@ -906,55 +938,7 @@ def get_mindmap_tree_structure(parent_mindmap=None):
     Kept for backward compatibility
     """
     try:
-        if parent_mindmap:
-            children = frappe.db.get_all(
-                "Drive Mindmap",
-                filters={"parent_mindmap": parent_mindmap},
-                fields=[
-                    "name",
-                    "title",
-                    "is_group",
-                    "parent_mindmap",
-                    "color",
-                    "owner",
-                ],
-                order_by="title",
-            )
-        else:
-            children = frappe.db.get_all(
-                "Drive Mindmap",
-                filters=[["parent_mindmap", "in", ["", None]]],
-                fields=[
-                    "name",
-                    "title",
-                    "is_group",
-                    "parent_mindmap",
-                    "color",
-                    "owner",
-                ],
-                order_by="title",
-            )
-
-        # Build tree recursively
-        tree = []
-        for child in children:
-            node = {
-                "name": child["name"],
-                "title": child["title"],
-                "is_group": child["is_group"],
-                "parent": child.get("parent_mindmap"),
-                "color": child.get("color"),
-                "owner": child["owner"],
-                "children": [],
-            }
-
-            # Get children recursively
-            if child["is_group"]:
-                node["children"] = get_mindmap_tree_structure(child["name"])
-
-            tree.append(node)
-
-        return tree
+        return _get_tree_structure(parent_mindmap)
 
     except Exception as e:
         frappe.log_error(f"Get tree structure error: {str(e)}")
@@ -1013,7 +997,7 @@ def create_mindmap_entity(title, personal, team, content=None, parent=None):
 
     # Initialize mindmap_data với root node
     mindmap_data = {"nodes": [root_node], "edges": [], "layout": "custom"}
-    drive_mindmap.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+    drive_mindmap.mindmap_data = mindmap_codec.dumps(mindmap_data)
 
     drive_mindmap.insert()
     frappe.db.commit()
@@ -1112,7 +1096,7 @@ def import_mindmap_nextgrp(entity_name, nextgrp_data):
         }
 
         # Save mindmap_data
-        mindmap_doc.mindmap_data = json.dumps(mindmap_data, ensure_ascii=False)
+        mindmap_doc.mindmap_data = mindmap_codec.dumps(mindmap_data)
         mindmap_doc.save(ignore_permissions=True)
         frappe.db.commit()
 
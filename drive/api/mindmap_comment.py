@@ -4,6 +4,8 @@ from frappe import _
 from raven.raven_bot.doctype.raven_bot.raven_bot import RavenBot
 import bleach
 from frappe.utils import get_datetime, convert_utc_to_system_timezone
+from frappe.query_builder.functions import Sum
+from drive.api.notifications import get_full_names
 
 
 ALLOWED_TAGS = ["p", "br", "b", "i", "strong", "em", "img", "a", "span"]
@@ -13,47 +15,93 @@ ALLOWED_ATTRS = {
     "span": ["id", "label", "data-mention"],
 }
 
+COMMENT_LIST_FIELDS = ["name", "owner", "creation", "modified", "node_id", "session_index"]
+
+
 @frappe.whitelist()
-def get_comments(mindmap_id: str):
+def get_comments(
+    mindmap_id: str,
+    node_id: str | None = None,
+    start: int = 0,
+    page_length: int | None = None,
+    with_body: int = 1,
+):
+    """
+    Lấy comment thuộc các session đang mở của mindmap.
+    Lọc session đóng ngay trong DB (join với Drive Mindmap Comment Session).
+
+    :param node_id: chỉ lấy comment của node này (optional)
+    :param start: offset khi phân trang
+    :param page_length: số comment mỗi trang (mặc định lấy hết)
+    :param with_body: 0 để bỏ nội dung comment, lấy sau bằng get_comment_bodies
+    """
     if not mindmap_id:
         frappe.throw(_("Missing mindmap_id"))
 
-    # 1) Lấy toàn bộ session đang mở của mindmap đó
-    open_sessions = frappe.get_all(
-        "Drive Mindmap Comment Session",
-        filters={
-            "mindmap_id": mindmap_id,
-            "is_closed": 0
-        },
-        fields=["node_id", "session_index"]
+    if not frappe.has_permission("Drive File", "read", mindmap_id):
+        frappe.throw("No permission", frappe.PermissionError)
+
+    Comment = frappe.qb.DocType("Drive Mindmap Comment")
+    Session = frappe.qb.DocType("Drive Mindmap Comment Session")
+
+    fields = [Comment[f] for f in COMMENT_LIST_FIELDS]
+    if frappe.utils.cint(with_body):
+        fields.append(Comment.comment)
+
+    query = (
+        frappe.qb.from_(Comment)
+        .inner_join(Session)
+        .on(
+            (Session.mindmap_id == Comment.mindmap_id)
+            & (Session.node_id == Comment.node_id)
+            & (Session.session_index == Comment.session_index)
+        )
+        .select(*fields)
+        .where((Comment.mindmap_id == mindmap_id) & (Session.is_closed == 0))
+        .orderby(Comment.creation)
     )
+    if node_id:
+        query = query.where(Comment.node_id == node_id)
+    if page_length:
+        query = query.limit(frappe.utils.cint(page_length)).offset(frappe.utils.cint(start))
 
-    # Map: node_id → [session_index mở]
-    open_map = {}
-    for s in open_sessions:
-        open_map.setdefault(s.node_id, set()).add(s.session_index)
+    return query.run(as_dict=True)
 
-    # 2) Lấy toàn bộ comment và lọc ở Python
-    raw_comments = frappe.get_all(
-        "Drive Mindmap Comment",
-        filters={"mindmap_id": mindmap_id},
-        fields=["name", "comment", "owner", "creation",
-                "modified", "node_id", "session_index"],
-        order_by="creation asc",
-    )
 
-    filtered_comments = []
+@frappe.whitelist()
+def get_comment_bodies(mindmap_id: str, comment_names):
+    """
+    Lấy nội dung các comment (dùng cùng get_comments với with_body=0)
+    """
+    if isinstance(comment_names, str):
+        comment_names = json.loads(comment_names)
+    if not mindmap_id or not comment_names:
+        return {}
 
-    for c in raw_comments:
-        node_sessions = open_map.get(c.node_id, set())
+    if not frappe.has_permission("Drive File", "read", mindmap_id):
+        frappe.throw("No permission", frappe.PermissionError)
 
-        # Nếu session_index của comment KHÔNG nằm trong session đang mở → bỏ qua
-        if c.session_index not in node_sessions:
-            continue
+    rows = frappe.get_all(
+        "Drive Mindmap Comment",
+        filters={"mindmap_id": mindmap_id, "name": ["in", comment_names]},
+        fields=["name", "comment"],
+    )
+    return {r.name: r.comment for r in rows}
 
-        filtered_comments.append(c)
 
-    return filtered_comments
+def get_open_comment_counts(mindmap_id: str):
+    """
+    Tổng comment_count của các session đang mở, theo node_id (1 query)
+    """
+    Session = frappe.qb.DocType("Drive Mindmap Comment Session")
+    rows = (
+        frappe.qb.from_(Session)
+        .select(Session.node_id, Sum(Session.comment_count).as_("total"))
+        .where((Session.mindmap_id == mindmap_id) & (Session.is_closed == 0))
+        .groupby(Session.node_id)
+        .run(as_dict=True)
+    )
+    return {r.node_id: int(r.total or 0) for r in rows}
 
 
 @frappe.whitelist()
@@ -489,11 +537,9 @@ def edit_comment(mindmap_id: str, comment_id: str, comment: str):
 def notify_mentions(comment_name):
     doc = frappe.get_doc("Drive Mindmap Comment", comment_name)
 
-    mindmap_title = frappe.db.get_value(
-        "Drive File",
-        doc.mindmap_id,
-        "title",
-    )    
+    mindmap_title, team = frappe.db.get_value(
+        "Drive File", doc.mindmap_id, ["title", "team"]
+    ) or (None, None)
 
     # parse comment
     comment = doc.comment
@@ -531,7 +577,6 @@ def notify_mentions(comment_name):
     if not valid_users:
         return
 
-    team = frappe.db.get_value("Drive File", doc.mindmap_id, "team")
     if not team:
         return
 
@@ -543,10 +588,7 @@ def notify_mentions(comment_name):
         f"#comment_id={doc.name}"
     )
 
-    actor_full_name = (
-        frappe.db.get_value("User", doc.owner, "full_name")
-        or doc.owner
-    )
+    actor_full_name = get_full_names([doc.owner])[doc.owner]
 
     bot_docs = frappe.conf.get("bot_docs")
     if not bot_docs:
@@ -579,11 +621,9 @@ def notify_mentions(comment_name):
 def notify_comment(comment_name):
     doc = frappe.get_doc("Drive Mindmap Comment", comment_name)
 
-    mindmap_title = frappe.db.get_value(
-        "Drive File",
-        doc.mindmap_id,
-        "title",
-    )    
+    mindmap_title, team = frappe.db.get_value(
+        "Drive File", doc.mindmap_id, ["title", "team"]
+    ) or (None, None)
 
     # parse comment
     comment = doc.comment
@@ -616,10 +656,7 @@ def notify_comment(comment_name):
     # -------------------------------------------------
     # 2. ACTOR
     # -------------------------------------------------
-    actor_full_name = (
-        frappe.db.get_value("User", doc.owner, "full_name")
-        or doc.owner
-    )
+    actor_full_name = get_full_names([doc.owner])[doc.owner]
 
     # -------------------------------------------------
     # 3. SESSION MEMBERS
@@ -660,7 +697,6 @@ def notify_comment(comment_name):
     # -------------------------------------------------
     # 5. BUILD LINK
     # -------------------------------------------------
-    team = frappe.db.get_value("Drive File", doc.mindmap_id, "team")
     if not team:
         return
 
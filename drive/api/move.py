@@ -0,0 +1,401 @@
+"""
+Set-based team / privacy migration of a moved Drive File subtree, used by
+`DriveFile.move`.
+
+`migrate_subtree` reads the subtree once from the lineage index. It then
+rewrites `team` / `is_private` of the descendants, drops the subtree's
+permissions and moves search tokens and trash rows, with one statement per
+table. A move within the team only detaches grants copied from a folder outside
+the subtree (`detach_inherited_grants`). Usage counters get their deltas applied directly. All of it runs in the
+caller's transaction together with a journal entry (`frappe.db.set_global`)
+naming the moved root, so the rows and the journal commit or roll back as one.
+
+Blobs follow after commit in `relocate_blobs`, `CHUNK_SIZE` files at a time:
+
+1. take each file's save lock (drive.api.onlyoffice), skipping files being saved
+2. copy into the new team's home (S3 server-side copy / local hard link), in parallel
+3. point `path` at the copies and commit
+4. delete the originals, then release the locks
+
+Holding the save lock keeps an OnlyOffice save from writing to the old key
+between copy and delete. One relocation per subtree runs at a time (Redis lock).
+
+A crash at any step leaves every row pointing at an existing blob. The next
+run picks up the files whose path is still outside their team's home, and
+originals left behind are collected by the orphan reaper (drive.utils.blobs).
+`resume_moves` re-enqueues every open journal; the journal is cleared once the
+subtree has no misplaced blob left.
+"""
+
+import json
+import time
+
+import frappe
+
+from drive.api.shared_roots import invalidate_shared_roots, SHARED_BY_ME, SHARED_WITH_ME
+from drive.api.storage import apply_usage_deltas
+from drive.locks.distributed_lock import DistributedLock, FileLockedError
+from drive.search.index import update_search_team
+from drive.utils.files import FileManager
+from drive.utils.lineage import get_descendants, get_lineage, like_prefix
+
+CHUNK_SIZE = 500
+MAX_RUN_SECONDS = 20 * 60
+LOCK_TTL = 5 * 60
+JOURNAL_PREFIX = "drive_move_journal:"
+SUBTREE_FIELDS = [
+    "name",
+    "team",
+    "owner",
+    "is_private",
+    "mime_type",
+    "file_size",
+    "is_group",
+    "is_active",
+    "is_link",
+    "path",
+    "document",
+    "mindmap",
+]
+# Dòng có blob trong storage: link giữ URL trong path, document / mindmap lưu trong DB
+HAS_BLOB = """
+    f.is_group = 0 AND f.is_link = 0 AND IFNULL(f.path, '') != '' AND LOCATE('://', f.path) = 0
+    AND IFNULL(f.document, '') = '' AND IFNULL(f.mindmap, '') = ''
+"""
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def _publish_progress(entity, actor, phase, done=0, total=0):
+    frappe.publish_realtime(
+        event="drive_move_progress",
+        message={"entity_name": entity, "phase": phase, "done": done, "total": total},
+        user=actor,
+    )
+
+
+def _has_blob(row):
+    """Python twin of HAS_BLOB"""
+    return bool(
+        not row.is_group
+        and not row.is_link
+        and row.path
+        and "://" not in row.path
+        and not row.document
+        and not row.mindmap
+    )
+
+
+def _usage_deltas(rows, team, is_private):
+    """Usage changes of active files in `rows` moving to (`team`, `is_private`)"""
+    deltas = {}
+    for r in rows:
+        if r.is_group or r.is_active != 1:
+            continue
+        for key, sign in (
+            ((r.team, r.owner, int(r.is_private or 0), r.mime_type or ""), -1),
+            ((team, r.owner, int(is_private), r.mime_type or ""), 1),
+        ):
+            if not key[0]:
+                continue
+            size, count = deltas.get(key, (0, 0))
+            deltas[key] = (size + sign * int(r.file_size or 0), count + sign)
+    return deltas
+
+
+def clear_subtree_permissions(entity):
+    """Delete every Drive Permission on `entity` and below, refreshing the shared lists involved"""
+    lineage = get_lineage(entity)
+    params = {"prefix": like_prefix(lineage or ""), "entity": entity}
+    # lineage của entity bắt đầu bằng chính nó nên LIKE đã gồm cả entity
+    subtree = "f.lineage LIKE %(prefix)s" if lineage else "f.name = %(entity)s"
+    holders = frappe.db.sql(
+        f"""
+        SELECT DISTINCT p.user, p.owner FROM `tabDrive Permission` p
+        JOIN `tabDrive File` f ON f.name = p.entity
+        WHERE {subtree}
+        """,
+        params,
+    )
+    if not holders:
+        return
+    frappe.db.sql(
+        f"""
+        DELETE p FROM `tabDrive Permission` p
+        JOIN `tabDrive File` f ON f.name = p.entity
+        WHERE {subtree}
+        """,
+        params,
+    )
+    invalidate_shared_roots(
+        [(user, SHARED_WITH_ME) for user, _ in holders] + [(owner, SHARED_BY_ME) for _, owner in holders]
+    )
+
+
+def detach_inherited_grants(entity):
+    """
+    Clear `inherited_from` on the grants of `entity` and below that were copied
+    from a folder outside the subtree: after the move that folder is no longer
+    an ancestor, so the copies stay as the subtree's own grants.
+    """
+    lineage = get_lineage(entity)
+    params = {"prefix": like_prefix(lineage or ""), "entity": entity}
+    subtree = "f.lineage LIKE %(prefix)s" if lineage else "f.name = %(entity)s"
+    source = "src.lineage LIKE %(prefix)s" if lineage else "src.name = %(entity)s"
+    frappe.db.sql(
+        f"""
+        UPDATE `tabDrive Permission` p
+        JOIN `tabDrive File` f ON f.name = p.entity
+        LEFT JOIN `tabDrive File` src ON src.name = p.inherited_from AND {source}
+        SET p.inherited_from = NULL
+        WHERE {subtree} AND IFNULL(p.inherited_from, '') != '' AND src.name IS NULL
+        """,
+        params,
+    )
+
+
+def migrate_subtree(doc, team, is_private):
+    """
+    Move the descendants of `doc` to `team` / `is_private` and clear the
+    subtree's permissions; `doc` itself is left to the caller's save.
+
+    :return: True if anything changed
+    """
+    detach_inherited_grants(doc.name)
+    is_private = int(is_private or 0)
+    team_changed = team != doc.team
+    if not team_changed and is_private == int(doc.is_private or 0):
+        return False
+
+    clear_subtree_permissions(doc.name)
+    rows = get_descendants(doc.name, fields=SUBTREE_FIELDS)
+    lineage = get_lineage(doc.name)
+    if rows and lineage:
+        frappe.db.sql(
+            """
+            UPDATE `tabDrive File` SET team = %(team)s, is_private = %(is_private)s
+            WHERE lineage LIKE %(prefix)s AND name != %(entity)s
+            """,
+            {"team": team, "is_private": is_private, "prefix": like_prefix(lineage), "entity": doc.name},
+        )
+        apply_usage_deltas(_usage_deltas(rows, team, is_private))
+
+    if team_changed:
+        names = [doc.name] + [r.name for r in rows]
+        for chunk in _chunks(names):
+            update_search_team(chunk, team)
+            frappe.db.sql(
+                "UPDATE `tabDrive Trash` SET team = %(team)s WHERE entity IN %(names)s",
+                {"team": team, "names": tuple(chunk)},
+            )
+        if _has_blob(doc) or any(_has_blob(r) for r in rows):
+            open_journal(doc.name)
+    return True
+
+
+def open_journal(entity):
+    """Record the pending blob relocation of `entity` and start it once the move commits"""
+    frappe.db.set_global(
+        JOURNAL_PREFIX + entity,
+        json.dumps({"actor": frappe.session.user, "started": frappe.utils.now()}),
+    )
+    enqueue_relocation(entity)
+
+
+def enqueue_relocation(entity):
+    frappe.enqueue(
+        relocate_blobs,
+        queue="long",
+        job_id=f"drive_move_{entity}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        entity=entity,
+    )
+
+
+def get_misplaced_files(entity, after="", limit=CHUNK_SIZE, count=False):
+    """Files of the subtree whose blob is not yet under their team's home folder, in name order"""
+    lineage = get_lineage(entity)
+    if not lineage:
+        return 0 if count else []
+    columns = "COUNT(*)" if count else "f.name, f.path, h.name AS home"
+    rows = frappe.db.sql(
+        f"""
+        SELECT {columns}
+        FROM `tabDrive File` f
+        JOIN `tabDrive File` h ON h.team = f.team AND h.parent_entity IS NULL
+        WHERE f.lineage LIKE %(prefix)s AND {HAS_BLOB}
+          AND LEFT(f.path, CHAR_LENGTH(h.name) + 1) != CONCAT(h.name, '/')
+          AND f.name > %(after)s
+        {"" if count else "ORDER BY f.name LIMIT %(limit)s"}
+        """,
+        {"prefix": like_prefix(lineage), "after": after, "limit": limit},
+        as_dict=not count,
+    )
+    return rows[0][0] if count else rows
+
+
+def _relocated(path, home):
+    """`path` with its first segment (the old home folder) replaced by `home`"""
+    return f"{home}/{path.partition('/')[2]}"
+
+
+def _thumbnail(home, name):
+    return f"{home}/thumbnails/{name}.thumbnail"
+
+
+def relocate_chunk(rows, manager):
+    """
+    Copy, repoint and delete the blobs of `rows`, each under its save lock;
+    rows whose lock is held count as failed and are retried by a later run.
+    Rows whose blob does not exist at all cannot be copied and count as lost.
+
+    :return: (relocated, failed, lost)
+    """
+    from drive.api.onlyoffice import get_save_lock, resume_pending_save
+
+    locks = {}
+    for r in rows:
+        lock = get_save_lock(r.name)
+        try:
+            lock.acquire_write_lock()
+        except FileLockedError:
+            continue
+        locks[r.name] = lock
+    try:
+        relocated, lost = _relocate_locked([r for r in rows if r.name in locks], manager)
+    finally:
+        for name, lock in locks.items():
+            lock.release_write_lock()
+            resume_pending_save(name)
+    return relocated, len(rows) - relocated - lost, lost
+
+
+def _relocate_locked(rows, manager):
+    """:return: (relocated, lost)"""
+    if not rows:
+        return 0, 0
+    moves = {r.path: _relocated(r.path, r.home) for r in rows}
+    failed = set(manager.copy_files(moves.items()))
+    lost = len(manager.missing_files(failed)) if failed else 0
+    done = [r for r in rows if r.path not in failed]
+    if not done:
+        return 0, lost
+    old_thumbnails = [_thumbnail(r.path.partition("/")[0], r.name) for r in done]
+    # Thumbnail không bắt buộc: lỗi sao chép chỉ làm mất ảnh xem trước
+    manager.copy_files(
+        (old, _thumbnail(r.home, r.name)) for old, r in zip(old_thumbnails, done)
+    )
+
+    for home in {r.home for r in done}:
+        frappe.db.sql(
+            """
+            UPDATE `tabDrive File` f
+            JOIN `tabDrive File` h ON h.team = f.team AND h.parent_entity IS NULL
+            SET f.path = CONCAT(h.name, SUBSTRING(f.path, LOCATE('/', f.path)))
+            WHERE f.name IN %(names)s AND h.name = %(home)s
+            """,
+            {"names": tuple(r.name for r in done if r.home == home), "home": home},
+        )
+    frappe.db.commit()
+    manager.delete_files([r.path for r in done] + old_thumbnails)
+    return len(done), lost
+
+
+def relocate_blobs(entity):
+    """Background job: move the blobs of a moved subtree into its team's home folder"""
+    key = JOURNAL_PREFIX + entity
+    journal = frappe.db.get_global(key)
+    if not journal:
+        return
+    lock = DistributedLock(f"drive_move:{entity}", exclusive=True, ttl=LOCK_TTL, auto_renew=True)
+    try:
+        lock.acquire_write_lock()
+    except FileLockedError:
+        # Job khác (resume_moves hoặc job tiếp nối) đang chuyển cây con này
+        return
+    try:
+        finished = _relocate_subtree(entity, key, json.loads(journal).get("actor"))
+    finally:
+        lock.release_write_lock()
+    if not finished:
+        # Hết thời gian: chạy tiếp ở job mới, sau khi đã nhả lock
+        frappe.enqueue(relocate_blobs, queue="long", entity=entity)
+
+
+def _relocate_subtree(entity, key, actor):
+    """:return: False if the run stopped on MAX_RUN_SECONDS"""
+    started = time.monotonic()
+    manager = FileManager()
+    total = get_misplaced_files(entity, count=True)
+    after, done, failed, lost = "", 0, 0, 0
+
+    while time.monotonic() - started < MAX_RUN_SECONDS:
+        rows = get_misplaced_files(entity, after)
+        if not rows:
+            break
+        try:
+            relocated, errors, missing = relocate_chunk(rows, manager)
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(frappe.get_traceback(), "Drive move blobs")
+            relocated, errors, missing = 0, len(rows), 0
+        after = rows[-1].name
+        done += relocated
+        failed += errors
+        lost += missing
+        _publish_progress(entity, actor, "blobs", done, total)
+    else:
+        return False
+
+    if lost:
+        # Không có blob nguồn: thử lại cũng không được, không giữ journal vì chúng
+        frappe.logger().warning(f"relocate_blobs: {lost} file(s) of {entity} have no blob to move")
+    if failed:
+        # Giữ journal để resume_moves thử lại các blob lỗi
+        frappe.logger().warning(f"relocate_blobs: {failed} blob(s) of {entity} not moved")
+        return True
+    frappe.db.set_global(key, None)
+    frappe.db.commit()
+    _publish_progress(entity, actor, "done", done, total)
+    return True
+
+
+def get_open_journals():
+    return frappe.get_all(
+        "DefaultValue",
+        filters={"parent": "__global", "defkey": ["like", JOURNAL_PREFIX + "%"]},
+        pluck="defkey",
+    )
+
+
+def get_journal_keys():
+    """
+    Storage keys an open relocation may still be working on: current and target
+    blob and thumbnail of every misplaced file. The orphan reaper leaves them alone.
+    """
+    keys = set()
+    for journal in get_open_journals():
+        entity, after = journal[len(JOURNAL_PREFIX) :], ""
+        while rows := get_misplaced_files(entity, after):
+            for r in rows:
+                old_home = r.path.partition("/")[0]
+                keys.update(
+                    (r.path, _relocated(r.path, r.home), _thumbnail(old_home, r.name), _thumbnail(r.home, r.name))
+                )
+            after = rows[-1].name
+    return keys
+
+
+def resume_moves():
+    """Hourly scheduler: restart the blob relocation of every open move journal"""
+    for key in get_open_journals():
+        entity = key[len(JOURNAL_PREFIX) :]
+        if frappe.db.exists("Drive File", entity):
+            enqueue_relocation(entity)
+        else:
+            frappe.db.set_global(key, None)
+    frappe.db.commit()
@@ -2,6 +2,49 @@ import frappe
 import json
 from pypika import Order
 
+NOTIFICATION_QUEUE_KEY = "drive_notification_queue"
+UNREAD_COUNT_KEY = "drive_unread_notifications"
+UNREAD_COUNT_TTL = 6 * 60 * 60
+# INCRBY only when the counter is already cached; a missing counter is rebuilt from the DB.
+# Every change also bumps the user's generation (KEYS[2]) so a rebuild that counted
+# before the change does not store its stale value (see FILL_IF_UNCHANGED)
+INCR_IF_EXISTS = """
+redis.call('incr', KEYS[2])
+redis.call('expire', KEYS[2], ARGV[2])
+if redis.call('exists', KEYS[1]) == 1 then
+    return redis.call('incrby', KEYS[1], ARGV[1])
+end
+return nil
+"""
+# SET NX the counted value only if the generation is still the one read before COUNT
+FILL_IF_UNCHANGED = """
+if (redis.call('get', KEYS[2]) or '0') == ARGV[1] then
+    return redis.call('set', KEYS[1], ARGV[2], 'EX', ARGV[3], 'NX')
+end
+return nil
+"""
+NOTIFICATION_FLUSH_JOB = "drive_notification_flush"
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_FIELDS = [
+    "name",
+    "creation",
+    "modified",
+    "modified_by",
+    "owner",
+    "docstatus",
+    "from_user",
+    "to_user",
+    "read",
+    "type",
+    "message",
+    "notif_doctype",
+    "notif_doctype_name",
+    "entity_type",
+    "id_team",
+    "file_name",
+    "comment_id",
+]
+
 
 def get_link(entity):
     type_ = {True: "file", bool(entity.is_group): "folder", bool(entity.document): "document"}
@@ -94,31 +137,31 @@ def notify_team_folder_creation(entity_name):
 
         # Get current user info
         current_user = frappe.session.user
-        current_user_full_name = frappe.db.get_value("User", current_user, "full_name")
+        current_user_full_name = get_full_names([current_user])[current_user]
 
         message = f'{current_user_full_name} đã tạo một folder mới: "{entity.title}"'
 
         # Send notification to all team members except the current user
-        for member in team_members:
-            if member != current_user:
-                create_notification(
-                    from_user=current_user,
-                    to_user=member,
-                    type="Folder Creation",
-                    entity=entity,
-                    message=message,
-                )
+        queue_notifications(
+            from_user=current_user,
+            to_users=[m for m in team_members if m != current_user],
+            type="Folder Creation",
+            entity=entity,
+            message=message,
+        )
 
     except Exception as e:
         print(f"Error sending team folder notifications: {e}")
 
 
 @frappe.whitelist()
-def get_notifications(only_unread):
+def get_notifications(only_unread, start=0, page_length=None):
     """
     Get notifications for current user
 
     :param only_unread: only get notifications where read is False
+    :param start: offset of the page
+    :param page_length: number of notifications per page (default: all)
     """
     User = frappe.qb.DocType("User")
     Notification = frappe.qb.DocType("Drive Notification")
@@ -147,18 +190,85 @@ def get_notifications(only_unread):
     if only_unread:
         query = query.where(Notification.read == 0)
     query = query.where(Notification.to_user == frappe.session.user)
+    if page_length:
+        query = query.limit(frappe.utils.cint(page_length)).offset(frappe.utils.cint(start))
     result = query.run(as_dict=True)
     return result
 
 
+def _unread_key(user):
+    return frappe.cache().make_key(f"{UNREAD_COUNT_KEY}:{user}")
+
+
+def _generation_key(user):
+    return frappe.cache().make_key(f"{UNREAD_COUNT_KEY}:gen:{user}")
+
+
+def _bump_generations(pipe, users):
+    for user in users:
+        pipe.incr(_generation_key(user))
+        pipe.expire(_generation_key(user), UNREAD_COUNT_TTL)
+
+
+def _count_unread(user):
+    return frappe.db.count("Drive Notification", filters={"to_user": user, "read": 0})
+
+
+def get_cached_unread_count(user):
+    """
+    Unread count for a user, served from Redis and rebuilt from the DB on a miss
+    """
+    key = _unread_key(user)
+    cached = frappe.cache().get(key)
+    if cached is not None:
+        return max(int(cached), 0)
+    generation = frappe.cache().get(_generation_key(user)) or b"0"
+    count = _count_unread(user)
+    frappe.cache().eval(
+        FILL_IF_UNCHANGED, 2, key, _generation_key(user), generation, count, UNREAD_COUNT_TTL
+    )
+    return count
+
+
+def publish_unread_count(user, count=None):
+    if count is None:
+        count = get_cached_unread_count(user)
+    frappe.publish_realtime(
+        event="drive_notification:unread_count",
+        message={"count": count},
+        user=user,
+        after_commit=True,
+    )
+
+
+def update_unread_count(user, delta):
+    """
+    Atomically adjust a user's cached unread count and push the new value
+    """
+    count = frappe.cache().eval(
+        INCR_IF_EXISTS, 2, _unread_key(user), _generation_key(user), int(delta), UNREAD_COUNT_TTL
+    )
+    publish_unread_count(user, max(int(count), 0) if count is not None else None)
+
+
+def reset_unread_count(users):
+    """
+    Drop cached counters so they are rebuilt on the next read
+    """
+    users = [u for u in set(users) if u]
+    if users:
+        with frappe.cache().pipeline() as pipe:
+            pipe.delete(*[_unread_key(u) for u in users])
+            _bump_generations(pipe, users)
+            pipe.execute()
+
+
 @frappe.whitelist()
 def get_unread_count():
     """
     Return a count of records where user is current user and read is False
     """
-    return frappe.db.count(
-        "Drive Notification", filters={"to_user": frappe.session.user, "read": 0}
-    )
+    return get_cached_unread_count(frappe.session.user)
 
 
 @frappe.whitelist()
@@ -169,12 +279,21 @@ def mark_as_read(name=None, all=False):
     :param name: ID of notification record
     :param all: Will mark all unread notifications as read
     """
+    user = frappe.session.user
     if all:
-        frappe.db.set_value(
-            "Drive Notification", {"to_user": frappe.session.user, "read": False}, "read", True
-        )
+        frappe.db.set_value("Drive Notification", {"to_user": user, "read": False}, "read", True)
+        with frappe.cache().pipeline() as pipe:
+            pipe.set(_unread_key(user), 0, ex=UNREAD_COUNT_TTL)
+            _bump_generations(pipe, [user])
+            pipe.execute()
+        publish_unread_count(user, 0)
+        return
+    notif = frappe.db.get_value("Drive Notification", name, ["to_user", "read"], as_dict=True)
+    if not notif:
         return
     frappe.db.set_value("Drive Notification", name, "read", True)
+    if not notif.read:
+        update_unread_count(notif.to_user, -1)
     return
 
 
@@ -189,10 +308,13 @@ def notify_mentions(entity_name, document_name):
     if not document.mentions:
         return
     mentions = json.loads(document.mentions)
+    full_names = get_full_names(m["author"] for m in mentions)
+    by_author = {}
     for mention in mentions:
-        author_full_name = frappe.db.get_value("User", {"name": mention["author"]}, ["full_name"])
-        message = f' {author_full_name} mentioned you in document "{entity.title}"'
-        create_notification(mention["author"], mention["id"], "Mention", entity, message)
+        by_author.setdefault(mention["author"], []).append(mention["id"])
+    for author, to_users in by_author.items():
+        message = f' {full_names[author]} mentioned you in document "{entity.title}"'
+        queue_notifications(author, to_users, "Mention", entity, message)
 
 
 def notify_share(entity_name, docperm_name):
@@ -220,11 +342,11 @@ def notify_share(entity_name, docperm_name):
         entity = frappe.get_doc("Drive File", entity_name)
         docshare = frappe.get_doc("Drive Permission", docperm_name)
 
-        author_full_name = frappe.db.get_value("User", {"name": docshare.owner}, ["full_name"])
-        entity_type = "mindmap" if entity.mindmap else "document" if entity.document else "folder" if entity.is_group else  "file"
+        author_full_name = get_full_names([docshare.owner])[docshare.owner]
+        entity_type = get_entity_type(entity)
 
         message = f'{author_full_name} đã chia sẻ một {entity_type} với bạn: "{entity.title}"'
-        create_notification(docshare.owner, docshare.user, "Share", entity, message)
+        queue_notifications(docshare.owner, [docshare.user], "Share", entity, message)
 
     except frappe.DoesNotExistError as e:
         # Document đã bị xóa, bỏ qua không cần notify
@@ -236,6 +358,31 @@ def notify_share(entity_name, docperm_name):
         raise
 
 
+def get_entity_type(entity):
+    return (
+        "mindmap"
+        if entity.mindmap
+        else "document" if entity.document else "folder" if entity.is_group else "file"
+    )
+
+
+def get_full_names(users):
+    """
+    Resolve full names for a set of users in one query
+    :param users: iterable of user emails
+    :return: dict of user -> full name (falls back to the email)
+    """
+    users = {u for u in users if u}
+    if not users:
+        return {}
+    rows = frappe.get_all(
+        "User", filters={"name": ["in", list(users)]}, fields=["name", "full_name"]
+    )
+    full_names = {u: u for u in users}
+    full_names.update({r.name: r.full_name or r.name for r in rows})
+    return full_names
+
+
 def create_notification(from_user, to_user, type, entity, message=None, comment_id: str = None):
     """
     Create a notification
@@ -245,33 +392,174 @@ def create_notification(from_user, to_user, type, entity, message=None, comment_
     :param entity: drive_file name
     :param message: notification message
     """
-    from drive.api.permissions import get_user_access
+    queue_notifications(from_user, [to_user], type, entity, message, comment_id)
+
 
-    user_access = get_user_access(entity.name, to_user)
-    if user_access.get("read") == 0:
+def queue_notifications(from_user, to_users, type, entity, message=None, comment_id=None):
+    """
+    Queue one notification per recipient. Rows are written in bulk by
+    `flush_notification_queue`, so the caller never waits on inserts or bot calls.
+    The item is pushed only once the caller's transaction commits, so a rolled back
+    share or comment never notifies anyone.
+
+    :param to_users: iterable of receiver emails (duplicates are dropped)
+    :param entity: Drive File document (or its name)
+    """
+    to_users = list(dict.fromkeys(u for u in to_users if u))
+    if not to_users:
         return
-    entity_type = "mindmap" if entity.mindmap else "document" if entity.document else "folder" if entity.is_group else  "file"
-    notif = frappe.get_doc(
-        {
-            "doctype": "Drive Notification",
-            "from_user": from_user,
-            "to_user": to_user,
-            "type": type,
-            "entity_type": entity_type,
-            "notif_doctype": "Drive File",
-            "notif_doctype_name": entity.name,
-            "message": message,
-            "id_team": entity.team,
-            "file_name": entity.title,
-            "comment_id": comment_id if comment_id else "",
-        }
+    item = {
+        "from_user": from_user,
+        "to_users": to_users,
+        "type": type,
+        "entity": entity if isinstance(entity, str) else entity.name,
+        "message": message,
+        "comment_id": comment_id or "",
+    }
+    frappe.db.after_commit.add(lambda: _push_notification(json.dumps(item, default=str)))
+
+
+def _push_notification(raw):
+    frappe.cache().rpush(NOTIFICATION_QUEUE_KEY, raw)
+    frappe.enqueue(
+        flush_notification_queue,
+        queue="short",
+        job_id=NOTIFICATION_FLUSH_JOB,
+        deduplicate=True,
     )
-    try:
-        notif.insert()
-        print("========================= insert: ", flush=True)
-        print(f"Notification created: {notif.type}")
-    except frappe.exceptions.ValidationError as e:
-        print(f"Error inserting document: {e}")
+
+
+def _pop_notification_queue():
+    # LRANGE + LTRIM trong một MULTI: hai flusher chạy song song không lấy trùng item
+    key = frappe.cache().make_key(NOTIFICATION_QUEUE_KEY)
+    with frappe.cache().pipeline() as pipe:
+        pipe.lrange(key, 0, NOTIFICATION_BATCH_SIZE - 1)
+        pipe.ltrim(key, NOTIFICATION_BATCH_SIZE, -1)
+        items, _ = pipe.execute()
+    return items
+
+
+def _requeue_notifications(raw_items):
+    # Trả batch về đầu hàng đợi, giữ nguyên thứ tự
+    key = frappe.cache().make_key(NOTIFICATION_QUEUE_KEY)
+    with frappe.cache().pipeline() as pipe:
+        pipe.lpush(key, *reversed(raw_items))
+        pipe.execute()
+
+
+def flush_notification_queue():
+    """
+    Drain the notification queue in batches: drop duplicates and receivers without
+    read access, bulk insert Drive Notification rows, then send the RavenBot messages.
+    A batch whose insert fails is pushed back and retried by the next flush.
+    """
+    while True:
+        raw_items = _pop_notification_queue()
+        if not raw_items:
+            return
+        try:
+            rows = _insert_notifications([json.loads(i) for i in raw_items])
+        except Exception:
+            frappe.db.rollback()
+            _requeue_notifications(raw_items)
+            raise
+        _announce_notifications(rows)
+
+
+def _insert_notifications(items):
+    from drive.api.permissions import get_user_access
+
+    entities = {
+        e.name: e
+        for e in frappe.get_all(
+            "Drive File",
+            filters={"name": ["in", list({i["entity"] for i in items})]},
+            fields=["name", "title", "team", "mindmap", "document", "is_group"],
+        )
+    }
+
+    now = frappe.utils.now()
+    seen = set()
+    access_cache = {}
+    rows = []
+    for item in items:
+        entity = entities.get(item["entity"])
+        if not entity:
+            continue
+        for to_user in item["to_users"]:
+            key = (to_user, item["type"], entity.name, item["comment_id"])
+            if key in seen:
+                continue
+            seen.add(key)
+
+            if (entity.name, to_user) not in access_cache:
+                access_cache[(entity.name, to_user)] = get_user_access(entity.name, to_user)
+            if access_cache[(entity.name, to_user)].get("read") == 0:
+                continue
+
+            rows.append(
+                frappe._dict(
+                    name=frappe.generate_hash(length=10),
+                    creation=now,
+                    modified=now,
+                    modified_by=item["from_user"],
+                    owner=item["from_user"],
+                    docstatus=0,
+                    from_user=item["from_user"],
+                    to_user=to_user,
+                    read=0,
+                    type=item["type"],
+                    message=item["message"],
+                    notif_doctype="Drive File",
+                    notif_doctype_name=entity.name,
+                    entity_type=get_entity_type(entity),
+                    id_team=entity.team,
+                    file_name=entity.title,
+                    comment_id=item["comment_id"],
+                )
+            )
+
+    if rows:
+        frappe.db.bulk_insert(
+            "Drive Notification",
+            NOTIFICATION_FIELDS,
+            [[r[f] for f in NOTIFICATION_FIELDS] for r in rows],
+            chunk_size=500,
+        )
+        frappe.db.commit()
+    return rows
+
+
+def _announce_notifications(rows):
+    from drive.drive.doctype.drive_notification.drive_notification import (
+        send_raven_notification,
+    )
+
+    if not rows:
+        return
+    per_user = {}
+    for r in rows:
+        per_user[r.to_user] = per_user.get(r.to_user, 0) + 1
+    for user, delta in per_user.items():
+        update_unread_count(user, delta)
+
+    full_names = get_full_names({r.from_user for r in rows} | {r.to_user for r in rows})
+    comment_ids = list({r.comment_id for r in rows if r.comment_id})
+    comments = {
+        c.name: c
+        for c in (
+            frappe.get_all(
+                "Comment", filters={"name": ["in", comment_ids]}, fields=["name", "content"]
+            )
+            if comment_ids
+            else []
+        )
+    }
+    for row in rows:
+        try:
+            send_raven_notification(row, full_names, comments)
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), "Drive Notification Bot Error")
 
 
 def notify_comment_mentions(entity_name, comment_doc, mentions):
@@ -282,19 +570,16 @@ def notify_comment_mentions(entity_name, comment_doc, mentions):
     :param mentions: List of mentions from frontend
     """
     entity = frappe.get_doc("Drive File", entity_name)
-    for mention in mentions:
-        author_full_name = frappe.db.get_value(
-            "User", {"name": comment_doc.comment_email}, ["full_name"]
-        )
-        message = f'{author_full_name} đã đề cập đến bạn trong bình luận "{entity.title}"'
-        create_notification(
-            comment_doc.comment_email,
-            mention["id"],
-            "Mention",
-            entity,
-            message,
-            comment_id=comment_doc.name,
-        )
+    author_full_name = get_full_names([comment_doc.comment_email])[comment_doc.comment_email]
+    message = f'{author_full_name} đã đề cập đến bạn trong bình luận "{entity.title}"'
+    queue_notifications(
+        comment_doc.comment_email,
+        [mention["id"] for mention in mentions],
+        "Mention",
+        entity,
+        message,
+        comment_id=comment_doc.name,
+    )
 
 
 def notify_comment_to_owner_file(entity_name, comment_doc, owner_email):
@@ -303,9 +588,7 @@ def notify_comment_to_owner_file(entity_name, comment_doc, owner_email):
     """
     entity = frappe.get_doc("Drive File", entity_name)
 
-    author_full_name = frappe.db.get_value(
-        "User", {"name": comment_doc.comment_email}, ["full_name"]
-    )
+    author_full_name = get_full_names([comment_doc.comment_email])[comment_doc.comment_email]
     message = f'{author_full_name} đã bình luận trong file "{entity.title}"'
     create_notification(
         comment_doc.comment_email,
@@ -323,20 +606,16 @@ def notify_comment_to_all_members(entity_name, comment_doc, team_members):
     """
     entity = frappe.get_doc("Drive File", entity_name)
 
-    author_full_name = frappe.db.get_value(
-        "User", {"name": comment_doc.comment_email}, ["full_name"]
-    )
+    author_full_name = get_full_names([comment_doc.comment_email])[comment_doc.comment_email]
     message = f'{author_full_name} đã bình luận trong file "{entity.title}"'
-    for member in team_members:
-        if member != comment_doc.comment_email:
-            create_notification(
-                comment_doc.comment_email,
-                member,
-                "To Owner File",
-                entity,
-                message,
-                comment_id=comment_doc.name,
-            )
+    queue_notifications(
+        comment_doc.comment_email,
+        [m for m in team_members if m != comment_doc.comment_email],
+        "To Owner File",
+        entity,
+        message,
+        comment_id=comment_doc.name,
+    )
 
 
 def notify_reply_comment(entity_name, comment_doc, reply_email):
@@ -345,9 +624,7 @@ def notify_reply_comment(entity_name, comment_doc, reply_email):
     """
     entity = frappe.get_doc("Drive File", entity_name)
 
-    author_full_name = frappe.db.get_value(
-        "User", {"name": comment_doc.comment_email}, ["full_name"]
-    )
+    author_full_name = get_full_names([comment_doc.comment_email])[comment_doc.comment_email]
     message = f'{author_full_name} đã trả lời bình luận "{entity.title}"'
     create_notification(
         comment_doc.comment_email,
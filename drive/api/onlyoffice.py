@@ -7,6 +7,23 @@ from frappe.utils.background_jobs import enqueue
 import hashlib
 import json
 
+from drive.api.files import SIGNED_URL_MIME_TYPES
+from drive.search.extract import queue_extraction
+from drive.api.storage import track_usage
+
+# (connect, read) timeout khi tải file đã chỉnh sửa từ OnlyOffice
+DOWNLOAD_TIMEOUT = (5, 60)
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+UPLOAD_CONCURRENCY = 4
+# OnlyOffice save queue
+SAVE_DEDUPE_TTL = 24 * 60 * 60
+SAVE_JOB_TIMEOUT = 900
+SAVE_MAX_ATTEMPTS = 3
+
+_http_session = None
+_s3_clients = {}
+
 
 @frappe.whitelist()
 def get_onlyoffice_url():
@@ -19,140 +36,152 @@ def get_onlyoffice_url():
     return onlyoffice_url.rstrip("/")
 
 
-@frappe.whitelist()
-def get_editor_config(entity_name):
+EDITOR_CONFIG_TTL = 30 * 60
+EDITOR_FILE_FIELDS = ["name", "title", "path", "mime_type", "owner", "creation", "onlyoffice_version"]
+
+
+def get_permission_tier(entity):
     """
-    Build OnlyOffice editor config with optimized settings for smooth collaboration
+    owner / edit / view, hoặc None nếu không có quyền đọc.
+    Chỉ gọi has_permission "read" khi user không có quyền write.
     """
-    try:
-        print(f"=== Getting editor config for: {entity_name} ===")
+    if entity.owner == frappe.session.user:
+        return "owner"
+    if has_edit_permission(entity.name):
+        return "edit"
+    if frappe.has_permission("Drive File", doc=entity.name, ptype="read"):
+        return "view"
+    return None
 
-        entity = frappe.get_doc("Drive File", entity_name)
 
-        # Xác định ai là chủ file
-        is_owner = entity.owner == frappe.session.user
-        has_edit = has_edit_permission(entity_name)
+def _editor_config_cache_key(entity, document_key, tier):
+    fingerprint = hashlib.md5(
+        f"{entity.title}|{entity.path}|{entity.mime_type}".encode()
+    ).hexdigest()[:8]
+    return f"drive_onlyoffice_config:{entity.name}:{document_key}:{tier}:{fingerprint}"
 
-        print(f"👤 Current user: {frappe.session.user}")
-        print(f"📄 File owner: {entity.owner}")
-        print(f"🔑 Is owner: {is_owner}")
-        print(f"✏️  Has edit permission: {has_edit}")
 
-        if not frappe.has_permission("Drive File", doc=entity_name, ptype="read"):
-            frappe.throw("You do not have permission to access this file")
+def get_document_url(entity):
+    """
+    URL OnlyOffice dùng để tải file. Lấy lại ở mỗi request, không nằm trong config
+    đã cache: signed URL có hạn riêng, get_s3_signed_url tự làm mới khi gần hết hạn.
+    """
+    if is_s3_storage() and (entity.mime_type or "") in SIGNED_URL_MIME_TYPES:
+        try:
+            from drive.api.files import get_s3_signed_url
 
-        # Get file URL
-        file_url = None
+            return get_s3_signed_url(entity.path, entity.mime_type)
+        except Exception as err:
+            frappe.logger().warning(f"S3 URL failed, using API URL: {err}")
 
-        if is_s3_storage():
-            try:
-                from drive.api.files import get_file_signed_url
+    site_url = get_accessible_site_url()
+    return f"{site_url}/api/method/drive.api.files.get_file_content?entity_name={entity.name}"
 
-                result = get_file_signed_url(entity_name)
-                file_url = result.get("signed_url")
-                print(f"Using S3 signed URL: {file_url[:50]}...")
-            except Exception as err:
-                frappe.logger().warning(f"S3 URL failed, using API URL: {err}")
 
-        if not file_url:
-            site_url = get_accessible_site_url()
-            file_url = f"{site_url}/api/method/drive.api.files.get_file_content?entity_name={entity_name}"
+def build_editor_config(entity, document_key, tier):
+    """
+    Phần config không phụ thuộc user (không gồm editorConfig.user, document.url và token)
+    """
+    site_url = get_accessible_site_url()
+
+    from pathlib import Path
+
+    clean_title = entity.title.replace(" (Bản sao)", "").replace(" (bản sao)", "")
+    file_ext = Path(clean_title).suffix[1:].lower() if Path(clean_title).suffix else "txt"
+    document_type = get_document_type(file_ext)
+
+    # Callback URL for saving
+    callback_url = f"{site_url}/api/method/drive.api.onlyoffice.save_document"
+
+    # Xác định permissions
+    # - User A (chủ file / có quyền write): edit=True → nhập trực tiếp, lưu luôn
+    #   và thấy balloon Accept/Reject để duyệt thay đổi của User B
+    # - User B (thành viên): edit=False → vào "Review Only" mode, track changes tự động bật
+    can_edit = tier in ("owner", "edit")
+    show_review_changes = document_type == "word" and tier == "owner"
+
+    # Build config với các tối ưu cho collaborative editing
+    return {
+        "documentType": document_type,
+        "document": {
+            "title": entity.title or entity.name,
+            "fileType": file_ext,
+            "key": document_key,
+            "permissions": {
+                "edit": can_edit,
+                "download": True,
+                "print": True,
+                # review=True cho TẤT CẢ để:
+                # - User A: có thể Accept/Reject changes của User B
+                # - User B: vào Review Only mode khi edit=False
+                "review": True,
+                "comment": True,
+                "fillForms": True,
+                "modifyFilter": True,
+                "modifyContentControl": True,
+            },
+        },
+        "editorConfig": {
+            "mode": "edit" if can_edit else "view",
+            "lang": "vi",
+            "callbackUrl": callback_url,  # QUAN TRỌNG: Callback để lưu
+            "customization": {
+                "autosave": True,
+                "autosaveTimeout": 30000,
+                "forcesave": True,
+                "notifyOnClose": True,
+                "compactToolbar": False,
+                "feedback": False,
+                "about": False,
+                "chat": True,
+                "comments": True,
+                "plugins": True,
+                # CHỈ User A (chủ file) thấy balloon Accept/Reject
+                # User B (thành viên) chỉ thấy text được track, KHÔNG thấy balloon
+                "showReviewChanges": show_review_changes,
+                # Chế độ hiển thị: markup = hiện balloon Accept/Reject
+                "reviewDisplay": ("markup" if document_type == "word" else "original"),
+            },
+            "events": {
+                "onDocumentReady": "onDocumentReady",
+                "onDocumentStateChange": "onDocumentStateChange",
+            },
+            "coEditing": {
+                "mode": "fast",  # "fast" mode cho real-time collaboration
+                "change": True,  # Hiển thị changes của users khác
+            },
+        },
+    }
 
-        print(f"📎 Final file URL: {file_url}")
-        from pathlib import Path
 
-        clean_title = entity.title.replace(" (Bản sao)", "").replace(" (bản sao)", "")
-        file_ext = (
-            Path(clean_title).suffix[1:].lower() if Path(clean_title).suffix else "txt"
-        )
-        document_type = get_document_type(file_ext)
+@frappe.whitelist()
+def get_editor_config(entity_name):
+    """
+    Build OnlyOffice editor config with optimized settings for smooth collaboration
 
-        # Callback URL for saving
-        callback_url = (
-            f"{get_accessible_site_url()}/api/method/drive.api.onlyoffice.save_document"
-        )
+    Phần config chung được cache theo (entity, document key, permission tier);
+    document key đổi khi onlyoffice_version tăng (revoke quyền) nên cache tự vô hiệu.
+    """
+    try:
+        entity = frappe.db.get_value("Drive File", entity_name, EDITOR_FILE_FIELDS, as_dict=True)
+        if not entity:
+            frappe.throw("Drive File not found", frappe.DoesNotExistError)
 
-        # Xác định permissions
-        can_edit = has_edit or is_owner
-        show_review_changes = document_type == "word" and is_owner
+        tier = get_permission_tier(entity)
+        if not tier:
+            frappe.throw("You do not have permission to access this file")
 
-        print(f"📝 Final permissions.edit: {can_edit}")
-        print(f"👁️  showReviewChanges (balloon Accept/Reject): {show_review_changes}")
-        if can_edit:
-            print("   → User A (chủ file): Edit mode - nhập trực tiếp, lưu luôn")
-            print("   → Thấy balloon Accept/Reject để duyệt thay đổi của User B")
-        else:
-            print(
-                "   → User B (thành viên): Review Only mode - track changes tự động bật"
-            )
-            print("   → KHÔNG thấy balloon Accept/Reject, chỉ thấy text được track")
-
-        # Build config với các tối ưu cho collaborative editing
-        config = {
-            "documentType": document_type,
-            "document": {
-                "title": entity.title or entity.name,
-                "url": file_url,
-                "fileType": file_ext,
-                "key": generate_document_key(entity),  # Key thông minh hơn
-                "permissions": {
-                    # YÊU CẦU:
-                    # - User A (chủ file): edit=True → nhập trực tiếp, lưu luôn
-                    # - User B (thành viên): edit=False → vào "Review Only" mode
-                    #   → Track Changes TỰ ĐỘNG BẬT (theo docs OnlyOffice)
-                    #   → mọi thay đổi phải User A duyệt (Accept/Reject)
-                    "edit": can_edit,
-                    "download": True,
-                    "print": True,
-                    # review=True cho TẤT CẢ để:
-                    # - User A: có thể Accept/Reject changes của User B
-                    # - User B: vào Review Only mode khi edit=False
-                    "review": True,
-                    "comment": True,
-                    "fillForms": True,
-                    "modifyFilter": True,
-                    "modifyContentControl": True,
-                },
-            },
-            "editorConfig": {
-                "mode": "edit" if has_edit_permission(entity_name) else "view",
-                "lang": "vi",
-                "callbackUrl": callback_url,  # QUAN TRỌNG: Callback để lưu
-                "user": {
-                    "id": frappe.session.user,
-                    "name": frappe.db.get_value(
-                        "User", frappe.session.user, "full_name"
-                    )
-                    or frappe.session.user,
-                },
-                "customization": {
-                    "autosave": True,
-                    "autosaveTimeout": 30000,
-                    "forcesave": True,
-                    "notifyOnClose": True,
-                    "compactToolbar": False,
-                    "feedback": False,
-                    "about": False,
-                    "chat": True,
-                    "comments": True,
-                    "plugins": True,
-                    # CHỈ User A (chủ file) thấy balloon Accept/Reject
-                    # User B (thành viên) chỉ thấy text được track, KHÔNG thấy balloon
-                    "showReviewChanges": show_review_changes,
-                    # Chế độ hiển thị: markup = hiện balloon Accept/Reject
-                    "reviewDisplay": (
-                        "markup" if document_type == "word" else "original"
-                    ),
-                },
-                "events": {
-                    "onDocumentReady": "onDocumentReady",
-                    "onDocumentStateChange": "onDocumentStateChange",
-                },
-                "coEditing": {
-                    "mode": "fast",  # "fast" mode cho real-time collaboration
-                    "change": True,  # Hiển thị changes của users khác
-                },
-            },
+        document_key = generate_document_key(entity)
+        cache_key = _editor_config_cache_key(entity, document_key, tier)
+        config = frappe.cache().get_value(cache_key)
+        if not config:
+            config = build_editor_config(entity, document_key, tier)
+            frappe.cache().set_value(cache_key, config, expires_in_sec=EDITOR_CONFIG_TTL)
+
+        config["document"]["url"] = get_document_url(entity)
+        config["editorConfig"]["user"] = {
+            "id": frappe.session.user,
+            "name": frappe.utils.get_fullname(frappe.session.user),
         }
 
         # Generate JWT token
@@ -161,19 +190,18 @@ def get_editor_config(entity_name):
             try:
                 token = jwt.encode(config, secret, algorithm="HS256")
                 config["token"] = token if isinstance(token, str) else token.decode()
-                print(f"🔐 Generated JWT token")
             except Exception as e:
                 print(f"❌ Error generating JWT token: {e}")
                 frappe.throw(f"Lỗi tạo JWT token: {str(e)}")
         else:
             frappe.logger().warning("⚠️  OnlyOffice JWT secret NOT configured!")
 
-        print(f"✅ Config generated successfully for {entity_name}")
+        print(f"✅ Config generated for {entity_name} ({tier})")
 
         return config
 
     except Exception as e:
-        print(f"❌ Error in get_editor_config: {str(e)}", exc_info=True)
+        print(f"❌ Error in get_editor_config: {str(e)}")
         frappe.throw(f"Lỗi khi tải config: {str(e)}")
 
 
@@ -229,25 +257,11 @@ def save_document():
                         f"❌ No write permission for user {frappe.session.user} on {entity_name}"
                     )
                     return {"error": 1}
-                # Status 2: Save synchronously (document closed)
-                if status == 2:
-                    success = save_document_sync(entity_name, url, key)
-                    if success:
-                        return {"error": 0}
-                    else:
-                        return {"error": 1}
-                # Status 6: Force save - can be async
-                else:
-                    enqueue(
-                        save_document_async,
-                        queue="default",
-                        timeout=300,
-                        entity_name=entity_name,
-                        download_url=url,
-                        key=key,
-                        is_force_save=True,
-                    )
-                    return {"error": 0}
+                # Status 2/6: ack ngay, lưu trong background queue (dedupe + tuần tự theo document)
+                queue_document_save(
+                    entity_name, url, key, status, data.get("lastsave") or url
+                )
+                return {"error": 0}
 
             except Exception as e:
                 return {"error": 1}
@@ -831,18 +845,12 @@ def save_document_sync(entity_name, download_url, key):
     """
     Save document synchronously (for status 2 - document closed)
     Based on OnlyOffice example code
+
+    File được stream thẳng từ OnlyOffice vào storage, không buffer toàn bộ trong RAM.
     """
     print(f"💾 save_document_sync START: {entity_name}")
 
     try:
-        # Download file from OnlyOffice
-        print(f"📥 Downloading from: {download_url}")
-        response = requests.get(download_url, timeout=30)
-        response.raise_for_status()
-
-        file_content = response.content
-        print(f"✅ Downloaded {len(file_content)} bytes")
-
         # Get Drive File info
         drive_file = frappe.get_value(
             "Drive File",
@@ -857,34 +865,48 @@ def save_document_sync(entity_name, download_url, key):
 
         print(f"📄 File: {drive_file['title']}")
 
-        # Save to storage
-        if is_s3_storage():
-            print("💿 Saving to S3...")
-            save_to_s3(entity_name, drive_file["path"], file_content)
-        else:
-            print("💿 Saving to local storage...")
-            save_to_local(entity_name, drive_file["path"], file_content)
+        # Stream file from OnlyOffice
+        print(f"📥 Downloading from: {download_url}")
+        with get_http_session().get(
+            download_url, stream=True, timeout=DOWNLOAD_TIMEOUT
+        ) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            stream = CountingReader(response.raw)
+
+            # Save to storage
+            if is_s3_storage():
+                print("💿 Saving to S3...")
+                save_to_s3(entity_name, drive_file["path"], stream, drive_file["mime_type"])
+            else:
+                print("💿 Saving to local storage...")
+                save_to_local(entity_name, drive_file["path"], stream)
+
+        print(f"✅ Downloaded {stream.bytes_read} bytes")
 
         # Update metadata
-        frappe.db.set_value(
-            "Drive File",
-            entity_name,
-            {
-                "modified": datetime.now(),
-                "file_size": len(file_content),
-            },
-            update_modified=True,
-        )
+        with track_usage([entity_name]):
+            frappe.db.set_value(
+                "Drive File",
+                entity_name,
+                {
+                    "modified": datetime.now(),
+                    "file_size": stream.bytes_read,
+                },
+                update_modified=True,
+            )
         frappe.db.commit()
+        queue_extraction(entity_name, drive_file["mime_type"])
 
         print(f"✅ Document saved successfully: {entity_name}")
+        return True
 
     except requests.RequestException as e:
-        print(f"❌ Download error: {str(e)}", exc_info=True)
+        print(f"❌ Download error: {str(e)}")
         frappe.db.rollback()
         raise
     except Exception as e:
-        print(f"❌ Save error: {str(e)}", exc_info=True)
+        print(f"❌ Save error: {str(e)}")
         frappe.db.rollback()
         raise
 
@@ -899,7 +921,156 @@ def save_document_async(entity_name, download_url, key, is_force_save=False):
         save_document_sync(entity_name, download_url, key)
         print(f"✅ Async save completed: {entity_name}")
     except Exception as e:
-        print(f"❌ Async save failed: {str(e)}", exc_info=True)
+        print(f"❌ Async save failed: {str(e)}")
+
+
+def _save_cache_key(*parts):
+    return frappe.cache().make_key(":".join(["drive_onlyoffice_save", *parts]))
+
+
+def _incr_save_metric(field, amount=1):
+    frappe.cache().hincrby(_save_cache_key("metrics"), field, amount)
+
+
+def queue_document_save(entity_name, download_url, key, status, version):
+    """
+    Queue a save from an OnlyOffice callback.
+
+    - Callback lặp lại cho cùng (key, version) bị bỏ qua
+    - Mỗi document chỉ giữ bản chờ lưu mới nhất, các bản cũ hơn bị gộp
+    - Một job cho mỗi document, nên các lần lưu của cùng document chạy tuần tự
+    """
+    version_hash = hashlib.md5(str(version).encode()).hexdigest()
+    _incr_save_metric("received")
+
+    if not frappe.cache().set(
+        _save_cache_key("seen", key, version_hash), 1, ex=SAVE_DEDUPE_TTL, nx=True
+    ):
+        _incr_save_metric("duplicate")
+        print(f"⏭️ Duplicate OnlyOffice callback for {key}")
+        return False
+
+    pending = json.dumps(
+        {
+            "url": download_url,
+            "key": key,
+            "status": status,
+            "version": version_hash,
+            "queued_at": frappe.utils.now(),
+        }
+    )
+    if frappe.cache().getset(_save_cache_key("pending", entity_name), pending):
+        _incr_save_metric("coalesced")
+    frappe.cache().expire(_save_cache_key("pending", entity_name), SAVE_DEDUPE_TTL)
+
+    enqueue(
+        process_document_saves,
+        queue="default",
+        timeout=SAVE_JOB_TIMEOUT,
+        job_id=f"onlyoffice_save_{entity_name}",
+        deduplicate=True,
+        entity_name=entity_name,
+    )
+    return True
+
+
+def get_save_lock(entity_name):
+    """
+    Lock giữ trong lúc ghi blob của document: job lưu OnlyOffice, và việc chuyển
+    blob sang home mới khi di chuyển thư mục (drive.api.move).
+    """
+    from drive.locks.distributed_lock import DistributedLock
+
+    return DistributedLock(
+        f"onlyoffice_save:{entity_name}", exclusive=True, ttl=SAVE_JOB_TIMEOUT
+    )
+
+
+def resume_pending_save(entity_name):
+    """
+    Gọi sau khi nhả save lock: bản chờ đến trong lúc lock bị giữ có thể đã bị
+    deduplicate bỏ qua hoặc job của nó gặp lock và thoát, nên chạy lại ở job
+    mới (không dedup).
+    """
+    # _save_cache_key đã qua make_key: dùng lệnh redis thô, không để cache thêm prefix lần nữa
+    if frappe.cache().get(_save_cache_key("pending", entity_name)) is not None:
+        enqueue(
+            process_document_saves,
+            queue="default",
+            timeout=SAVE_JOB_TIMEOUT,
+            entity_name=entity_name,
+        )
+
+
+def process_document_saves(entity_name):
+    """
+    Background job: lưu bản chờ mới nhất của document, lặp đến khi hết, có retry.
+    """
+    import time
+    from drive.locks.distributed_lock import FileLockedError
+
+    try:
+        lock = get_save_lock(entity_name)
+        lock.acquire_write_lock()
+    except FileLockedError:
+        # Một worker khác đang lưu document này và sẽ lấy bản chờ mới nhất
+        return
+
+    pending_key = _save_cache_key("pending", entity_name)
+    failed = None
+    try:
+        while not failed and (raw := frappe.cache().getdel(pending_key)):
+            pending = json.loads(raw)
+            for attempt in range(1, SAVE_MAX_ATTEMPTS + 1):
+                started = time.monotonic()
+                try:
+                    save_document_sync(entity_name, pending["url"], pending["key"])
+                    _incr_save_metric("saved")
+                    _incr_save_metric(
+                        "save_ms", int((time.monotonic() - started) * 1000)
+                    )
+                    break
+                except Exception:
+                    if attempt == SAVE_MAX_ATTEMPTS:
+                        _incr_save_metric("failed")
+                        frappe.log_error(
+                            frappe.get_traceback(), f"OnlyOffice save failed: {entity_name}"
+                        )
+                        failed = _requeue_failed_save(pending_key, raw, pending)
+                        break
+                    _incr_save_metric("retried")
+                    time.sleep(2**attempt)
+    finally:
+        lock.release_write_lock()
+
+    # Callback đến sau lần getdel cuối nhưng trước khi nhả lock; bản lỗi vừa trả lại
+    # hàng đợi thì chờ callback / job sau, không chạy lại ngay thành vòng lặp
+    if failed is None or frappe.cache().get(pending_key) != failed:
+        resume_pending_save(entity_name)
+
+
+def _requeue_failed_save(pending_key, raw, pending):
+    """
+    Lưu thất bại hẳn: bỏ đánh dấu "seen" để OnlyOffice gửi lại cùng version vẫn
+    được nhận, và trả bản chờ về hàng đợi nếu chưa có bản mới hơn.
+
+    :return: giá trị đã trả lại (bytes), hoặc False nếu đã có bản mới hơn
+    """
+    if pending.get("version"):
+        frappe.cache().delete(_save_cache_key("seen", pending["key"], pending["version"]))
+    if frappe.cache().set(pending_key, raw, ex=SAVE_DEDUPE_TTL, nx=True):
+        return raw
+    return False
+
+
+@frappe.whitelist()
+def get_save_metrics():
+    """Counters of the OnlyOffice save queue"""
+    frappe.only_for("System Manager")
+    with frappe.cache().pipeline() as pipe:
+        pipe.hgetall(_save_cache_key("metrics"))
+        metrics = pipe.execute()[0]
+    return {k.decode(): int(v) for k, v in metrics.items()}
 
 
 def get_accessible_site_url():
@@ -964,94 +1135,108 @@ def get_document_type(ext):
 def is_s3_storage():
     """Kiểm tra S3 storage"""
     try:
-        settings = frappe.get_single("Drive S3 Settings")
+        settings = frappe.get_cached_doc("Drive S3 Settings")
         return bool(settings.get("bucket") and settings.get("aws_key"))
     except:
         return False
 
 
-def save_to_s3(entity_name, s3_key, file_content):
+class CountingReader:
+    """File-like wrapper that counts the bytes read through it"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        chunk = self.raw.read(size)
+        self.bytes_read += len(chunk)
+        return chunk
+
+
+def get_http_session():
     """
-    Upload to S3 with optimizations:
-    - Multipart upload for large files
-    - Proper content type
-    - Server-side encryption
+    requests.Session dùng chung trong process để tái sử dụng kết nối tới OnlyOffice
     """
-    try:
-        import boto3
-        from botocore.config import Config
+    global _http_session
+    if _http_session is None:
+        _http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+        _http_session.mount("http://", adapter)
+        _http_session.mount("https://", adapter)
+    return _http_session
 
-        settings = frappe.get_single("Drive S3 Settings")
 
+def get_s3_client(settings):
+    """
+    boto3 client dùng chung, tạo lại khi cấu hình S3 thay đổi
+    """
+    import boto3
+    from botocore.config import Config
+
+    cache_key = (
+        settings.aws_key,
+        settings.endpoint_url,
+        settings.signature_version,
+        settings.modified,
+    )
+    client = _s3_clients.get(cache_key)
+    if client is None:
         # Configure with retry and timeout
         config = Config(
             retries={"max_attempts": 3, "mode": "standard"},
-            signature_version=settings.signature_version or "s3",  # THÊM
+            signature_version=settings.signature_version or "s3",
             s3={"addressing_style": "path"},
             connect_timeout=5,
             read_timeout=30,
+            max_pool_connections=UPLOAD_CONCURRENCY * 2,
         )
-
-        s3_client = boto3.client(
+        client = boto3.client(
             "s3",
             aws_access_key_id=settings.aws_key,
             aws_secret_access_key=settings.get_password("aws_secret"),
-            endpoint_url=settings.endpoint_url,  # THÊM
+            endpoint_url=settings.endpoint_url,
             config=config,
         )
+        _s3_clients.clear()
+        _s3_clients[cache_key] = client
+    return client
 
-        file_size = len(file_content)
-        print(f"📤 Uploading to S3: {file_size} bytes")
-
-        # Use multipart upload for files > 5MB
-        if file_size > 5 * 1024 * 1024:  # 5MB
-            print("📦 Using multipart upload for large file")
-
-            # Create multipart upload
-            mpu = s3_client.create_multipart_upload(
-                Bucket=settings.bucket, Key=s3_key, ServerSideEncryption="AES256"
-            )
-
-            upload_id = mpu["UploadId"]
-            parts = []
-            chunk_size = 5 * 1024 * 1024  # 5MB chunks
-            part_number = 1
-
-            for i in range(0, file_size, chunk_size):
-                chunk = file_content[i : i + chunk_size]
-
-                part = s3_client.upload_part(
-                    Bucket=settings.bucket,
-                    Key=s3_key,
-                    PartNumber=part_number,
-                    UploadId=upload_id,
-                    Body=chunk,
-                )
-
-                parts.append({"PartNumber": part_number, "ETag": part["ETag"]})
 
-                part_number += 1
-
-            # Complete multipart upload
-            s3_client.complete_multipart_upload(
-                Bucket=settings.bucket,
-                Key=s3_key,
-                UploadId=upload_id,
-                MultipartUpload={"Parts": parts},
-            )
+def save_to_s3(entity_name, s3_key, file_content, content_type=None):
+    """
+    Upload to S3:
+    - Stream file-like input, multipart upload các part song song cho file lớn
+    - Memory giới hạn ở khoảng UPLOAD_CONCURRENCY * UPLOAD_CHUNK_SIZE
+    - Server-side encryption
 
-            print(f"✅ Multipart upload completed: {len(parts)} parts")
-        else:
-            # Single put for small files
-            s3_client.put_object(
-                Bucket=settings.bucket,
-                Key=s3_key,
-                Body=file_content,
-                ContentType="application/octet-stream",
-                ServerSideEncryption="AES256",
-            )
+    :param file_content: bytes hoặc file-like object có read()
+    """
+    from io import BytesIO
+    from boto3.s3.transfer import TransferConfig
 
-            print(f"✅ Single upload completed")
+    settings = frappe.get_single("Drive S3 Settings")
+    try:
+        s3_client = get_s3_client(settings)
+
+        if isinstance(file_content, (bytes, bytearray)):
+            file_content = BytesIO(file_content)
+
+        print(f"📤 Uploading to S3: {s3_key}")
+        s3_client.upload_fileobj(
+            file_content,
+            settings.bucket,
+            s3_key,
+            ExtraArgs={
+                "ContentType": content_type or "application/octet-stream",
+                "ServerSideEncryption": "AES256",
+            },
+            Config=TransferConfig(
+                multipart_threshold=UPLOAD_CHUNK_SIZE,
+                multipart_chunksize=UPLOAD_CHUNK_SIZE,
+                max_concurrency=UPLOAD_CONCURRENCY,
+            ),
+        )
 
         print(f"✅ Uploaded to S3: {s3_key}")
 
@@ -1060,15 +1245,24 @@ def save_to_s3(entity_name, s3_key, file_content):
         # Log more details for debugging
         print(f"   Bucket: {settings.bucket}")
         print(f"   Key: {s3_key}")
-        print(f"   Size: {len(file_content)} bytes")
         raise
 
 
 def save_to_local(entity_name, file_path, file_content):
-    """Save to local storage"""
-    try:
-        import os
+    """
+    Save to local storage.
+    Ghi ra file tạm cùng thư mục rồi os.replace để người đọc không thấy file ghi dở.
+    Người đọc không cần khoá; chỉ các lần ghi đè cùng đường dẫn được tuần tự hoá
+    bằng khoá ghi để bản cũ không thay thế bản mới hơn.
+
+    :param file_content: bytes hoặc file-like object có read()
+    """
+    import os
+    import tempfile
+    from drive.locks.distributed_lock import DistributedLock
 
+    tmp_path = None
+    try:
         sites_path = frappe.get_site_path()
 
         if file_path.startswith("/"):
@@ -1077,10 +1271,27 @@ def save_to_local(entity_name, file_path, file_content):
         full_path = os.path.join(sites_path, file_path)
         os.makedirs(os.path.dirname(full_path), exist_ok=True)
 
-        with open(full_path, "wb") as f:
-            f.write(file_content)
+        with DistributedLock(file_path, exclusive=True, auto_renew=True) as lock:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=os.path.dirname(full_path), prefix=".onlyoffice-"
+            )
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(file_content, (bytes, bytearray)):
+                    f.write(file_content)
+                else:
+                    while chunk := file_content.read(DOWNLOAD_CHUNK_SIZE):
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            # Lease có thể đã hết trong lúc tải: không ghi đè bản của người giữ lock sau
+            lock.check_fence()
+            os.replace(tmp_path, full_path)
+            tmp_path = None
 
         print(f"✅ Saved to local: {full_path}")
     except Exception as e:
         print(f"❌ Local save error: {str(e)}")
         raise
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.remove(tmp_path)
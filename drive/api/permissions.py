@@ -1,10 +1,12 @@
 import frappe
-from frappe.utils import getdate
 
 from drive.utils.users import mark_as_viewed
 from drive.utils.files import get_valid_breadcrumbs, generate_upward_path, get_file_type
+from drive.utils.lineage import split_lineage
 from drive.api.activity import create_new_activity_log, create_new_entity_activity_log
 
+EXPIRY_BATCH = 1000
+
 ENTITY_FIELDS = [
     "name",
     "title",
@@ -262,6 +264,11 @@ def get_shared_with_list(entity):
     # Tạo map của direct permissions
     direct_perm_map = {perm.user: perm for perm in direct_permissions}
 
+    # Quyền kế thừa từ thư mục cha (gần nhất trước); quyền trực tiếp được ưu tiên
+    inherited_permissions, inherited_team_permission = get_inherited_grants(entity_doc)
+    inherited_permissions = [p for p in inherited_permissions if p.user not in direct_perm_map]
+    override_map = {perm.user: perm for perm in inherited_permissions} | direct_perm_map
+
     # 3. Xử lý team members TRƯỚC (ưu tiên cao hơn)
     team_members_list = []  # Danh sách team members để loại trừ khỏi direct permissions sau
 
@@ -270,7 +277,7 @@ def get_shared_with_list(entity):
         {"entity": entity, "user": "$TEAM"},
         ["read", "write", "comment", "share"],
         as_dict=True,
-    )
+    ) or inherited_team_permission
 
     # Hiển thị team members nếu:
     # 1. Có team permission, HOẶC
@@ -327,10 +334,10 @@ def get_shared_with_list(entity):
                 # Lưu user vào danh sách team members
                 team_members_list.append(member.user)
 
-                # Kiểm tra xem user này có direct permission không
-                if member.user in direct_perm_map:
+                # Kiểm tra xem user này có direct (hoặc kế thừa) permission không
+                if member.user in override_map:
                     # User có override permission - sử dụng quyền từ direct permission
-                    direct_perm = direct_perm_map[member.user]
+                    direct_perm = override_map[member.user]
                     team_member = {
                         "user": member.user,
                         "user_image": member.user_image,
@@ -379,6 +386,15 @@ def get_shared_with_list(entity):
                 perm.update(user_info)
                 perm["source"] = "direct"
                 all_users.append(perm)
+    for perm in inherited_permissions:
+        if perm.user not in team_members_list:
+            user_info = frappe.db.get_value(
+                "User", perm.user, ["user_image", "full_name", "email"], as_dict=True
+            )
+            if user_info:
+                perm.update(user_info)
+                perm["source"] = "inherited"
+                all_users.append(perm)
 
     # 5. Lọc trùng email - Giữ theo thứ tự ưu tiên: owner > direct > team
     def deduplicate_by_email(users_list):
@@ -392,7 +408,7 @@ def get_shared_with_list(entity):
         unique_users = []
 
         # Sắp xếp theo thứ tự ưu tiên trước khi lọc
-        priority_order = {"owner": 0, "direct": 1, "team": 2}
+        priority_order = {"owner": 0, "direct": 1, "inherited": 2, "team": 3}
         users_list.sort(
             key=lambda x: (priority_order.get(x.get("source"), 3), 0 if x.get("is_owner") else 1)
         )
@@ -424,6 +440,44 @@ def get_shared_with_list(entity):
     return all_users
 
 
+def get_inherited_grants(entity_doc):
+    """
+    Current grants on the ancestors of `entity_doc`, nearest folder first for
+    each user: (user grants with `inherited_from`, nearest `$TEAM` grant or None)
+    """
+    ancestors = split_lineage(entity_doc.lineage)[1:]
+    if not ancestors:
+        return [], None
+    DrivePermission = frappe.qb.DocType("Drive Permission")
+    rows = (
+        frappe.qb.from_(DrivePermission)
+        .select(
+            DrivePermission.entity,
+            DrivePermission.user,
+            DrivePermission.read,
+            DrivePermission.write,
+            DrivePermission.comment,
+            DrivePermission.share,
+        )
+        .where(
+            DrivePermission.entity.isin(ancestors)
+            & (DrivePermission.user != "")
+            & current_grant(DrivePermission)
+        )
+    ).run(as_dict=True)
+    depth = {name: i for i, name in enumerate(ancestors)}
+    rows.sort(key=lambda r: depth[r.entity])
+
+    grants, team_grant = {}, None
+    for r in rows:
+        if r.user == "$TEAM":
+            team_grant = team_grant or frappe._dict({k: r[k] for k in ("read", "write", "comment", "share")})
+        elif r.user not in grants:
+            r["inherited_from"] = r.pop("entity")
+            grants[r.user] = r
+    return list(grants.values()), team_grant
+
+
 # Hàm utility riêng biệt để lọc trùng email (có thể tái sử dụng)
 def remove_duplicate_emails(users_list, keep_priority=None):
     """
@@ -472,23 +526,48 @@ def remove_duplicate_emails(users_list, keep_priority=None):
     return unique_users
 
 
-def auto_delete_expired_perms():
-    current_date = getdate()
-    expired_documents = frappe.get_list(
-        "Drive Permission",
-        filters=[
-            ["valid_until", "is", "set"],
-            ["valid_until", "<", current_date],
-        ],
-        fields=["name", "valid_until"],
-    )
-    if expired_documents:
+def current_grant(table):
+    """
+    Query builder criterion: the Drive Permission row has not passed its
+    `valid_until`. Expired rows are ignored at read time; the sweeper below
+    only cleans them up.
+    """
+    return table.valid_until.isnull() | (table.valid_until > frappe.utils.now_datetime())
 
-        def batch_delete_perms(docs):
-            for d in docs:
-                frappe.delete_doc("Drive Permission", d.name)
 
-        frappe.enqueue(batch_delete_perms, docs=expired_documents)
+def auto_delete_expired_perms():
+    """
+    Delete expired Drive Permissions by range on the `valid_until` index,
+    EXPIRY_BATCH rows per statement, and refresh the shared lists of the
+    users involved.
+    """
+    from drive.api.shared_roots import SHARED_BY_ME, SHARED_WITH_ME, invalidate_shared_roots
+
+    now = frappe.utils.now_datetime()
+    while True:
+        expired = frappe.db.sql(
+            """
+            SELECT name, user, owner FROM `tabDrive Permission`
+            WHERE valid_until <= %(now)s
+            ORDER BY valid_until
+            LIMIT %(limit)s
+            """,
+            {"now": now, "limit": EXPIRY_BATCH},
+            as_dict=True,
+        )
+        if not expired:
+            break
+        frappe.db.sql(
+            "DELETE FROM `tabDrive Permission` WHERE name IN %(names)s",
+            {"names": tuple(p.name for p in expired)},
+        )
+        invalidate_shared_roots(
+            [(p.user, SHARED_WITH_ME) for p in expired]
+            + [(p.owner, SHARED_BY_ME) for p in expired]
+        )
+        frappe.db.commit()
+        if len(expired) < EXPIRY_BATCH:
+            break
 
 
 def user_has_permission(doc, ptype, user):
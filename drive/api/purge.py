@@ -0,0 +1,258 @@
+"""
+Scheduled purge of expired trash.
+
+Replaces the per-document `delete()` loop of the old daily hooks. The purge
+walks the expired Drive Files in name order, `PURGE_BATCH` at a time:
+
+1. expand expired folders to their whole subtree (lineage index)
+2. delete the blobs and thumbnails in parallel (S3 `delete_objects`, 1000
+   keys per call); rows whose blob could not be deleted are kept for the next
+   run, stray thumbnails are left to the orphan reaper (drive.utils.blobs)
+3. delete the rows and everything hanging off them with one DELETE per table
+4. commit and store the last processed name as a checkpoint
+
+The checkpoint lives in the database (`frappe.db.set_global`), so a crashed or
+timed-out run continues where it stopped; a run that reaches the end clears it.
+A batch that fails is retried row by row, and only the rows that still fail are
+skipped (and reported) until the next pass. A run stops after `MAX_RUN_SECONDS`
+and re-enqueues itself; a Redis lock keeps a single purge running at a time.
+"""
+
+import json
+import time
+from datetime import timedelta
+
+import frappe
+
+from drive.api.notifications import reset_unread_count
+from drive.locks.distributed_lock import DistributedLock, FileLockedError
+from drive.utils.files import FileManager
+from drive.utils.lineage import get_descendants
+
+RETENTION_DAYS = 30
+PURGE_BATCH = 500
+MAX_RUN_SECONDS = 20 * 60
+CHECKPOINT_KEY = "drive_purge_checkpoint"
+METRICS_KEY = "drive_purge_last_run"
+LOCK_KEY = "drive_purge_trash"
+LOCK_TTL = 5 * 60
+SAMPLE_SIZE = 20
+
+PURGE_FIELDS = ["name", "team", "path", "document", "is_group"]
+
+# (table, column) of rows that belong to a Drive File and go with it
+DEPENDENT_ROWS = [
+    ("Drive Permission", "entity"),
+    ("Drive Entity Log", "entity_name"),
+    ("Drive Entity Tag", "parent"),
+    ("Drive Favourite", "entity"),
+    ("Drive Pin File", "drive_file"),
+    ("Drive Recent File", "entity"),
+    ("Drive Shortcut", "file"),
+    ("Drive Trash", "entity"),
+    ("Drive Search Token", "entity"),
+    ("Drive Shared Root", "entity"),
+    ("Drive File Text", "entity"),
+    ("Drive Entity Activity Log", "entity"),
+    ("Drive Document Version", "parent_entity"),
+    ("Drive Notification", "notif_doctype_name"),
+]
+
+
+def _cutoff():
+    return frappe.utils.now_datetime() - timedelta(days=RETENTION_DAYS)
+
+
+def get_expired_batch(after, limit=PURGE_BATCH):
+    """
+    Expired Drive Files after `after` in name order: permanently deleted
+    (is_active = -1) or trashed (is_active = 0) more than RETENTION_DAYS ago.
+    Trash age comes from Drive Trash.trashed_on, falling back to modified.
+    """
+    return frappe.db.sql(
+        """
+        SELECT df.name, df.team, df.path, df.document, df.is_group
+        FROM `tabDrive File` df
+        WHERE df.name > %(after)s
+          AND (
+            (df.is_active = -1 AND df.modified < %(cutoff)s)
+            OR (
+              df.is_active = 0
+              AND COALESCE(
+                (SELECT MAX(t.trashed_on) FROM `tabDrive Trash` t WHERE t.entity = df.name),
+                df.modified
+              ) < %(cutoff)s
+            )
+          )
+        ORDER BY df.name
+        LIMIT %(limit)s
+        """,
+        {"after": after or "", "cutoff": _cutoff(), "limit": limit},
+        as_dict=True,
+    )
+
+
+def purge_entities(rows, manager):
+    """
+    Delete `rows` (and the subtrees of folders among them) with their blobs and
+    dependent rows.
+
+    :return: (entities deleted, blobs deleted, blobs failed)
+    """
+    entities = {r.name: r for r in rows}
+    for row in rows:
+        if row.is_group:
+            for child in get_descendants(row.name, fields=PURGE_FIELDS):
+                entities.setdefault(child.name, child)
+
+    files = [r for r in entities.values() if not r.is_group]
+    paths = {r.path for r in files if r.path}
+    thumbnails = manager.get_thumbnail_paths(files)
+    failed = set(manager.delete_files(list(paths) + thumbnails)) & paths
+    # Blob chưa xoá được: giữ lại dòng để lần chạy sau thử lại, tránh blob mồ côi
+    names = [n for n, r in entities.items() if r.is_group or r.path not in failed]
+    if not names:
+        return 0, 0, len(failed)
+
+    params = {"names": tuple(names)}
+    unread_users = frappe.db.sql_list(
+        """
+        SELECT DISTINCT to_user FROM `tabDrive Notification`
+        WHERE notif_doctype_name IN %(names)s AND `read` = 0
+        """,
+        params,
+    )
+    for table, column in DEPENDENT_ROWS:
+        frappe.db.sql(f"DELETE FROM `tab{table}` WHERE `{column}` IN %(names)s", params)
+
+    documents = tuple(entities[n].document for n in names if entities[n].document)
+    if documents:
+        frappe.db.sql("DELETE FROM `tabDrive Document` WHERE name IN %(documents)s", {"documents": documents})
+    frappe.db.sql("DELETE FROM `tabDrive File` WHERE name IN %(names)s", params)
+    reset_unread_count(unread_users)
+    return len(names), len(paths) - len(failed), len(failed)
+
+
+def purge_shortcuts(limit=PURGE_BATCH):
+    """Delete expired trashed / deleted shortcuts in batches; returns the count"""
+    total = 0
+    while True:
+        names = frappe.db.sql_list(
+            """
+            SELECT s.name FROM `tabDrive Shortcut` s
+            WHERE (s.is_active = -1 AND s.modified < %(cutoff)s)
+               OR (
+                 s.is_active = 0
+                 AND COALESCE(
+                   (SELECT MAX(t.trashed_on) FROM `tabDrive Trash` t WHERE t.entity_shortcut = s.name),
+                   s.modified
+                 ) < %(cutoff)s
+               )
+            LIMIT %(limit)s
+            """,
+            {"cutoff": _cutoff(), "limit": limit},
+        )
+        if not names:
+            return total
+        params = {"names": tuple(names)}
+        frappe.db.sql("DELETE FROM `tabDrive Trash` WHERE entity_shortcut IN %(names)s", params)
+        frappe.db.sql("DELETE FROM `tabDrive Favourite` WHERE entity_shortcut IN %(names)s", params)
+        frappe.db.sql("DELETE FROM `tabDrive Shortcut` WHERE name IN %(names)s", params)
+        frappe.db.commit()
+        total += len(names)
+
+
+def _purge_batch(rows, manager, metrics):
+    """Purge one batch; on error retry its rows one at a time and record those that still fail"""
+    try:
+        return purge_entities(rows, manager)
+    except Exception:
+        frappe.db.rollback()
+        frappe.log_error(frappe.get_traceback(), "Drive trash purge")
+
+    totals = [0, 0, 0]
+    for row in rows:
+        try:
+            result = purge_entities([row], manager)
+            frappe.db.commit()
+        except Exception:
+            frappe.db.rollback()
+            metrics["failed"] += 1
+            if len(metrics["failed_sample"]) < SAMPLE_SIZE:
+                metrics["failed_sample"].append(row.name)
+            continue
+        totals = [t + r for t, r in zip(totals, result)]
+    return tuple(totals)
+
+
+def purge_trash():
+    """Daily scheduler / background job: purge expired trash, resuming from the checkpoint"""
+    lock = DistributedLock(LOCK_KEY, exclusive=True, ttl=LOCK_TTL, auto_renew=True)
+    try:
+        lock.acquire_write_lock()
+    except FileLockedError:
+        frappe.logger().info("purge_trash: another purge is running")
+        return
+
+    try:
+        metrics, after = _run_purge()
+    finally:
+        lock.release_write_lock()
+
+    if not metrics["finished"]:
+        # Mỗi checkpoint một job_id: hai job không thể cùng chạy tiếp từ một checkpoint
+        frappe.enqueue(
+            purge_trash,
+            queue="long",
+            job_id=f"{LOCK_KEY}:{after}",
+            deduplicate=True,
+        )
+    return metrics
+
+
+def _run_purge():
+    started = time.monotonic()
+    manager = FileManager()
+    metrics = {
+        "batches": 0,
+        "entities": 0,
+        "blobs": 0,
+        "blob_failures": 0,
+        "failed": 0,
+        "failed_sample": [],
+    }
+    after = frappe.db.get_global(CHECKPOINT_KEY) or ""
+    finished = False
+
+    while time.monotonic() - started < MAX_RUN_SECONDS:
+        rows = get_expired_batch(after)
+        if not rows:
+            finished = True
+            break
+        entities, blobs, blob_failures = _purge_batch(rows, manager, metrics)
+        after = rows[-1].name
+        frappe.db.set_global(CHECKPOINT_KEY, after)
+        frappe.db.commit()
+        metrics["batches"] += 1
+        metrics["entities"] += entities
+        metrics["blobs"] += blobs
+        metrics["blob_failures"] += blob_failures
+
+    if finished:
+        metrics["shortcuts"] = purge_shortcuts()
+        frappe.db.set_global(CHECKPOINT_KEY, "")
+        frappe.db.commit()
+
+    elapsed = time.monotonic() - started
+    metrics.update(
+        {
+            "finished": finished,
+            "seconds": round(elapsed, 1),
+            "entities_per_second": round(metrics["entities"] / elapsed, 1) if elapsed else 0,
+            "blobs_per_second": round(metrics["blobs"] / elapsed, 1) if elapsed else 0,
+            "checkpoint": "" if finished else after,
+        }
+    )
+    frappe.cache().set_value(METRICS_KEY, metrics)
+    frappe.logger().info(f"purge_trash: {json.dumps(metrics)}")
+    return metrics, after
@@ -0,0 +1,167 @@
+"""
+Materialised "shared roots" per user, backing the Shared view.
+
+A shared root is an entity shared with (or by) a user whose parent folder is
+not itself shared with (or by) that user. Rows of `Drive Shared Root` carry
+denormalised title / modified / accessed columns so the Shared view can page
+through them in index order instead of over-fetching and sorting in Python.
+
+The set of a (user, direction) pair is rebuilt in one INSERT ... SELECT when a
+permission of that user changes or a shared entity moves; column values are
+kept in place by `sync_shared_root_entity` and `touch_shared_root`. The
+"fresh" flag of a set is written by `persist_shared_roots` once its rebuild has
+committed, and expires after `FRESH_TTL` so a lost invalidation heals by itself.
+"""
+
+import frappe
+
+SHARED_WITH_ME = 0
+SHARED_BY_ME = 1
+FRESH_KEY = "drive_shared_roots_fresh"
+FRESH_TTL = 6 * 60 * 60
+
+# Permission rows that are not a concrete user
+NON_USER_PERMISSIONS = ("", "$TEAM")
+
+
+def _fresh_key(user, by):
+    return f"{FRESH_KEY}:{user}:{by}"
+
+
+def refresh_shared_roots(user, by):
+    """Rebuild the shared roots of `user` (`by`=1: shared by them, 0: shared with them)"""
+    by = int(by)
+    column = "owner" if by else "user"
+    params = {"user": user, "by": by, "now": frappe.utils.now_datetime()}
+    frappe.db.sql(
+        "DELETE FROM `tabDrive Shared Root` WHERE user = %(user)s AND shared_by = %(by)s",
+        params,
+    )
+    frappe.db.sql(
+        f"""
+        INSERT INTO `tabDrive Shared Root` (user, shared_by, entity, title, file_modified, accessed)
+        SELECT %(user)s, %(by)s, df.name, LEFT(df.title, 140), df.modified,
+               COALESCE(
+                   (SELECT MAX(el.last_interaction) FROM `tabDrive Entity Log` el
+                    WHERE el.entity_name = df.name),
+                   df.modified
+               )
+        FROM (
+            SELECT DISTINCT entity FROM `tabDrive Permission`
+            WHERE `read` = 1 AND {column} = %(user)s
+              AND (valid_until IS NULL OR valid_until > %(now)s)
+        ) shared
+        JOIN `tabDrive File` df ON df.name = shared.entity
+        WHERE NOT EXISTS (
+            SELECT 1 FROM `tabDrive Permission` pp
+            JOIN `tabDrive File` a ON a.name = pp.entity
+            WHERE pp.`read` = 1 AND pp.{column} = %(user)s
+              AND (pp.valid_until IS NULL OR pp.valid_until > %(now)s)
+              AND a.name != df.name
+              AND (
+                  a.name = df.parent_entity
+                  OR (IFNULL(a.lineage, '') != '' AND LEFT(df.lineage, CHAR_LENGTH(a.lineage)) = a.lineage)
+              )
+        )
+        """,
+        params,
+    )
+
+
+def persist_shared_roots(user, by):
+    """Background job: rebuild and commit the shared roots of `user`, then mark them fresh"""
+    refresh_shared_roots(user, by)
+    frappe.db.commit()
+    frappe.cache().set_value(_fresh_key(user, by), 1, expires_in_sec=FRESH_TTL)
+
+
+def _enqueue_refresh(user, by, after_commit=True):
+    frappe.enqueue(
+        persist_shared_roots,
+        queue="short",
+        job_id=f"drive_shared_roots_{user}_{by}",
+        deduplicate=True,
+        enqueue_after_commit=after_commit,
+        user=user,
+        by=by,
+    )
+
+
+def ensure_shared_roots(user, by):
+    """
+    Make the shared roots of `user` readable in this transaction. A stale set is
+    rebuilt inline for the current read and persisted by a background job, since
+    the Shared view is read over GET and its transaction is rolled back.
+    """
+    if not frappe.cache().get_value(_fresh_key(user, by)):
+        refresh_shared_roots(user, by)
+        # GET bị rollback và after_commit bị huỷ theo: enqueue ngay, job có transaction riêng
+        _enqueue_refresh(user, by, after_commit=False)
+
+
+def invalidate_shared_roots(pairs):
+    """
+    Mark (user, by) sets stale and rebuild them in the background;
+    a read that comes first rebuilds inline.
+    """
+    for user, by in set(pairs):
+        if not user or user in NON_USER_PERMISSIONS:
+            continue
+        frappe.cache().delete_value(_fresh_key(user, by))
+        _enqueue_refresh(user, by)
+
+
+def rebuild_shared_roots():
+    """Rebuild the shared roots of every user holding or granting a permission"""
+    rows = frappe.db.sql("SELECT DISTINCT user, owner FROM `tabDrive Permission`")
+    pairs = {(user, SHARED_WITH_ME) for user, _ in rows} | {(owner, SHARED_BY_ME) for _, owner in rows}
+    for user, by in pairs:
+        if not user or user in NON_USER_PERMISSIONS:
+            continue
+        persist_shared_roots(user, by)
+
+
+def invalidate_for_entities(entity_names):
+    """Invalidate every user holding or granting a permission on `entity_names`"""
+    if not entity_names:
+        return
+    rows = frappe.db.sql(
+        """
+        SELECT DISTINCT user, owner FROM `tabDrive Permission`
+        WHERE entity IN %(entities)s
+        """,
+        {"entities": tuple(entity_names)},
+    )
+    pairs = [(user, SHARED_WITH_ME) for user, _ in rows]
+    pairs += [(owner, SHARED_BY_ME) for _, owner in rows]
+    invalidate_shared_roots(pairs)
+
+
+def sync_shared_root_entity(doc):
+    """Drive File.on_update: keep the sort columns of its shared-root rows current"""
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive Shared Root`
+        SET title = LEFT(%(title)s, 140), file_modified = %(modified)s
+        WHERE entity = %(entity)s
+        """,
+        {"title": doc.title, "modified": doc.modified, "entity": doc.name},
+    )
+    if doc.has_value_changed("parent_entity") and not doc.is_new():
+        invalidate_for_entities([doc.name])
+
+
+def touch_shared_root(entity, last_interaction):
+    """Drive Entity Log.after_insert: bump the access time used for ordering"""
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive Shared Root`
+        SET accessed = %(accessed)s
+        WHERE entity = %(entity)s AND (accessed IS NULL OR accessed < %(accessed)s)
+        """,
+        {"entity": entity, "accessed": last_interaction},
+    )
+
+
+def remove_shared_root_entity(entity):
+    frappe.db.delete("Drive Shared Root", {"entity": entity})
@@ -0,0 +1,211 @@
+"""
+Folder sharing without per-child copies.
+
+Access is resolved upwards (drive.utils.files.generate_upward_path): a grant on
+a folder already covers everything below it, so `DriveFile.share` records a
+single Drive Permission on the folder. Sites shared before that still hold the
+per-child copies of the old bulk share, marked with `inherited_from` (see
+`mark_inherited_grants`); those copies follow the folder grant:
+
+- sharing sets their levels and valid_until to the folder's
+- unsharing deletes them
+
+Grants set on a descendant itself (no `inherited_from`) are never touched.
+Copies are found with one join on the user's grants and the lineage index, and
+written `CHUNK_SIZE` at a time with a `drive_share_progress` event to the
+acting user. Up to `SYNC_LIMIT` rows this runs in the request's transaction;
+above it the work moves to a background job that commits every chunk.
+"""
+
+import frappe
+
+from drive.api.shared_roots import SHARED_BY_ME, SHARED_WITH_ME, invalidate_shared_roots
+from drive.utils.lineage import get_descendants, get_lineage, like_prefix, split_lineage
+
+CHUNK_SIZE = 1000
+SYNC_LIMIT = 5000
+LEVELS = ("read", "comment", "share", "write")
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def get_descendant_grants(entity, user):
+    """Names of `user`'s Drive Permissions below `entity` that were copied from its share"""
+    lineage = get_lineage(entity)
+    if lineage:
+        return frappe.db.sql_list(
+            """
+            SELECT p.name FROM `tabDrive Permission` p
+            JOIN `tabDrive File` f ON f.name = p.entity
+            WHERE p.user = %(user)s AND p.inherited_from = %(entity)s
+              AND f.lineage LIKE %(prefix)s AND f.name != %(entity)s
+            """,
+            {"user": user, "prefix": like_prefix(lineage), "entity": entity},
+        )
+    # Chưa có lineage (dữ liệu trước patch): lấy cây con rồi tra theo từng chunk
+    names = []
+    for chunk in _chunks(get_descendants(entity)):
+        names += frappe.db.sql_list(
+            """
+            SELECT name FROM `tabDrive Permission`
+            WHERE user = %(user)s AND inherited_from = %(entity)s AND entity IN %(names)s
+            """,
+            {"user": user, "entity": entity, "names": tuple(chunk)},
+        )
+    return names
+
+
+def mark_inherited_grants():
+    """
+    Set `inherited_from` on the per-child copies left by the old bulk share: a
+    grant equal (levels and valid_until) to a grant of the same user on an
+    ancestor folder is attributed to the nearest such folder. Grants are read
+    `CHUNK_SIZE` at a time and only matched against their own ancestors' grants.
+    """
+    fields = ", ".join(f"p.`{level}`" for level in LEVELS)
+    last = ""
+    while True:
+        grants = frappe.db.sql(
+            f"""
+            SELECT p.name, p.user, p.entity, f.lineage, p.valid_until, {fields}
+            FROM `tabDrive Permission` p
+            JOIN `tabDrive File` f ON f.name = p.entity
+            WHERE p.name > %(last)s AND IFNULL(p.inherited_from, '') = ''
+            ORDER BY p.name
+            LIMIT {CHUNK_SIZE}
+            """,
+            {"last": last},
+            as_dict=True,
+        )
+        if not grants:
+            break
+        last = grants[-1].name
+        _mark_chunk(grants)
+        frappe.db.commit()
+
+
+def _grant_key(grant):
+    return (*(grant[level] for level in LEVELS), grant.valid_until)
+
+
+def _mark_chunk(grants):
+    ancestors = {g.name: split_lineage(g.lineage)[1:] for g in grants}
+    names = {a for chain in ancestors.values() for a in chain}
+    if not names:
+        return
+    folder_grants = {}
+    for chunk in _chunks(list(names)):
+        for ap in frappe.db.sql(
+            f"""
+            SELECT ap.entity, ap.user, ap.inherited_from, ap.valid_until,
+              {", ".join(f"ap.`{level}`" for level in LEVELS)}
+            FROM `tabDrive Permission` ap
+            WHERE ap.entity IN %(ancestors)s AND ap.user IN %(users)s
+            """,
+            {"ancestors": tuple(chunk), "users": tuple({g.user for g in grants})},
+            as_dict=True,
+        ):
+            # Bản copy đã đánh dấu ở chunk trước: quy về folder gốc của nó
+            folder_grants[(ap.entity, ap.user)] = (_grant_key(ap), ap.inherited_from or ap.entity)
+
+    by_folder = {}
+    for grant in grants:
+        key = _grant_key(grant)
+        # split_lineage trả về từ gần đến xa: folder đầu tiên khớp là folder gần nhất
+        folder = next(
+            (
+                folder_grants[(a, grant.user)][1]
+                for a in ancestors[grant.name]
+                if folder_grants.get((a, grant.user), (None,))[0] == key
+            ),
+            None,
+        )
+        if folder:
+            by_folder.setdefault(folder, []).append(grant.name)
+    for folder, names in by_folder.items():
+        frappe.db.sql(
+            "UPDATE `tabDrive Permission` SET inherited_from = %(folder)s WHERE name IN %(names)s",
+            {"folder": folder, "names": tuple(names)},
+        )
+
+
+def _publish_progress(entity, done, total, actor):
+    frappe.publish_realtime(
+        event="drive_share_progress",
+        message={"entity_name": entity, "done": done, "total": total},
+        user=actor,
+    )
+
+
+def get_folder_grant(entity, user):
+    """The folder's own grant for `user` (levels and valid_until), None if unshared"""
+    return frappe.db.get_value(
+        "Drive Permission",
+        {"entity": entity, "user": user},
+        [*LEVELS, "valid_until"],
+        as_dict=True,
+    )
+
+
+def sync_descendant_grants(entity, user, actor=None, names=None, commit=True):
+    """
+    Align `user`'s inherited grants below `entity` with the folder's current
+    grant, or delete them if the folder is no longer shared with `user`. Reads
+    the grant when it runs, so a queued job always applies the latest share.
+    With `commit` (background job) every chunk is committed; inline calls leave
+    the writes to the request's transaction.
+
+    :return: number of grants touched
+    """
+    actor = actor or frappe.session.user
+    if names is None:
+        names = get_descendant_grants(entity, user)
+    if not names:
+        return 0
+
+    grant = get_folder_grant(entity, user)
+    values = {"now": frappe.utils.now(), "actor": actor}
+    if grant:
+        values.update(grant)
+        levels = ", ".join(f"`{level}` = %({level})s" for level in LEVELS)
+        statement = f"""
+            UPDATE `tabDrive Permission`
+            SET {levels},
+                valid_until = %(valid_until)s, modified = %(now)s, modified_by = %(actor)s
+            WHERE name IN %(names)s
+        """
+    else:
+        statement = "DELETE FROM `tabDrive Permission` WHERE name IN %(names)s"
+
+    done = 0
+    for chunk in _chunks(names):
+        values["names"] = tuple(chunk)
+        frappe.db.sql(statement, values)
+        if commit:
+            frappe.db.commit()
+        done += len(chunk)
+        _publish_progress(entity, done, len(names), actor)
+
+    invalidate_shared_roots([(user, SHARED_WITH_ME), (actor, SHARED_BY_ME)])
+    return done
+
+
+def apply_to_descendants(entity, user):
+    """Run `sync_descendant_grants` inline, or as a background job for large subtrees"""
+    user = user or ""
+    names = get_descendant_grants(entity, user)
+    if len(names) <= SYNC_LIMIT:
+        return sync_descendant_grants(entity, user, names=names, commit=False)
+    frappe.enqueue(
+        sync_descendant_grants,
+        queue="long",
+        job_id=f"drive_share_{entity}_{user}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        entity=entity,
+        user=user,
+        actor=frappe.session.user,
+    )
@@ -1,3 +1,5 @@
+from contextlib import contextmanager
+
 import frappe
 from frappe import _
 from pypika import functions as fn
@@ -5,6 +7,120 @@ from drive.utils.files import get_file_type
 
 MEGA_BYTE = 1024**2
 DriveFile = frappe.qb.DocType("Drive File")
+DriveStorageUsage = frappe.qb.DocType("Drive Storage Usage")
+
+
+# Usage counters: one Drive Storage Usage row per (team, owner, is_private, mime_type)
+# holding the size and count of active, non-folder files. Kept in step by
+# Drive File.on_update / on_trash and `track_usage` for bulk updates, and
+# recounted nightly by `recount_storage_usage`.
+
+
+def _usage_key(row):
+    if not row or row.get("is_group") or row.get("is_active") != 1 or not row.get("team"):
+        return None
+    return (row.get("team"), row.get("owner"), int(row.get("is_private") or 0), row.get("mime_type") or "")
+
+
+def apply_usage_deltas(deltas):
+    """
+    :param deltas: {(team, user, is_private, mime_type): (size delta, count delta)}
+    """
+    values = [(*key, size, count) for key, (size, count) in deltas.items() if size or count]
+    if not values:
+        return
+    frappe.db.sql(
+        """
+        INSERT INTO `tabDrive Storage Usage` (team, user, is_private, mime_type, file_size, file_count)
+        VALUES {}
+        ON DUPLICATE KEY UPDATE
+            file_size = file_size + VALUES(file_size),
+            file_count = file_count + VALUES(file_count)
+        """.format(", ".join(["(%s, %s, %s, %s, %s, %s)"] * len(values))),
+        [v for row in values for v in row],
+    )
+
+
+def record_usage_change(before, after):
+    """Apply the usage change of one Drive File going from `before` to `after` (either may be None)"""
+    deltas = {}
+    for row, sign in ((before, -1), (after, 1)):
+        key = _usage_key(row)
+        if key:
+            size, count = deltas.get(key, (0, 0))
+            deltas[key] = (size + sign * (row.get("file_size") or 0), count + sign)
+    apply_usage_deltas(deltas)
+
+
+def _aggregate_usage(entity_names=None, team=None):
+    query = (
+        frappe.qb.from_(DriveFile)
+        .select(
+            DriveFile.team,
+            DriveFile.owner,
+            DriveFile.is_private,
+            DriveFile.mime_type,
+            fn.Sum(DriveFile.file_size),
+            fn.Count("*"),
+        )
+        .where((DriveFile.is_group == 0) & (DriveFile.is_active == 1) & DriveFile.team.notnull())
+        .groupby(DriveFile.team, DriveFile.owner, DriveFile.is_private, DriveFile.mime_type)
+    )
+    if entity_names is not None:
+        query = query.where(DriveFile.name.isin(entity_names))
+    if team:
+        query = query.where(DriveFile.team == team)
+    usage = {}
+    for team, owner, is_private, mime_type, size, count in query.run():
+        key = (team, owner, int(is_private or 0), mime_type or "")
+        old_size, old_count = usage.get(key, (0, 0))
+        usage[key] = (old_size + int(size or 0), old_count + count)
+    return usage
+
+
+@contextmanager
+def track_usage(entity_names):
+    """
+    Wrap bulk SQL / set_value updates of Drive Files so the usage counters follow:
+    the affected rows are aggregated before and after and only the difference is applied.
+    """
+    entity_names = list(entity_names or [])
+    if not entity_names:
+        yield
+        return
+    before = _aggregate_usage(entity_names)
+    yield
+    after = _aggregate_usage(entity_names)
+    deltas = {}
+    for key in before.keys() | after.keys():
+        size_before, count_before = before.get(key, (0, 0))
+        size_after, count_after = after.get(key, (0, 0))
+        deltas[key] = (size_after - size_before, count_after - count_before)
+    apply_usage_deltas(deltas)
+
+
+def recount_storage_usage(team=None):
+    """
+    Nightly job: rebuild the usage counters from Drive File and log any drift
+    """
+    teams = [team] if team else frappe.get_all("Drive Team", pluck="name")
+    for team in teams:
+        actual = _aggregate_usage(team=team)
+        stored = {
+            (r.team, r.user, int(r.is_private or 0), r.mime_type or ""): (r.file_size, r.file_count)
+            for r in frappe.get_all(
+                "Drive Storage Usage",
+                filters={"team": team},
+                fields=["team", "user", "is_private", "mime_type", "file_size", "file_count"],
+            )
+        }
+        drifted = sum(1 for k in stored.keys() | actual.keys() if stored.get(k) != actual.get(k))
+        if not drifted:
+            continue
+        frappe.logger().info(f"recount_storage_usage: fixed {drifted} counters in team {team}")
+        frappe.db.delete("Drive Storage Usage", {"team": team})
+        apply_usage_deltas(actual)
+        frappe.db.commit()
 
 
 @frappe.whitelist()
@@ -39,19 +155,24 @@ def storage_breakdown(team, owned_only):
         r["file_type"] = get_file_type(r)
 
     query = (
-        frappe.qb.from_(DriveFile)
-        .select(DriveFile.mime_type, fn.Sum(DriveFile.file_size).as_("file_size"))
-        .where((DriveFile.is_group == 0) & (DriveFile.is_active == 1) & (DriveFile.team == team))
+        frappe.qb.from_(DriveStorageUsage)
+        .select(DriveStorageUsage.mime_type, fn.Sum(DriveStorageUsage.file_size).as_("file_size"))
+        .where(DriveStorageUsage.team == team)
     )
 
     if owned_only:
-        query = query.where(DriveFile.owner == frappe.session.user)
+        query = query.where(DriveStorageUsage.user == frappe.session.user)
     else:
-        query = query.where(DriveFile.is_private == 0)
+        query = query.where(DriveStorageUsage.is_private == 0)
+
+    total = query.groupby(DriveStorageUsage.mime_type).run(as_dict=True)
+    for r in total:
+        r["mime_type"] = r["mime_type"] or None
+        r["file_size"] = int(r["file_size"] or 0)
 
     return {
         "limit": limit,
-        "total": query.groupby("mime_type").run(as_dict=True),
+        "total": total,
         "entities": entities,
     }
 
@@ -59,17 +180,16 @@ def storage_breakdown(team, owned_only):
 @frappe.whitelist()
 def storage_bar_data(team):
     query = (
-        frappe.qb.from_(DriveFile)
+        frappe.qb.from_(DriveStorageUsage)
         .where(
-            (DriveFile.team == team)
-            & (DriveFile.is_group == 0)
-            & (DriveFile.owner == frappe.session.user)
-            & (DriveFile.is_active == 1)
+            (DriveStorageUsage.team == team)
+            & (DriveStorageUsage.user == frappe.session.user)
         )
-        .select(fn.Coalesce(fn.Sum(DriveFile.file_size), 0).as_("total_size"))
+        .select(fn.Coalesce(fn.Sum(DriveStorageUsage.file_size), 0).as_("total_size"))
     )
 
     result = query.run(as_dict=True)[0]
+    result["total_size"] = int(result["total_size"])
     site_config = frappe.get_site_config()
     plan_limit = site_config.get("plan_limit", {})
     max_storage = plan_limit.get("max_storage_usage")
@@ -0,0 +1,186 @@
+"""
+Set-based trash / restore of Drive File subtrees, used by remove_or_restore.
+
+For each selected entity the subtree is read once from the lineage index;
+`is_active` of the descendants is flipped with chunked UPDATEs, `Drive Trash`
+rows are bulk inserted / deleted, usage counters and folder sizes get their
+deltas applied directly, and only the selected entity itself goes through
+`Document.save`. Realtime notices are collected across the whole request and
+sent once per affected user by `publish_trash_events`.
+"""
+
+import frappe
+
+from drive.api.storage import apply_usage_deltas, storage_bar_data
+from drive.utils.files import update_file_size
+from drive.utils.lineage import get_descendants, split_lineage
+
+CHUNK_SIZE = 1000
+SUBTREE_FIELDS = [
+    "name",
+    "team",
+    "owner",
+    "path",
+    "is_private",
+    "mime_type",
+    "file_size",
+    "is_group",
+    "is_active",
+]
+# Permission rows that are not a concrete user
+NON_USER_PERMISSIONS = ("", "$TEAM")
+
+
+def _chunks(items, size=CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i : i + size]
+
+
+def check_restore_quota(doc):
+    """Raise if restoring `doc` would exceed its team's storage limit"""
+    storage = storage_bar_data(doc.team)
+    # limit tính bằng GB, total_size tính bằng bytes
+    available = storage["limit"] * 1024 * 1024 * 1024 - storage["total_size"]
+    if available < (doc.file_size or 0):
+        frappe.throw("You're out of storage!", ValueError)
+
+
+def _insert_trash_rows(rows, user):
+    """Bulk insert Drive Trash rows for `rows` that the user has not trashed yet"""
+    now = frappe.utils.now()
+    for chunk in _chunks(rows):
+        existing = set(
+            frappe.db.sql_list(
+                """
+                SELECT entity FROM `tabDrive Trash`
+                WHERE user = %(user)s AND entity IN %(names)s
+                """,
+                {"user": user, "names": tuple(r.name for r in chunk)},
+            )
+        )
+        frappe.db.bulk_insert(
+            "Drive Trash",
+            ["entity", "user", "team", "original_path", "trashed_on", "owner", "modified_by", "creation", "modified"],
+            [
+                (r.name, user, r.team, r.path, now, user, user, now, now)
+                for r in chunk
+                if r.name not in existing
+            ],
+        )
+
+
+def _delete_trash_rows(names, user):
+    for chunk in _chunks(names):
+        frappe.db.sql(
+            "DELETE FROM `tabDrive Trash` WHERE user = %(user)s AND entity IN %(names)s",
+            {"user": user, "names": tuple(chunk)},
+        )
+
+
+def _set_active(rows, flag, user):
+    # Khi xoá theo cascade KHÔNG cập nhật modified: giữ timestamp cũ hơn thư mục cha
+    # để trang thùng rác phân biệt mục bị xoá trực tiếp với mục con
+    touch = "" if flag == 0 else ", modified = %(now)s, modified_by = %(user)s"
+    for chunk in _chunks([r.name for r in rows]):
+        frappe.db.sql(
+            f"UPDATE `tabDrive File` SET is_active = %(flag)s{touch} WHERE name IN %(names)s",
+            {"flag": flag, "now": frappe.utils.now(), "user": user, "names": tuple(chunk)},
+        )
+
+    deltas = {}
+    sign = 1 if flag == 1 else -1
+    for r in rows:
+        if r.is_group or not r.team:
+            continue
+        key = (r.team, r.owner, int(r.is_private or 0), r.mime_type or "")
+        size, count = deltas.get(key, (0, 0))
+        deltas[key] = (size + sign * int(r.file_size or 0), count + sign)
+    apply_usage_deltas(deltas)
+
+
+def _collect_recipients(rows, recipients, ancestors=()):
+    """
+    Add everyone who can see one of `rows` to `recipients`: owners and users
+    holding a permission on a row or on one of `ancestors` (inherited) get a
+    personal event; rows visible to the whole team or shared publicly / with
+    `$TEAM` go into the broadcast (key None).
+    """
+    names = [r.name for r in rows]
+    for r in rows:
+        if r.owner:
+            recipients.setdefault(r.owner, set()).add(r.name)
+        if not r.is_private:
+            recipients.setdefault(None, set()).add(r.name)
+    if ancestors:
+        # Quyền trên thư mục cha được kế thừa: người nhận thấy toàn bộ cây con
+        for user in frappe.db.sql_list(
+            "SELECT DISTINCT user FROM `tabDrive Permission` WHERE entity IN %(names)s",
+            {"names": tuple(ancestors)},
+        ):
+            key = None if user in NON_USER_PERMISSIONS else user
+            recipients.setdefault(key, set()).update(names)
+    for chunk in _chunks(names):
+        for entity, user in frappe.db.sql(
+            "SELECT entity, user FROM `tabDrive Permission` WHERE entity IN %(names)s",
+            {"names": tuple(chunk)},
+        ):
+            # Quyền công khai / cả nhóm: gửi chung một sự kiện broadcast
+            key = None if user in NON_USER_PERMISSIONS else user
+            recipients.setdefault(key, set()).add(entity)
+
+
+def toggle_subtree(doc, flag, user, recipients=None):
+    """
+    Trash (`flag`=0) or restore (`flag`=1) `doc` and everything below it.
+
+    :param recipients: {user: set(entity names)} filled with who to notify on trash,
+        only once every write succeeded (a failed subtree rolled back to a savepoint
+        leaves it untouched)
+    """
+    if flag == 1:
+        check_restore_quota(doc)
+
+    descendants = [
+        r for r in get_descendants(doc.name, fields=SUBTREE_FIELDS) if r.is_active in (0, 1)
+    ]
+    top = frappe._dict({f: doc.get(f) for f in SUBTREE_FIELDS})
+    subtree = [top] + descendants
+
+    collected = {}
+    if flag == 0:
+        if recipients is not None:
+            _collect_recipients(subtree, collected, split_lineage(doc.lineage)[1:])
+        _insert_trash_rows(subtree, user)
+    else:
+        _delete_trash_rows([r.name for r in subtree], user)
+
+    _set_active([r for r in descendants if r.is_active != flag], flag, user)
+
+    if doc.parent_entity and doc.is_active != flag:
+        update_file_size(doc.parent_entity, (doc.file_size or 0) * (1 if flag else -1))
+
+    doc.is_active = flag
+    doc.flags.ignore_links = True
+    doc.save(ignore_permissions=flag == 1)
+    for key, names in collected.items():
+        recipients.setdefault(key, set()).update(names)
+    return len(subtree)
+
+
+def publish_trash_events(recipients):
+    """One `permission_revoked` event per affected user (plus one broadcast for team-visible and public/team shares)"""
+    now = frappe.utils.now()
+    for user, names in recipients.items():
+        names = sorted(names)
+        message = {
+            "entity_name": names[0] if len(names) == 1 else None,
+            "entity_names": names,
+            "action": "moved_to_trash",
+            "deleted": False,
+            "unshared": False,
+            "reason": "File has been moved to trash",
+            "timestamp": now,
+        }
+        frappe.publish_realtime(
+            event="permission_revoked", message=message, user=user, after_commit=True
+        )
@@ -0,0 +1,83 @@
+import click
+import frappe
+from frappe.commands import get_site, pass_context
+
+
+@click.command("drive-index-report")
+@click.option("--min-ms", default=100, type=float, help="Report digests slower than this on average")
+@click.option("--limit", default=20, type=int, help="Number of query digests to show")
+@click.option("--fix", is_flag=True, default=False, help="Create the missing managed indexes")
+@pass_context
+def drive_index_report(context, min_ms, limit, fix):
+    "Report missing Drive indexes and slow or unindexed queries on Drive tables"
+    from drive.utils.indexes import add_drive_indexes, get_missing_indexes, get_slow_queries
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        missing = get_missing_indexes()
+        click.secho("Missing managed indexes", bold=True)
+        for doctype, fields in missing:
+            click.echo(f"  {doctype}: ({', '.join(fields)})")
+        if not missing:
+            click.echo("  none")
+        elif fix:
+            for doctype in {doctype for doctype, _ in missing}:
+                add_drive_indexes(doctype)
+            frappe.db.commit()
+            click.echo(f"  created {len(missing)} index(es)")
+
+        click.secho(f"\nSlow (avg >= {min_ms} ms) or unindexed queries", bold=True)
+        rows = get_slow_queries(min_ms, limit)
+        if rows is None:
+            click.echo("  performance_schema is disabled; enable it in the MariaDB config to collect digests")
+            return
+        for row in rows:
+            flags = []
+            if row.no_index:
+                flags.append(f"no index x{row.no_index}")
+            if row.no_good_index:
+                flags.append(f"bad index x{row.no_good_index}")
+            click.echo(
+                f"  {row.calls} calls, avg {row.avg_ms} ms, total {row.total_ms} ms, "
+                f"{row.rows_examined} rows examined / {row.rows_sent} sent"
+                + (f" [{', '.join(flags)}]" if flags else "")
+            )
+            click.echo(f"    {row.query[:300]}")
+        if not rows:
+            click.echo("  none")
+    finally:
+        frappe.destroy()
+
+
+@click.command("drive-blob-report")
+@click.option("--delete", is_flag=True, default=False, help="Delete the orphans instead of only reporting them")
+@click.option("--grace-hours", default=24, type=float, help="Ignore blobs modified more recently than this")
+@click.option("--max-per-second", default=2000, type=int, help="Deletion rate limit (keys per second)")
+@pass_context
+def drive_blob_report(context, delete, grace_hours, max_per_second):
+    "Report (or delete) storage blobs that no Drive File refers to"
+    from drive.utils.blobs import reap_orphan_blobs
+
+    site = get_site(context)
+    frappe.init(site=site)
+    frappe.connect()
+    try:
+        report = reap_orphan_blobs(
+            dry_run=not delete, grace_hours=grace_hours, max_per_second=max_per_second
+        )
+        click.secho(f"Orphan blobs ({report.storage} storage)", bold=True)
+        click.echo(f"  scanned {report.scanned} keys, {report.scanned_bytes / 1024**2:.1f} MB")
+        click.echo(f"  orphans {report.orphans} keys, {report.orphan_bytes / 1024**2:.1f} MB")
+        for key in report.sample:
+            click.echo(f"    {key}")
+        if delete:
+            click.echo(f"  deleted {report.deleted}, failed {report.failed} in {report.seconds} s")
+        elif report.orphans:
+            click.echo("  dry run; pass --delete to remove them")
+    finally:
+        frappe.destroy()
+
+
+commands = [drive_index_report, drive_blob_report]
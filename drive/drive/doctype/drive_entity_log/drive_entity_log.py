@@ -6,4 +6,13 @@ from frappe.model.document import Document
 
 
 class DriveEntityLog(Document):
-    pass
+    def after_insert(self):
+        from drive.api.shared_roots import touch_shared_root
+
+        touch_shared_root(self.entity_name, self.last_interaction)
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Entity Log")
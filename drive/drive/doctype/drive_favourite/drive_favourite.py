@@ -7,3 +7,9 @@ from frappe.model.document import Document
 
 class DriveFavourite(Document):
     pass
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Favourite")
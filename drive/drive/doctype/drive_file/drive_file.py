@@ -1,4 +1,4 @@
-from drive.api.notifications import notify_share
+from drive.api.notifications import notify_share, reset_unread_count
 import frappe
 from frappe.model.document import Document
 from pathlib import Path
@@ -12,9 +12,15 @@ from drive.utils.files import (
 )
 from drive.api.files import get_ancestors_of
 from drive.utils.files import generate_upward_path
+from drive.utils.lineage import is_descendant, move_lineage, set_lineage
 from drive.api.activity import create_new_activity_log, create_new_entity_activity_log
 from drive.api.permissions import user_has_permission
 from drive.api.onlyoffice import revoke_editing_access
+from drive.search.index import queue_index, remove_entity
+from drive.api.storage import record_usage_change, track_usage
+from drive.api.move import migrate_subtree
+from drive.api.sharing import apply_to_descendants
+from drive.api.shared_roots import remove_shared_root_entity, sync_shared_root_entity
 
 
 class DriveFile(Document):
@@ -29,10 +35,31 @@ class DriveFile(Document):
             user=frappe.session.user,
         )
 
+    def before_save(self):
+        set_lineage(self)
+
+    def on_update(self):
+        move_lineage(self)
+        record_usage_change(self.get_doc_before_save(), self)
+        sync_shared_root_entity(self)
+        if self.has_value_changed("title") or self.has_value_changed("team"):
+            queue_index([self.name])
+
     def on_trash(self):
+        record_usage_change(self, None)
+        remove_entity(self.name)
+        remove_shared_root_entity(self.name)
+        frappe.db.delete("Drive File Text", {"entity": self.name})
         frappe.db.delete("Drive Favourite", {"entity": self.name})
         frappe.db.delete("Drive Entity Log", {"entity_name": self.name})
         frappe.db.delete("Drive Permission", {"entity": self.name})
+        reset_unread_count(
+            frappe.get_all(
+                "Drive Notification",
+                filters={"notif_doctype_name": self.name, "read": 0},
+                pluck="to_user",
+            )
+        )
         frappe.db.delete("Drive Notification", {"notif_doctype_name": self.name})
         frappe.db.delete("Drive Entity Activity Log", {"entity": self.name})
 
@@ -109,189 +136,38 @@ class DriveFile(Document):
                 new_parent = get_home_folder(self.team).name
                 print(f"Using current team home folder: {new_parent}")
 
-        new_parent_team = frappe.db.get_value("Drive File", new_parent, "team")
-        current_team = self.team
-
-        print(
-            f"Move debug: current_team={current_team}, new_parent_team={new_parent_team}, new_parent={new_parent}"
-        )
-
-        # Hàm helper để xóa tất cả permissions
-        def delete_all_permissions(entity_name, include_children=False):
-            """Xóa tất cả permissions của file và file con (nếu có)"""
-            # Xóa permission của file chính
-            frappe.db.sql(
-                """
-                DELETE FROM `tabDrive Permission`
-                WHERE entity = %s
-                """,
-                entity_name,
-            )
-
-            # Nếu cần xóa permission của file con
-            if include_children:
-
-                def get_all_descendants(parent_name):
-                    """Lấy tất cả file con và file cháu đệ quy"""
-                    descendants = []
-                    direct_children = frappe.db.get_all(
-                        "Drive File",
-                        filters={"parent_entity": parent_name},
-                        fields=["name", "is_group"],
-                    )
-                    for child in direct_children:
-                        descendants.append(child.name)
-                        if child.is_group:
-                            descendants.extend(get_all_descendants(child.name))
-                    return descendants
-
-                child_names = get_all_descendants(entity_name)
-                if child_names:
-                    frappe.db.sql(
-                        """
-                        DELETE FROM `tabDrive Permission`
-                        WHERE entity IN %(children)s
-                        """,
-                        {"children": child_names},
-                    )
-
-        print(
-            f"Clearing permissions: is_private={is_private}, team change={current_team} != {new_parent_team}"
-        )
-        # if new_parent == self.parent_entity:
-        # **LUÔN XÓA PERMISSIONS** khi có thay đổi is_private hoặc team
-        should_clear_permissions = (
-            self.is_private != is_private  # Có thay đổi private status
-            or current_team != new_parent_team  # Hoặc có chuyển team
-        )
-
-        if should_clear_permissions:
-            print(
-                f"Clearing permissions: is_private={is_private}, team change={current_team} != {new_parent_team}"
+        if new_parent == self.name:
+            frappe.throw(
+                "Cannot move into itself",
+                frappe.PermissionError,
             )
-            delete_all_permissions(self.name, include_children=self.is_group)
-
-            # Cập nhật team cho file con nếu cần
-            if self.is_group and current_team != new_parent_team:
-
-                def get_all_descendants(parent_name):
-                    descendants = []
-                    direct_children = frappe.db.get_all(
-                        "Drive File",
-                        filters={"parent_entity": parent_name},
-                        fields=["name", "is_group"],
-                    )
-                    for child in direct_children:
-                        descendants.append(child.name)
-                        if child.is_group:
-                            descendants.extend(get_all_descendants(child.name))
-                    return descendants
-
-                child_names = get_all_descendants(self.name)
-                if child_names:
-                    frappe.db.sql(
-                        """
-                        UPDATE `tabDrive File`
-                        SET team = %(team)s
-                        WHERE name IN %(children)s
-                        """,
-                        {"team": new_parent_team, "children": child_names},
-                    )
-
-            if current_team != new_parent_team:
-                self.team = new_parent_team
-
-            if is_private is not None:
-                self.is_private = int(is_private)
 
-            self.save()
-
-        result = frappe.get_value(
-            "Drive File",
-            self.parent_entity,
-            ["title", "team", "name", "is_private"],
-            as_dict=True,
+        parent = frappe.db.get_value(
+            "Drive File", new_parent, ["team", "is_group", "is_private"], as_dict=True
         )
-        result["is_private"] = self.is_private
+        if not parent or not parent.is_group:
+            raise NotADirectoryError()
 
-        if new_parent == self.name:
+        if is_descendant(new_parent, self.name):
             frappe.throw(
                 "Cannot move into itself",
                 frappe.PermissionError,
             )
 
-        is_group = frappe.db.get_value("Drive File", new_parent, "is_group")
-        if not is_group:
-            raise NotADirectoryError()
+        new_is_private = int(is_private if is_private is not None else parent.is_private or 0)
 
-        for child in self.get_children():
-            if child.name == self.name or child.name == new_parent:
-                frappe.throw(
-                    "Cannot move into itself",
-                    frappe.PermissionError,
-                )
-                return frappe.get_value(
-                    "Drive File",
-                    self.parent_entity,
-                    ["title", "team", "name", "is_private"],
-                    as_dict=True,
-                )
+        # Đổi team / private: cả cây con được chuyển bằng các câu lệnh gộp,
+        # quyền chia sẻ bị xoá và blob được chuyển sang home của team mới ở job nền
+        migrate_subtree(self, parent.team, new_is_private)
 
         update_file_size(self.parent_entity, -self.file_size)
         update_file_size(new_parent, +self.file_size)
 
-        will_change_team = current_team != new_parent_team
-        print(
-            f"Will change team: {will_change_team}, Current: {current_team}, New: {new_parent_team}"
-        )
-
-        # **THAY ĐỔI CHÍNH:** Luôn xóa permissions khi di chuyển file
-        # delete_all_permissions(self.name, include_children=self.is_group)
-
-        # Cập nhật team nếu cần
-        if will_change_team:
-            if self.is_group:
-
-                def get_all_descendants(parent_name):
-                    descendants = []
-                    direct_children = frappe.db.get_all(
-                        "Drive File",
-                        filters={"parent_entity": parent_name},
-                        fields=["name", "is_group"],
-                    )
-                    for child in direct_children:
-                        descendants.append(child.name)
-                        if child.is_group:
-                            descendants.extend(get_all_descendants(child.name))
-                    return descendants
-
-                child_names = get_all_descendants(self.name)
-                if child_names:
-                    frappe.db.sql(
-                        """
-                        UPDATE `tabDrive File`
-                        SET team = %(team)s
-                        WHERE name IN %(children)s
-                        """,
-                        {"team": new_parent_team, "children": child_names},
-                    )
-
-            self.team = new_parent_team
-
-        # Cập nhật thông tin file
+        self.team = parent.team
         self.parent_entity = new_parent
-
-        if is_private is not None:
-            self.is_private = int(is_private)
-        else:
-            self.is_private = frappe.db.get_value(
-                "Drive File", new_parent, "is_private"
-            )
-
+        self.is_private = new_is_private
         self.save()
 
-        print(f"Final save: team={self.team}, parent={self.parent_entity}")
-
         result = frappe.get_value(
             "Drive File",
             self.parent_entity,
@@ -873,223 +749,14 @@ class DriveFile(Document):
                     )
                     print(f"   User: {user}, Owner: {self.owner}")
 
-        # ✅ Nếu đây là folder, tự động chia sẻ tất cả children
+        # ✅ Folder: quyền được kế thừa xuống children, chỉ đồng bộ các quyền riêng đã có bên dưới
         if self.is_group:
-            self._share_children_bulk(
-                user=user,
-                read=read,
-                comment=comment,
-                share=share,
-                write=write,
-                valid_until=valid_until,
-            )
+            apply_to_descendants(self.name, user)
         # ✅ Chỉ revoke nếu user đang có write và bị giảm xuống
 
         create_new_activity_log(entity=self.name, last_interaction=frappe.utils.now())
         notify_share(self.name, permission.name)
 
-    def _share_children_bulk(
-        self, user=None, read=None, comment=None, share=None, write=None, valid_until=""
-    ):
-        """
-        Share all children of this folder recursively using parent_entity relationship.
-        Uses recursive CTE to get all descendants efficiently.
-        """
-        try:
-            child_names = self._get_all_descendants_recursive(self.name)
-        except Exception as e:
-            print(f"WARNING: Recursive query failed, using iterative approach: {e}")
-            child_names = self._get_all_descendants_iterative(self.name)
-
-        if not child_names:
-            print(f"DEBUG - No children found for folder {self.name}")
-            return
-
-        print(f"DEBUG - Sharing {len(child_names)} children of {self.name}")
-
-        # ✅ Chuẩn bị dữ liệu để bulk insert/update
-        now = frappe.utils.now()
-        user_value = user or ""
-
-        # Build permission values
-        permission_values = {}
-        if read is not None:
-            permission_values["read"] = int(read)
-        if comment is not None:
-            permission_values["comment"] = int(comment)
-        if share is not None:
-            permission_values["share"] = int(share)
-        if write is not None:
-            permission_values["write"] = int(write)
-
-        # ✅ Kiểm tra xem children nào đã có permission
-        existing_permissions = frappe.db.sql(
-            """
-            SELECT entity, name
-            FROM `tabDrive Permission`
-            WHERE entity IN ({})
-            AND user = %s
-            """.format(
-                ",".join(["%s"] * len(child_names))
-            ),
-            child_names + [user_value],
-            as_dict=1,
-        )
-
-        existing_entities = {p.entity: p.name for p in existing_permissions}
-        entities_to_insert = [
-            name for name in child_names if name not in existing_entities
-        ]
-        entities_to_update = [name for name in child_names if name in existing_entities]
-
-        print(
-            f"DEBUG - Insert: {len(entities_to_insert)}, Update: {len(entities_to_update)}"
-        )
-
-        # ✅ Bulk UPDATE existing permissions
-        if entities_to_update and permission_values:
-            update_fields = []
-            update_values = []
-
-            for field, value in permission_values.items():
-                update_fields.append(f"`{field}` = %s")
-                update_values.append(value)
-
-            if valid_until:
-                update_fields.append("`valid_until` = %s")
-                update_values.append(valid_until)
-
-            update_fields.append("`modified` = %s")
-            update_values.append(now)
-
-            # Add WHERE clause values
-            update_values.extend(entities_to_update)
-            update_values.append(user_value)
-
-            frappe.db.sql(
-                """
-                UPDATE `tabDrive Permission`
-                SET {}
-                WHERE entity IN ({})
-                AND user = %s
-                """.format(
-                    ", ".join(update_fields), ",".join(["%s"] * len(entities_to_update))
-                ),
-                update_values,
-            )
-
-        # ✅ Bulk INSERT new permissions
-        if entities_to_insert:
-            insert_values = []
-            for entity in entities_to_insert:
-                perm_name = frappe.generate_hash(length=10)
-
-                # Build values tuple
-                values = [
-                    perm_name,  # name
-                    now,  # creation
-                    now,  # modified
-                    frappe.session.user,  # modified_by
-                    frappe.session.user,  # owner
-                    0,  # docstatus
-                    entity,  # entity
-                    user_value,  # user
-                    permission_values.get("read", 0),
-                    permission_values.get("comment", 0),
-                    permission_values.get("share", 0),
-                    permission_values.get("write", 0),
-                    valid_until or None,
-                ]
-                insert_values.append(values)
-
-            # Batch insert (500 records at a time to avoid query size limits)
-            batch_size = 500
-            for i in range(0, len(insert_values), batch_size):
-                batch = insert_values[i : i + batch_size]
-
-                placeholders = ",".join(
-                    ["(%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"]
-                    * len(batch)
-                )
-                flat_values = [item for sublist in batch for item in sublist]
-
-                frappe.db.sql(
-                    f"""
-                    INSERT INTO `tabDrive Permission`
-                    (name, creation, modified, modified_by, owner, docstatus, 
-                    entity, user, `read`, `comment`, `share`, `write`, valid_until)
-                    VALUES {placeholders}
-                    """,
-                    flat_values,
-                )
-
-        frappe.db.commit()
-        print(f"DEBUG - Successfully shared {len(child_names)} children")
-
-    def _get_all_descendants_recursive(self, parent_name):
-        """
-        Get all descendants using recursive CTE (Common Table Expression).
-        Much faster than iterative approach for deep folder structures.
-        """
-        try:
-            result = frappe.db.sql(
-                """
-                WITH RECURSIVE descendants AS (
-                    SELECT name, parent_entity, is_group
-                    FROM `tabDrive File`
-                    WHERE parent_entity = %(parent)s
-                    AND is_active = 1
-                    
-                    UNION ALL
-                    
-                    SELECT f.name, f.parent_entity, f.is_group
-                    FROM `tabDrive File` f
-                    INNER JOIN descendants d ON f.parent_entity = d.name
-                    WHERE f.is_active = 1
-                )
-                SELECT name FROM descendants
-                """,
-                {"parent": parent_name},
-                as_list=True,
-            )
-            return [row[0] for row in result]
-        except Exception as e:
-            raise e
-
-    def _get_all_descendants_iterative(self, parent_name, max_depth=50):
-        """
-        Fallback: Get all descendants iteratively using parent_entity.
-        Used when recursive CTE is not supported or fails.
-        """
-        all_descendants = []
-        current_level = [parent_name]
-        level = 0
-
-        while current_level and level < max_depth:
-            children = frappe.db.sql(
-                """
-                SELECT name, is_group
-                FROM `tabDrive File`
-                WHERE parent_entity IN ({})
-                AND is_active = 1
-                """.format(
-                    ",".join(["%s"] * len(current_level))
-                ),
-                current_level,
-                as_dict=True,
-            )
-
-            if not children:
-                break
-
-            child_names = [c["name"] for c in children]
-            all_descendants.extend(child_names)
-
-            current_level = [c["name"] for c in children if c["is_group"]]
-            level += 1
-
-        return all_descendants
-
     @frappe.whitelist()
     def unshare(self, user=None):
         """Unshare this file or folder with the specified user
@@ -1113,6 +780,8 @@ class DriveFile(Document):
         if perm_name:
             revoke_editing_access(self.name, user)
             frappe.delete_doc("Drive Permission", perm_name, ignore_permissions=True)
+        if self.is_group:
+            apply_to_descendants(self.name, user)
 
     @frappe.whitelist()
     def move_owner(
@@ -1152,118 +821,119 @@ class DriveFile(Document):
             )
 
             # Chỉ thay đổi parent_entity và team nếu đây là file gốc được chuyển
-            if is_root_transfer:
-                # TH1: File is_private = 1 -> chuyển vào personal drive của new_owner
-                if self.is_private:
-                    print(f"TH1: File is private, moving to new owner's personal drive")
+            with track_usage([self.name]):
+                if is_root_transfer:
+                    # TH1: File is_private = 1 -> chuyển vào personal drive của new_owner
+                    if self.is_private:
+                        print(f"TH1: File is private, moving to new owner's personal drive")
+
+                        new_owner_default_team = frappe.db.get_value(
+                            "Drive Settings", {"user": new_owner}, "default_team"
+                        )
 
-                    new_owner_default_team = frappe.db.get_value(
-                        "Drive Settings", {"user": new_owner}, "default_team"
-                    )
+                        # ✅ FIX: Luôn cập nhật parent_entity về home folder của new_owner khi transfer
+                        # Vì đây là root transfer, file phải nằm ở root của new owner's My Drive
+                        if new_owner_default_team:
+                            new_home = get_home_folder(new_owner_default_team)["name"]
+                            frappe.db.set_value(
+                                "Drive File",
+                                self.name,
+                                {
+                                    "owner": new_owner,
+                                    "team": new_owner_default_team,
+                                    "parent_entity": new_home,
+                                },
+                            )
+                        else:
+                            # Nếu new_owner chưa có default team, giữ nguyên team nhưng vẫn đổi owner và parent
+                            current_team_home = get_home_folder(self.team)["name"]
+                            frappe.db.set_value(
+                                "Drive File",
+                                self.name,
+                                {
+                                    "owner": new_owner,
+                                    "parent_entity": current_team_home,
+                                },
+                            )
 
-                    # ✅ FIX: Luôn cập nhật parent_entity về home folder của new_owner khi transfer
-                    # Vì đây là root transfer, file phải nằm ở root của new owner's My Drive
-                    if new_owner_default_team:
-                        new_home = get_home_folder(new_owner_default_team)["name"]
-                        frappe.db.set_value(
-                            "Drive File",
-                            self.name,
-                            {
-                                "owner": new_owner,
-                                "team": new_owner_default_team,
-                                "parent_entity": new_home,
-                            },
+                    # TH2: File trong team X, new_owner là member của team X -> chỉ đổi owner, GIỮ NGUYÊN vị trí
+                    elif is_new_owner_team_member:
+                        print(
+                            f"TH2: New owner is team member, only changing owner (keep parent_entity)"
                         )
+                        # ✅ Khi cùng team, chỉ đổi owner, GIỮ NGUYÊN parent_entity
+                        # Điều này cho phép folder B vẫn nằm trong folder A sau khi transfer
+                        frappe.db.set_value("Drive File", self.name, "owner", new_owner)
+
+                    # TH3: File trong team X, new_owner KHÔNG phải member -> đổi owner + set is_private + chuyển vào personal drive
                     else:
-                        # Nếu new_owner chưa có default team, giữ nguyên team nhưng vẫn đổi owner và parent
-                        current_team_home = get_home_folder(self.team)["name"]
-                        frappe.db.set_value(
-                            "Drive File",
-                            self.name,
-                            {
-                                "owner": new_owner,
-                                "parent_entity": current_team_home,
-                            },
+                        print(
+                            f"TH3: New owner is NOT team member, setting private and moving to personal drive"
                         )
-
-                # TH2: File trong team X, new_owner là member của team X -> chỉ đổi owner, GIỮ NGUYÊN vị trí
-                elif is_new_owner_team_member:
-                    print(
-                        f"TH2: New owner is team member, only changing owner (keep parent_entity)"
-                    )
-                    # ✅ Khi cùng team, chỉ đổi owner, GIỮ NGUYÊN parent_entity
-                    # Điều này cho phép folder B vẫn nằm trong folder A sau khi transfer
-                    frappe.db.set_value("Drive File", self.name, "owner", new_owner)
-
-                # TH3: File trong team X, new_owner KHÔNG phải member -> đổi owner + set is_private + chuyển vào personal drive
+                        new_owner_default_team = frappe.db.get_value(
+                            "Drive Settings", {"user": new_owner}, "default_team"
+                        )
+                        if new_owner_default_team:
+                            new_home = get_home_folder(new_owner_default_team)["name"]
+                            frappe.db.set_value(
+                                "Drive File",
+                                self.name,
+                                {
+                                    "owner": new_owner,
+                                    "is_private": 1,
+                                    "team": new_owner_default_team,
+                                    "parent_entity": new_home,
+                                },
+                            )
+                        else:
+                            # Nếu new_owner chưa có default team, giữ nguyên team nhưng vẫn move về team root
+                            current_team_home = get_home_folder(self.team)["name"]
+                            frappe.db.set_value(
+                                "Drive File",
+                                self.name,
+                                {
+                                    "owner": new_owner,
+                                    "is_private": 1,
+                                    "parent_entity": current_team_home,
+                                },
+                            )
                 else:
-                    print(
-                        f"TH3: New owner is NOT team member, setting private and moving to personal drive"
+                    # Đây là file con, chỉ đổi owner và is_private (nếu cần), KHÔNG đổi parent_entity
+                    print(f"Child file: Only changing owner, keeping parent_entity intact")
+
+                    # Nếu file cha đã chuyển sang is_private, file con cũng phải is_private
+                    # Kiểm tra parent entity để xác định
+                    parent_file = (
+                        frappe.get_doc("Drive File", self.parent_entity)
+                        if self.parent_entity
+                        else None
                     )
-                    new_owner_default_team = frappe.db.get_value(
-                        "Drive Settings", {"user": new_owner}, "default_team"
+                    should_be_private = (
+                        parent_file.is_private if parent_file else self.is_private
                     )
-                    if new_owner_default_team:
-                        new_home = get_home_folder(new_owner_default_team)["name"]
+
+                    # ✅ FIX: Cập nhật team của file con để khớp với team của folder cha
+                    parent_team = parent_file.team if parent_file else self.team
+
+                    if should_be_private and not is_new_owner_team_member:
                         frappe.db.set_value(
                             "Drive File",
                             self.name,
                             {
                                 "owner": new_owner,
                                 "is_private": 1,
-                                "team": new_owner_default_team,
-                                "parent_entity": new_home,
+                                "team": parent_team,  # Cập nhật team
                             },
                         )
                     else:
-                        # Nếu new_owner chưa có default team, giữ nguyên team nhưng vẫn move về team root
-                        current_team_home = get_home_folder(self.team)["name"]
                         frappe.db.set_value(
                             "Drive File",
                             self.name,
                             {
                                 "owner": new_owner,
-                                "is_private": 1,
-                                "parent_entity": current_team_home,
+                                "team": parent_team,  # Cập nhật team
                             },
                         )
-            else:
-                # Đây là file con, chỉ đổi owner và is_private (nếu cần), KHÔNG đổi parent_entity
-                print(f"Child file: Only changing owner, keeping parent_entity intact")
-
-                # Nếu file cha đã chuyển sang is_private, file con cũng phải is_private
-                # Kiểm tra parent entity để xác định
-                parent_file = (
-                    frappe.get_doc("Drive File", self.parent_entity)
-                    if self.parent_entity
-                    else None
-                )
-                should_be_private = (
-                    parent_file.is_private if parent_file else self.is_private
-                )
-
-                # ✅ FIX: Cập nhật team của file con để khớp với team của folder cha
-                parent_team = parent_file.team if parent_file else self.team
-
-                if should_be_private and not is_new_owner_team_member:
-                    frappe.db.set_value(
-                        "Drive File",
-                        self.name,
-                        {
-                            "owner": new_owner,
-                            "is_private": 1,
-                            "team": parent_team,  # Cập nhật team
-                        },
-                    )
-                else:
-                    frappe.db.set_value(
-                        "Drive File",
-                        self.name,
-                        {
-                            "owner": new_owner,
-                            "team": parent_team,  # Cập nhật team
-                        },
-                    )
 
             frappe.db.commit()
             if self.is_group and transfer_child_files:
@@ -1600,4 +1270,6 @@ class DriveFile(Document):
 
 
 def on_doctype_update():
-    frappe.db.add_index("Drive File", ["title"])
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive File")
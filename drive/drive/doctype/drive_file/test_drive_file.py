@@ -1,9 +1,15 @@
 # Copyright (c) 2025, Frappe Technologies Pvt. Ltd. and Contributors
 # See license.txt
 
-# import frappe
+import json
+from unittest.mock import patch
+
+import frappe
 from frappe.tests import IntegrationTestCase, UnitTestCase
 
+from drive.api import onlyoffice
+from drive.utils.files import compute_folder_sizes
+
 
 # On IntegrationTestCase, the doctype test records and all
 # link-field test record dependencies are recursively loaded
@@ -18,7 +24,55 @@ class UnitTestDriveFile(UnitTestCase):
     Use this class for testing individual functions and methods.
     """
 
-    pass
+    @staticmethod
+    def _row(name, parent=None, is_group=0, file_size=0, is_active=1):
+        return frappe._dict(
+            name=name,
+            parent_entity=parent,
+            is_group=is_group,
+            is_active=is_active,
+            file_size=file_size,
+        )
+
+    def test_folder_sizes_sum_nested_children(self):
+        rows = [
+            self._row("root", is_group=1),
+            self._row("a", "root", is_group=1),
+            self._row("b", "a", is_group=1),
+            self._row("f1", "root", file_size=10),
+            self._row("f2", "a", file_size=20),
+            self._row("f3", "b", file_size=30),
+        ]
+        self.assertEqual(compute_folder_sizes(rows), {"root": 60, "a": 50, "b": 30})
+
+    def test_folder_sizes_skip_inactive_children(self):
+        rows = [
+            self._row("root", is_group=1),
+            self._row("trashed", "root", is_group=1, is_active=0),
+            self._row("f1", "trashed", file_size=100),
+            self._row("f2", "root", file_size=5),
+            self._row("f3", "root", file_size=7, is_active=0),
+        ]
+        sizes = compute_folder_sizes(rows)
+        self.assertEqual(sizes["root"], 5)
+        self.assertEqual(sizes["trashed"], 100)
+
+    def test_folder_sizes_empty_folder_and_missing_size(self):
+        rows = [
+            self._row("root", is_group=1),
+            self._row("empty", "root", is_group=1),
+            self._row("f1", "root", file_size=None),
+        ]
+        self.assertEqual(compute_folder_sizes(rows), {"root": 0, "empty": 0})
+
+    def test_folder_sizes_deep_tree(self):
+        depth = 5000
+        rows = [self._row("d0", is_group=1)]
+        rows += [self._row(f"d{i}", f"d{i - 1}", is_group=1) for i in range(1, depth)]
+        rows.append(self._row("leaf", f"d{depth - 1}", file_size=3))
+        sizes = compute_folder_sizes(rows)
+        self.assertEqual(len(sizes), depth)
+        self.assertTrue(all(size == 3 for size in sizes.values()))
 
 
 class IntegrationTestDriveFile(IntegrationTestCase):
@@ -28,3 +82,66 @@ class IntegrationTestDriveFile(IntegrationTestCase):
     """
 
     pass
+
+
+class TestOnlyOfficeSaveQueue(IntegrationTestCase):
+    """Pending OnlyOffice saves must survive a held save lock."""
+
+    entity = "_test_onlyoffice_save"
+
+    def setUp(self):
+        self.pending_key = onlyoffice._save_cache_key("pending", self.entity)
+        self.seen_key = onlyoffice._save_cache_key("seen", "k", "v1")
+        frappe.cache().delete(self.pending_key, self.seen_key)
+
+    def tearDown(self):
+        frappe.cache().delete(self.pending_key, self.seen_key)
+
+    def set_pending(self):
+        frappe.cache().set(
+            self.pending_key,
+            json.dumps({"url": "http://x", "key": "k", "status": 2, "version": "v1"}),
+        )
+
+    def test_resume_enqueues_pending_save(self):
+        self.set_pending()
+        with patch.object(onlyoffice, "enqueue") as enqueue:
+            onlyoffice.resume_pending_save(self.entity)
+        enqueue.assert_called_once()
+        self.assertEqual(enqueue.call_args.kwargs["entity_name"], self.entity)
+        self.assertNotIn("deduplicate", enqueue.call_args.kwargs)
+
+    def test_resume_without_pending_save_does_nothing(self):
+        with patch.object(onlyoffice, "enqueue") as enqueue:
+            onlyoffice.resume_pending_save(self.entity)
+        enqueue.assert_not_called()
+
+    def test_save_queued_while_locked_runs_after_release(self):
+        lock = onlyoffice.get_save_lock(self.entity)
+        lock.acquire_write_lock()
+        self.set_pending()
+        with (
+            patch.object(onlyoffice, "enqueue") as enqueue,
+            patch.object(onlyoffice, "save_document_sync") as save,
+        ):
+            # Job của callback gặp lock và thoát, bản chờ vẫn còn
+            onlyoffice.process_document_saves(self.entity)
+            save.assert_not_called()
+            lock.release_write_lock()
+            onlyoffice.resume_pending_save(self.entity)
+        enqueue.assert_called_once()
+
+    def test_failed_save_is_requeued_and_unmarked(self):
+        self.set_pending()
+        frappe.cache().set(self.seen_key, 1)
+        with (
+            patch.object(onlyoffice, "SAVE_MAX_ATTEMPTS", 1),
+            patch.object(onlyoffice, "save_document_sync", side_effect=OSError),
+            patch.object(onlyoffice, "enqueue") as enqueue,
+            patch.object(frappe, "log_error"),
+        ):
+            onlyoffice.process_document_saves(self.entity)
+        # Bản chờ được trả lại, OnlyOffice gửi lại cùng version không bị coi là trùng
+        self.assertIsNotNone(frappe.cache().get(self.pending_key))
+        self.assertIsNone(frappe.cache().get(self.seen_key))
+        enqueue.assert_not_called()
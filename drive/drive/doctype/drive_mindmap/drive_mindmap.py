@@ -1,8 +1,33 @@
 # Copyright (c) 2024, Your Company and contributors
 # For license information, please see license.txt
 
+import frappe
 from frappe.model.document import Document
 
+# Fields rendered by the mindmap tree views; saving mindmap_data alone keeps the cache
+TREE_VIEW_FIELDS = ("title", "is_group", "parent_mindmap", "color", "owner")
+
 
 class DriveMindmap(Document):
-    pass
+    def on_update(self):
+        if self.has_value_changed("mindmap_data"):
+            from drive.search.index import queue_index
+
+            queue_index(frappe.get_all("Drive File", {"mindmap": self.name}, pluck="name"))
+
+        before = self.get_doc_before_save()
+        if before and not any(self.has_value_changed(f) for f in TREE_VIEW_FIELDS):
+            return
+        self.invalidate_tree_cache(before)
+
+    def on_trash(self):
+        self.invalidate_tree_cache()
+
+    def invalidate_tree_cache(self, before=None):
+        from drive.api.mindmap import invalidate_mindmap_tree_cache
+
+        invalidate_mindmap_tree_cache(self.parent_mindmap)
+        if self.is_group:
+            invalidate_mindmap_tree_cache(self.name)
+        if before and before.parent_mindmap != self.parent_mindmap:
+            invalidate_mindmap_tree_cache(before.parent_mindmap)
@@ -1,9 +1,82 @@
-# Copyright (c) 2024, Your Company and contributors
-# For license information, please see license.txt
-
-import frappe
-from frappe.tests.utils import FrappeTestCase
-
-
-class TestDriveMindmap(FrappeTestCase):
-    pass
+# Copyright (c) 2024, Your Company and contributors
+# For license information, please see license.txt
+
+import base64
+import json
+import zlib
+
+import frappe
+from frappe.tests.utils import FrappeTestCase
+
+from drive.utils import mindmap_codec
+
+
+class TestDriveMindmap(FrappeTestCase):
+    pass
+
+
+class TestMindmapCodec(FrappeTestCase):
+    def _sample(self):
+        return {
+            "nodes": [
+                {"id": "1", "data": {"label": "Gốc"}, "position": {"x": 0, "y": 0}},
+                {"id": "2", "data": {"label": "Nhánh"}, "parentId": "1"},
+                {"id": "3", "data": None, "parentId": None},
+            ],
+            "edges": [{"id": "e1-2", "source": "1", "target": "2"}],
+            "layout": "horizontal",
+            "viewport": {"zoom": 1.5},
+        }
+
+    def test_compact_round_trip(self):
+        data = self._sample()
+        encoded = mindmap_codec.encode(data)
+        self.assertEqual(encoded["encoding"], mindmap_codec.COMPACT_ENCODING)
+        self.assertEqual(mindmap_codec.decode(encoded), data)
+        self.assertEqual(mindmap_codec.decode(encoded["payload"], mindmap_codec.COMPACT_ENCODING), data)
+
+    def test_missing_keys_stay_missing(self):
+        # Key vắng mặt khác với key có giá trị None
+        nodes = mindmap_codec.CompactMindmap(mindmap_codec.encode(self._sample())).nodes
+        self.assertNotIn("parentId", nodes[0])
+        self.assertIn("parentId", nodes[2])
+        self.assertIsNone(nodes[2]["parentId"])
+
+    def test_node_count_without_decoding(self):
+        compact = mindmap_codec.CompactMindmap(mindmap_codec.encode(self._sample()))
+        self.assertEqual(compact.node_count(), 3)
+        self.assertEqual(mindmap_codec.CompactMindmap(mindmap_codec.encode({})).node_count(), 0)
+
+    def test_empty_mindmap(self):
+        self.assertEqual(
+            mindmap_codec.decode(mindmap_codec.encode(None)),
+            {"nodes": [], "edges": [], "layout": None},
+        )
+
+    def test_storage_round_trip(self):
+        data = self._sample()
+        stored = mindmap_codec.dumps(data)
+        self.assertNotIn(" ", stored)
+        self.assertIn("Gốc", stored)
+        self.assertEqual(mindmap_codec.loads(stored), data)
+        self.assertEqual(mindmap_codec.dumps(stored), stored)
+
+    def test_loads_invalid_returns_default(self):
+        self.assertEqual(mindmap_codec.loads("", {}), {})
+        self.assertEqual(mindmap_codec.loads("{not json", {}), {})
+        self.assertIsNone(mindmap_codec.loads(None))
+
+    def test_decode_plain_json(self):
+        data = self._sample()
+        self.assertEqual(mindmap_codec.decode(mindmap_codec.dumps(data)), data)
+        self.assertEqual(mindmap_codec.decode(data), data)
+
+    def test_unsupported_encoding_and_version(self):
+        with self.assertRaises(ValueError):
+            mindmap_codec.decode("abc", "gzip")
+        payload = mindmap_codec.encode(self._sample())
+        body = json.loads(zlib.decompress(base64.b64decode(payload["payload"])))
+        body["v"] = mindmap_codec.CODEC_VERSION + 1
+        raw = zlib.compress(json.dumps(body).encode("utf-8"))
+        with self.assertRaises(ValueError):
+            mindmap_codec.CompactMindmap(base64.b64encode(raw).decode("ascii"))
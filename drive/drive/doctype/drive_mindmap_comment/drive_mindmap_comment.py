@@ -195,6 +195,8 @@ class DriveMindmapComment(Document):
         frappe.enqueue(
             "drive.api.mindmap_comment.notify_comment",
             queue="short",
+            job_id=f"notify_comment_{self.name}",
+            deduplicate=True,
             comment_name=self.name,
             enqueue_after_commit=True,
         )
@@ -204,6 +206,8 @@ class DriveMindmapComment(Document):
             frappe.enqueue(
                 "drive.api.mindmap_comment.notify_mentions",
                 queue="short",
+                job_id=f"notify_mentions_{self.name}",
+                deduplicate=True,
                 comment_name=self.name,
                 enqueue_after_commit=True,
             )
@@ -283,6 +287,8 @@ class DriveMindmapComment(Document):
         frappe.enqueue(
             "drive.api.mindmap_comment.notify_comment",
             queue="short",
+            job_id=f"notify_comment_{self.name}",
+            deduplicate=True,
             comment_name=self.name,
             enqueue_after_commit=True,
         )
@@ -292,6 +298,14 @@ class DriveMindmapComment(Document):
             frappe.enqueue(
                 "drive.api.mindmap_comment.notify_mentions",
                 queue="short",
+                job_id=f"notify_mentions_{self.name}",
+                deduplicate=True,
                 comment_name=self.name,
                 enqueue_after_commit=True,
             )
+
+
+def on_doctype_update():
+    frappe.db.add_index(
+        "Drive Mindmap Comment", ["mindmap_id", "node_id", "session_index"]
+    )
@@ -3,6 +3,15 @@
 
 from frappe.model.document import Document
 
+import frappe
+
 
 class DriveMindmapCommentSession(Document):
     pass
+
+
+def on_doctype_update():
+    frappe.db.add_index(
+        "Drive Mindmap Comment Session",
+        ["mindmap_id", "node_id", "session_index", "is_closed"],
+    )
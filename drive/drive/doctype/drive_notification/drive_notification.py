@@ -9,97 +9,99 @@ import json
 
 class DriveNotification(Document):
     def after_insert(self):
-        bot_docs = frappe.conf.get("bot_docs")
-        if not bot_docs:
-            return
-        full_name = (
-            frappe.db.get_value("User", {"name": self.from_user}, "full_name") or self.from_user
+        from drive.api.notifications import update_unread_count
+
+        if self.to_user and not self.read:
+            update_unread_count(self.to_user, 1)
+        send_raven_notification(self)
+
+
+def send_raven_notification(notif, full_names=None, comments=None):
+    """
+    Send the RavenBot message for a Drive Notification row.
+
+    :param notif: Drive Notification document or dict with its fields
+    :param full_names: optional {user: full_name} map to avoid per-user lookups
+    :param comments: optional {comment_id: Comment row with name and content}
+    """
+    bot_docs = frappe.conf.get("bot_docs")
+    if not bot_docs:
+        return
+
+    def full_name_of(user):
+        if full_names is not None and user in full_names:
+            return full_names[user] or user
+        return frappe.db.get_value("User", {"name": user}, "full_name") or user
+
+    full_name = full_name_of(notif.from_user)
+    link = f"/drive/t/{notif.id_team}/{(notif.entity_type or '').lower()}/{notif.notif_doctype_name}"
+
+    if notif.type == "Share":
+        message_data = {
+            "key": "share_document",
+            "title": f"{full_name} đã chia sẻ với bạn tài liệu {notif.file_name}",
+            "full_name_owner": full_name,
+            "to_user": notif.to_user,
+            "type": notif.type,
+            "entity_type": notif.entity_type,
+            "message": notif.message,
+            "file_name": notif.file_name,
+            "link": link,
+        }
+
+        RavenBot.send_notification_to_user(
+            bot_name=bot_docs,
+            user_id=notif.to_user,
+            message=json.dumps(message_data, ensure_ascii=False, default=str),
         )
-        if self.type == "Share":
-            message_data = {
-                "key": "share_document",
-                "title": f"{full_name} đã chia sẻ với bạn tài liệu {self.file_name}",
-                "full_name_owner": full_name,
-                "to_user": self.to_user,
-                "type": self.type,
-                "entity_type": self.entity_type,
-                "message": self.message,
-                "file_name": self.file_name,
-                "link": f"/drive/t/{self.id_team}/{self.entity_type.lower()}/{self.notif_doctype_name}",
-            }
-
-            RavenBot.send_notification_to_user(
-                bot_name=bot_docs,
-                user_id=self.to_user,
-                message=json.dumps(message_data, ensure_ascii=False, default=str),
-            )
-
-        comment_doc = frappe.get_doc("Comment", self.comment_id)
-        full_name_to_user = (
-            frappe.db.get_value("User", {"name": self.to_user}, "full_name") or self.to_user
+        return
+
+    if not notif.comment_id:
+        return
+    if comments is not None and notif.comment_id in comments:
+        comment_doc = comments[notif.comment_id]
+    else:
+        comment_doc = frappe.db.get_value(
+            "Comment", notif.comment_id, ["name", "content"], as_dict=True
         )
-        if not full_name_to_user or not comment_doc:
-            return
-        if self.type == "Mention":
-            message_data = {
-                "key": "mention_document",
-                "title": f"{full_name} đã nhắc đến bạn trong {self.file_name}",
-                "full_name_owner": full_name,
-                "to_user": self.to_user,
-                "full_name_to_user": full_name_to_user,
-                "type": self.type,
-                "entity_type": self.entity_type,
-                "message": self.message,
-                "file_name": self.file_name,
-                "comment_id": comment_doc.name or "",
-                "comment_content": comment_doc.content or "",
-                "link": f"/drive/t/{self.id_team}/{self.entity_type.lower()}/{self.notif_doctype_name}",
-            }
-            RavenBot.send_notification_to_user(
-                bot_name=bot_docs,
-                user_id=self.to_user,
-                message=json.dumps(message_data, ensure_ascii=False, default=str),
-            )
-
-        if self.type == "To Owner File":
-            message_data = {
-                "key": "to_owner_file",
-                "title": f"{full_name} đã bình luận trong {self.file_name}",
-                "full_name_owner": full_name,
-                "to_user": self.to_user,
-                "full_name_to_user": full_name_to_user,
-                "type": self.type,
-                "entity_type": self.entity_type,
-                "message": self.message,
-                "file_name": self.file_name,
-                "comment_id": comment_doc.name or "",
-                "comment_content": comment_doc.content or "",
-                "link": f"/drive/t/{self.id_team}/{self.entity_type.lower()}/{self.notif_doctype_name}",
-            }
-            RavenBot.send_notification_to_user(
-                bot_name=bot_docs,
-                user_id=self.to_user,
-                message=json.dumps(message_data, ensure_ascii=False, default=str),
-            )
-        if self.type == "Reply":
-            print("notify_reply", self.type)
-            message_data = {
-                "key": "reply_comment",
-                "title": f"{full_name} đã trả lời bình luận của bạn trong {self.file_name}",
-                "full_name_owner": full_name,
-                "to_user": self.to_user,
-                "full_name_to_user": full_name_to_user,
-                "type": self.type,
-                "entity_type": self.entity_type,
-                "message": self.message,
-                "file_name": self.file_name,
-                "comment_id": comment_doc.name or "",
-                "comment_content": comment_doc.content or "",
-                "link": f"/drive/t/{self.id_team}/{self.entity_type.lower()}/{self.notif_doctype_name}",
-            }
-
-            RavenBot.send_notification_to_user(
-                bot_name=bot_docs,
-                user_id=self.to_user,
-                message=json.dumps(message_data, ensure_ascii=False, default=str),
-            )
+    full_name_to_user = full_name_of(notif.to_user)
+    if not full_name_to_user or not comment_doc:
+        return
+
+    templates = {
+        "Mention": ("mention_document", f"{full_name} đã nhắc đến bạn trong {notif.file_name}"),
+        "To Owner File": ("to_owner_file", f"{full_name} đã bình luận trong {notif.file_name}"),
+        "Reply": (
+            "reply_comment",
+            f"{full_name} đã trả lời bình luận của bạn trong {notif.file_name}",
+        ),
+    }
+    if notif.type not in templates:
+        return
+    key, title = templates[notif.type]
+
+    message_data = {
+        "key": key,
+        "title": title,
+        "full_name_owner": full_name,
+        "to_user": notif.to_user,
+        "full_name_to_user": full_name_to_user,
+        "type": notif.type,
+        "entity_type": notif.entity_type,
+        "message": notif.message,
+        "file_name": notif.file_name,
+        "comment_id": comment_doc.name or "",
+        "comment_content": comment_doc.content or "",
+        "link": link,
+    }
+    RavenBot.send_notification_to_user(
+        bot_name=bot_docs,
+        user_id=notif.to_user,
+        message=json.dumps(message_data, ensure_ascii=False, default=str),
+    )
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Notification")
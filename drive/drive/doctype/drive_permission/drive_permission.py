@@ -8,4 +8,26 @@ from drive.api.notifications import notify_share
 
 
 class DrivePermission(Document):
-    pass
+    def after_insert(self):
+        self.invalidate_shared_roots()
+
+    def on_update(self):
+        self.invalidate_shared_roots()
+
+    def on_trash(self):
+        self.invalidate_shared_roots()
+
+    def invalidate_shared_roots(self):
+        from drive.api.shared_roots import (
+            SHARED_BY_ME,
+            SHARED_WITH_ME,
+            invalidate_shared_roots,
+        )
+
+        invalidate_shared_roots([(self.user, SHARED_WITH_ME), (self.owner, SHARED_BY_ME)])
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Permission")
@@ -30,3 +30,8 @@ class DrivePinFile(Document):
 			
 			self.order = (max_order[0].max_order or 0) + 1 if max_order else 1
 
+
+def on_doctype_update():
+	from drive.utils.indexes import add_drive_indexes
+
+	add_drive_indexes("Drive Pin File")
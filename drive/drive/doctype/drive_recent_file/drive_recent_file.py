@@ -8,3 +8,8 @@ from frappe.model.document import Document
 class DriveRecentFile(Document):
 	pass
 
+
+def on_doctype_update():
+	from drive.utils.indexes import add_drive_indexes
+
+	add_drive_indexes("Drive Recent File")
@@ -0,0 +1,15 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DriveSearchToken(Document):
+    pass
+
+
+def on_doctype_update():
+    # Prefix lookups (`token LIKE 'abc%'`) are range scans on (team, token)
+    frappe.db.add_index("Drive Search Token", ["team", "token"])
+    frappe.db.add_index("Drive Search Token", ["entity"])
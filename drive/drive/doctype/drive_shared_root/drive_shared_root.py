@@ -0,0 +1,16 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DriveSharedRoot(Document):
+    pass
+
+
+def on_doctype_update():
+    # Một index cho mỗi cách sắp xếp của trang Shared
+    for column in ("accessed", "title", "file_modified"):
+        frappe.db.add_index("Drive Shared Root", ["user", "shared_by", column])
+    frappe.db.add_index("Drive Shared Root", ["entity"])
@@ -180,3 +180,9 @@ class DriveShortcut(Document):
         path_parts.append(self.title)
 
         return "/" + "/".join(path_parts) if path_parts else f"/{self.title}"
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Shortcut")
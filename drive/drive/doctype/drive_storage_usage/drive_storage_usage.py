@@ -0,0 +1,18 @@
+# Copyright (c) 2026, Frappe Technologies Pvt. Ltd. and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class DriveStorageUsage(Document):
+    pass
+
+
+def on_doctype_update():
+    # Khoá cho INSERT ... ON DUPLICATE KEY UPDATE trong drive.api.storage
+    frappe.db.add_unique(
+        "Drive Storage Usage",
+        ["team", "user", "is_private", "mime_type"],
+        constraint_name="unique_storage_usage",
+    )
@@ -25,3 +25,9 @@ class DriveTrash(Document):
         """Đặt giá trị trashed_on bằng thời gian hiện tại nếu chưa có"""
         if not self.trashed_on:
             self.trashed_on = frappe.utils.now()
+
+
+def on_doctype_update():
+    from drive.utils.indexes import add_drive_indexes
+
+    add_drive_indexes("Drive Trash")
@@ -135,11 +135,22 @@ doc_events = {
 # ---------------
 
 scheduler_events = {
+    "all": [
+        "drive.api.notifications.flush_notification_queue",
+        "drive.search.index.flush_search_index",
+    ],
     "daily": [
-        "drive.api.files.auto_delete_from_trash",
-        "drive.api.files.clear_deleted_files",
+        "drive.utils.files.reconcile_folder_sizes",
+        "drive.api.storage.recount_storage_usage",
     ],
-    "hourly": ["drive.api.permissions.auto_delete_expired_perms"],
+    # Chạy tới MAX_RUN_SECONDS (20 phút): cần timeout của hàng đợi long
+    "daily_long": ["drive.api.purge.purge_trash"],
+    "cron": {
+        # Quét theo index valid_until nên chạy dày được; quyền đã hết hạn vốn bị bỏ qua khi đọc
+        "*/5 * * * *": ["drive.api.permissions.auto_delete_expired_perms"],
+    },
+    "hourly": ["drive.api.move.resume_moves"],
+    "weekly": ["drive.utils.blobs.reap_orphan_blobs_job"],
 }
 
 # Testing
@@ -1,39 +1,172 @@
+import threading
+
 import frappe
-import redis
+
+# All lock operations run as server-side scripts: one round trip, no WATCH/MULTI retries.
+# KEYS[1] = lock key, KEYS[2] = fencing counter (kept for a day), KEYS[3] = metrics hash
+
+# A write lock stores the holder's lock id; a read lock stores the number of readers.
+ACQUIRE_WRITE = """
+if redis.call('set', KEYS[1], ARGV[1], 'PX', ARGV[2], 'NX') then
+    redis.call('hincrby', KEYS[3], 'write_acquired', 1)
+    local token = redis.call('incr', KEYS[2])
+    redis.call('expire', KEYS[2], 86400)
+    return token
+end
+redis.call('hincrby', KEYS[3], 'write_contended', 1)
+return false
+"""
+
+RELEASE_WRITE = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+ACQUIRE_READ = """
+local current = redis.call('get', KEYS[1])
+if current and not tonumber(current) then
+    redis.call('hincrby', KEYS[3], 'read_contended', 1)
+    return false
+end
+redis.call('incr', KEYS[1])
+redis.call('pexpire', KEYS[1], ARGV[1])
+redis.call('hincrby', KEYS[3], 'read_acquired', 1)
+local token = redis.call('incr', KEYS[2])
+redis.call('expire', KEYS[2], 86400)
+return token
+"""
+
+RELEASE_READ = """
+local current = tonumber(redis.call('get', KEYS[1]))
+if not current then
+    return 0
+end
+if current <= 1 then
+    redis.call('del', KEYS[1])
+else
+    redis.call('decr', KEYS[1])
+end
+return 1
+"""
+
+# ARGV[1] = lock id for write locks, "" for read locks
+RENEW = """
+local current = redis.call('get', KEYS[1])
+if not current then
+    return 0
+end
+if ARGV[1] == '' then
+    if not tonumber(current) then
+        return 0
+    end
+elseif current ~= ARGV[1] then
+    return 0
+end
+redis.call('hincrby', KEYS[3], 'renewed', 1)
+return redis.call('pexpire', KEYS[1], ARGV[2])
+"""
+
+# ARGV[1] = fencing token of the caller; 1 while no later acquire has happened
+CHECK_FENCE = """
+if tonumber(redis.call('get', KEYS[2])) == tonumber(ARGV[1]) then
+    return 1
+end
+redis.call('hincrby', KEYS[3], 'fence_rejected', 1)
+return 0
+"""
+
+METRICS_KEY = "drive_lock_metrics"
+
+_scripts = {}
+
+
+def _script(cache, source):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = cache.register_script(source)
+    return script
 
 
 class FileLockedError(Exception):
     pass
 
 
+class StaleLockError(FileLockedError):
+    """The lease expired and another holder acquired the lock since"""
+
+
 class DistributedLock(object):
-    def __init__(self, path, exclusive, ttl=60):
+    """
+    Redis reader/writer lock on a path.
+
+    Every successful acquire returns a fencing token (`self.token`) that increases
+    monotonically per path. Writers call `check_fence()` right before making
+    their write visible, so a holder whose lease expired cannot overwrite the
+    work of the next one.
+    Pass `auto_renew=True` for long operations (thumbnails, zip export) to extend the
+    lease every ttl/3 seconds while the lock is held.
+    """
+
+    def __init__(self, path, exclusive, ttl=60, auto_renew=False):
         self.path = path
         self.exclusive = exclusive
         self.ttl = ttl
-        self.key = frappe.cache().make_key(path)
+        self.auto_renew = auto_renew
+        self.cache = frappe.cache()
+        self.key = self.cache.make_key(path)
+        self.fence_key = self.cache.make_key(f"{path}:fence")
+        self.metrics_key = self.cache.make_key(METRICS_KEY)
         self.lock_id = f"{frappe.session.user}{frappe.utils.now_datetime().timestamp()}"
         self.acquired = False
+        self.token = None
+        self._renewer = None
+
+    @property
+    def _keys(self):
+        return [self.key, self.fence_key, self.metrics_key]
 
     def acquire_write_lock(self):
-        if not self._add(self.key, self.lock_id, self.ttl):
+        token = _script(self.cache, ACQUIRE_WRITE)(
+            keys=self._keys, args=[self.lock_id, int(self.ttl * 1000)]
+        )
+        if not token:
             raise FileLockedError()
-        self.acquired = True
+        self._on_acquired(token)
 
     def release_write_lock(self):
-        self._check_and_delete(self.key, self.lock_id)
+        self._stop_renewer()
+        _script(self.cache, RELEASE_WRITE)(keys=self._keys, args=[self.lock_id])
         self.acquired = False
 
     def acquire_read_lock(self):
-        if not self._increment(self.key, self.ttl):
+        token = _script(self.cache, ACQUIRE_READ)(
+            keys=self._keys, args=[int(self.ttl * 1000)]
+        )
+        if not token:
             raise FileLockedError()
-        self.acquired = True
+        self._on_acquired(token)
 
     def release_read_lock(self):
-        if not self._check_and_delete(self.key, "1"):
-            self._decrement(self.key)
+        self._stop_renewer()
+        _script(self.cache, RELEASE_READ)(keys=self._keys)
         self.acquired = False
 
+    def renew(self):
+        """Extend the lease by `ttl`. Returns False if the lock is no longer held."""
+        holder = self.lock_id if self.exclusive else ""
+        return bool(
+            _script(self.cache, RENEW)(keys=self._keys, args=[holder, int(self.ttl * 1000)])
+        )
+
+    def check_fence(self):
+        """Raise StaleLockError if the lock was acquired by someone else after us"""
+        if not self.acquired or not _script(self.cache, CHECK_FENCE)(
+            keys=self._keys, args=[self.token]
+        ):
+            raise StaleLockError()
+
     def __enter__(self):
         if not self.acquired:
             self.acquire_write_lock() if self.exclusive else self.acquire_read_lock()
@@ -43,57 +176,31 @@ class DistributedLock(object):
         if self.acquired:
             self.release_write_lock() if self.exclusive else self.release_read_lock()
 
-    def _add(self, key, value, ttl):
-        """Returns true if key does not already exist and value is set"""
-        return frappe.cache().set(key, value, ex=ttl, nx=True)
-
-    def _increment(self, key, ttl):
-        """Atomic transaction to increment value. Returns False if current value cannot be incremented.
-        If the key does not exist, value is set to 1"""
-        with frappe.cache().pipeline() as pipe:
-            try:
-                res = pipe.incr(key).expire(key, ttl).execute()
-                return True
-            except redis.ResponseError:
-                return False
-
-    def _decrement(self, key):
-        """Atomic transaction to decrement value. Returns False if current value cannot be decremented
-        or if the key does not exist"""
-        try:
-            if not frappe.cache().exists(key):
-                return False
-            frappe.cache().decr(key)
-            return True
-        except redis.ResponseError:
-            return False
-
-    def _check_and_set(self, key, expected_val, new_val, ttl):
-        """Atomic transaction to set value if current value matches the expected value"""
-        with frappe.cache().pipeline() as pipe:
-            while True:
-                try:
-                    pipe.watch(key)
-                    current_val = pipe.get(key)
-                    if current_val and current_val.decode() != expected_val:
-                        return False
-                    pipe.multi()
-                    pipe.set(key, new_val, ex=ttl)
-                    return pipe.execute()[0]
-                except redis.WatchError:
-                    continue
-
-    def _check_and_delete(self, key, expected_val):
-        """Atomic transaction to delete the key if current value matches the expected value"""
-        with frappe.cache().pipeline() as pipe:
-            while True:
-                try:
-                    pipe.watch(key)
-                    current_val = pipe.get(key)
-                    if current_val and current_val.decode() != expected_val:
-                        return False
-                    pipe.multi()
-                    pipe.delete(key)
-                    return pipe.execute()[0]
-                except redis.WatchError:
-                    continue
+    def _on_acquired(self, token):
+        self.token = int(token)
+        self.acquired = True
+        if self.auto_renew:
+            stop = threading.Event()
+            thread = threading.Thread(target=self._renew_loop, args=(stop,), daemon=True)
+            self._renewer = (stop, thread)
+            thread.start()
+
+    def _renew_loop(self, stop):
+        while not stop.wait(self.ttl / 3):
+            if not self.renew():
+                return
+
+    def _stop_renewer(self):
+        if self._renewer:
+            stop, thread = self._renewer
+            stop.set()
+            thread.join(timeout=1)
+            self._renewer = None
+
+
+def get_lock_metrics():
+    """Acquire / contention / renewal counters for all DistributedLocks on this site"""
+    with frappe.cache().pipeline() as pipe:
+        pipe.hgetall(frappe.cache().make_key(METRICS_KEY))
+        metrics = pipe.execute()[0]
+    return {k.decode(): int(v) for k, v in metrics.items()}
@@ -0,0 +1,5 @@
+from drive.utils.indexes import add_drive_indexes
+
+
+def execute():
+    add_drive_indexes()
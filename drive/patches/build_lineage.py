@@ -0,0 +1,5 @@
+from drive.utils.lineage import rebuild_lineage
+
+
+def execute():
+    rebuild_lineage()
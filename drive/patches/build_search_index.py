@@ -0,0 +1,5 @@
+from drive.search.index import rebuild_search_index
+
+
+def execute():
+    rebuild_search_index()
@@ -0,0 +1,5 @@
+from drive.api.shared_roots import rebuild_shared_roots
+
+
+def execute():
+    rebuild_shared_roots()
@@ -0,0 +1,5 @@
+from drive.api.storage import recount_storage_usage
+
+
+def execute():
+    recount_storage_usage()
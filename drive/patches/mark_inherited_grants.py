@@ -0,0 +1,5 @@
+from drive.api.sharing import mark_inherited_grants
+
+
+def execute():
+    mark_inherited_grants()
@@ -0,0 +1,275 @@
+"""
+Background text extraction for uploaded files.
+
+After an upload or an OnlyOffice save the file is queued here; the job copies
+the blob to a temp file (hashing it on the way), skips it if that content hash
+was already extracted, and otherwise pulls plain text and basic metadata out
+with in-process parsers only:
+
+- PDF via pypdf (shipped with Frappe)
+- OOXML (docx/xlsx/pptx) and ODF by streaming the XML parts out of the zip
+- text/* read directly
+
+Every extraction is bounded by input size, output length and wall time. The
+result is stored whitespace-collapsed in `Drive File Text` and the entity is
+re-queued for the search index.
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import time
+import zipfile
+from xml.etree.ElementTree import iterparse
+
+import frappe
+
+from drive.search.index import queue_index
+from drive.utils.files import FileManager
+
+EXTRACT_JOB_TIMEOUT = 300
+EXTRACT_TIME_LIMIT = 60  # giây cho phần phân tích nội dung
+MAX_INPUT_BYTES = 100 * 1024 * 1024
+MAX_UNCOMPRESSED_BYTES = 200 * 1024 * 1024
+MAX_TEXT_CHARS = 200_000
+COPY_CHUNK_SIZE = 1024 * 1024
+
+OOXML_PARTS = {
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": (
+        re.compile(r"word/(document|header\d*|footer\d*|footnotes)\.xml"),
+        {"t"},
+    ),
+    "application/vnd.openxmlformats-officedocument.presentationml.presentation": (
+        re.compile(r"ppt/slides/slide\d+\.xml"),
+        {"t"},
+    ),
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet": (
+        re.compile(r"xl/sharedStrings\.xml"),
+        {"t"},
+    ),
+}
+ODF_MIME_TYPES = {
+    "application/vnd.oasis.opendocument.text",
+    "application/vnd.oasis.opendocument.spreadsheet",
+    "application/vnd.oasis.opendocument.presentation",
+}
+TEXT_MIME_TYPES = {"application/json", "application/xml", "text/csv"}
+
+
+class ExtractionLimitReached(Exception):
+    pass
+
+
+class TextBuffer:
+    """Collects text fragments until MAX_TEXT_CHARS or the deadline is hit"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self.parts = []
+        self.size = 0
+        self.truncated = False
+
+    def add(self, text):
+        if not text:
+            return
+        if self.size >= MAX_TEXT_CHARS or time.monotonic() > self.deadline:
+            self.truncated = True
+            raise ExtractionLimitReached()
+        text = text[: MAX_TEXT_CHARS - self.size]
+        self.parts.append(text)
+        self.size += len(text)
+
+    def text(self):
+        return re.sub(r"\s+", " ", " ".join(self.parts)).strip()
+
+
+def can_extract(mime_type):
+    return bool(mime_type) and (
+        mime_type == "application/pdf"
+        or mime_type in OOXML_PARTS
+        or mime_type in ODF_MIME_TYPES
+        or mime_type in TEXT_MIME_TYPES
+        or mime_type.startswith("text/")
+    )
+
+
+def queue_extraction(entity_name, mime_type=None):
+    if mime_type is not None and not can_extract(mime_type):
+        return
+    frappe.enqueue(
+        extract_entity_text,
+        queue="long",
+        timeout=EXTRACT_JOB_TIMEOUT,
+        job_id=f"drive_extract_{entity_name}",
+        deduplicate=True,
+        enqueue_after_commit=True,
+        entity_name=entity_name,
+    )
+
+
+def _local_name(tag):
+    return tag.rsplit("}", 1)[-1]
+
+
+def _xml_text(stream, tags, buffer):
+    """Stream text of `tags` (any tag if None) out of an XML file"""
+    for _, elem in iterparse(stream, events=("end",)):
+        if tags is None or _local_name(elem.tag) in tags:
+            buffer.add(elem.text)
+            if tags is None:
+                buffer.add(elem.tail)
+        if _local_name(elem.tag) in ("p", "si", "h"):
+            buffer.add(" ")
+        elem.clear()
+
+
+def _zip_metadata(zf, part):
+    if part not in zf.namelist():
+        return {}
+    metadata = {}
+    with zf.open(part) as fh:
+        for _, elem in iterparse(fh):
+            name = _local_name(elem.tag)
+            if name in ("title", "creator", "initial-creator", "subject") and elem.text:
+                metadata.setdefault("author" if "creator" in name else name, elem.text[:200])
+            elem.clear()
+    return metadata
+
+
+def _extract_zip(path, parts, tags, meta_part, buffer):
+    with zipfile.ZipFile(path) as zf:
+        members = [i for i in zf.infolist() if parts.fullmatch(i.filename)]
+        if sum(i.file_size for i in members) > MAX_UNCOMPRESSED_BYTES:
+            raise ExtractionLimitReached()
+        metadata = _zip_metadata(zf, meta_part)
+        try:
+            for info in sorted(members, key=lambda i: _natural_key(i.filename)):
+                with zf.open(info) as fh:
+                    _xml_text(fh, tags, buffer)
+        except ExtractionLimitReached:
+            pass
+        return metadata
+
+
+def _natural_key(name):
+    return [int(p) if p.isdigit() else p for p in re.split(r"(\d+)", name)]
+
+
+def _extract_pdf(path, buffer):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        return None
+
+    reader = PdfReader(path)
+    info = reader.metadata or {}
+    metadata = {"pages": len(reader.pages)}
+    if info.get("/Title"):
+        metadata["title"] = str(info["/Title"])[:200]
+    if info.get("/Author"):
+        metadata["author"] = str(info["/Author"])[:200]
+    try:
+        for page in reader.pages:
+            buffer.add(page.extract_text() or "")
+            buffer.add(" ")
+    except ExtractionLimitReached:
+        pass
+    return metadata
+
+
+def _extract_plain(path, buffer):
+    with open(path, "rb") as fh:
+        raw = fh.read(MAX_TEXT_CHARS * 4)
+    try:
+        buffer.add(raw.decode("utf-8", errors="ignore"))
+    except ExtractionLimitReached:
+        pass
+    return {}
+
+
+def extract_text(path, mime_type):
+    """
+    Extract text from a local file.
+
+    :return: (text, metadata, truncated), or None if the type is not supported
+    """
+    buffer = TextBuffer(time.monotonic() + EXTRACT_TIME_LIMIT)
+    if mime_type == "application/pdf":
+        metadata = _extract_pdf(path, buffer)
+    elif mime_type in OOXML_PARTS:
+        parts, tags = OOXML_PARTS[mime_type]
+        metadata = _extract_zip(path, parts, tags, "docProps/core.xml", buffer)
+    elif mime_type in ODF_MIME_TYPES:
+        metadata = _extract_zip(path, re.compile("content.xml"), None, "meta.xml", buffer)
+    elif can_extract(mime_type):
+        metadata = _extract_plain(path, buffer)
+    else:
+        return None
+    if metadata is None:
+        return None
+    return buffer.text(), metadata, buffer.truncated
+
+
+def _copy_to_temp(path):
+    """Copy a blob to a temp file; returns (temp path, sha1) or (None, None) if too large"""
+    source = FileManager().get_file(path)
+    digest = hashlib.sha1()
+    size = 0
+    fd, tmp_path = tempfile.mkstemp(prefix="drive-extract-")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := source.read(COPY_CHUNK_SIZE):
+                size += len(chunk)
+                if size > MAX_INPUT_BYTES:
+                    os.remove(tmp_path)
+                    return None, None
+                digest.update(chunk)
+                out.write(chunk)
+    finally:
+        source.close()
+    return tmp_path, digest.hexdigest()
+
+
+def extract_entity_text(entity_name):
+    """Background job: extract and store the text of one Drive File"""
+    entity = frappe.db.get_value(
+        "Drive File",
+        entity_name,
+        ["name", "path", "mime_type", "file_size", "is_group", "document"],
+        as_dict=True,
+    )
+    if not entity or entity.is_group or entity.document or not entity.path:
+        return
+    if not can_extract(entity.mime_type) or (entity.file_size or 0) > MAX_INPUT_BYTES:
+        return
+
+    tmp_path, content_hash = _copy_to_temp(entity.path)
+    if not tmp_path:
+        return
+    try:
+        if frappe.db.get_value("Drive File Text", entity_name, "content_hash") == content_hash:
+            return
+        try:
+            result = extract_text(tmp_path, entity.mime_type)
+        except Exception:
+            frappe.log_error(frappe.get_traceback(), f"Drive text extraction: {entity_name}")
+            result = ("", {"error": 1}, False)
+        if result is None:
+            return
+        text, metadata, truncated = result
+    finally:
+        os.remove(tmp_path)
+
+    if frappe.db.exists("Drive File Text", entity_name):
+        doc = frappe.get_doc("Drive File Text", entity_name)
+    else:
+        doc = frappe.new_doc("Drive File Text")
+        doc.entity = entity_name
+    doc.content_hash = content_hash
+    doc.content = text
+    doc.metadata = frappe.as_json(metadata)
+    doc.truncated = int(truncated)
+    doc.save(ignore_permissions=True)
+    frappe.db.commit()
+    queue_index([entity_name])
@@ -0,0 +1,247 @@
+"""
+Inverted index over Drive File titles and contents.
+
+One `Drive Search Token` row per (entity, folded token) with a precomputed
+score, keyed by (team, token) so a query is a handful of index range scans
+(`token = 'x'` / `token LIKE 'x%'`) instead of a LIKE scan over `tabDrive File`.
+
+Entities are re-indexed asynchronously: writers call `queue_index`, which adds
+the names to a Redis set; `flush_search_index` drains it in a background job
+(also run from the scheduler as a safety net).
+"""
+
+import frappe
+
+from drive.search.text import contains_exact, fold, tokenize, weigh
+from drive.utils import mindmap_codec
+
+PENDING_KEY = "drive_search_pending"
+INDEX_JOB = "drive_search_index"
+FLUSH_BATCH = 200
+MAX_TOKENS_PER_ENTITY = 5000
+MAX_QUERY_TOKENS = 8
+CANDIDATE_LIMIT = 200
+
+WEIGHTS = {"title": 10, "mindmap": 3, "content": 1, "extracted": 1}
+
+ENTITY_FIELDS = ["name", "title", "team", "document", "mindmap", "mime_type"]
+
+
+def get_entity_texts(entity):
+    """(text, weight) pairs to index for a Drive File row"""
+    texts = [(entity.title, WEIGHTS["title"])]
+
+    if entity.document:
+        raw_content = frappe.db.get_value("Drive Document", entity.document, "raw_content")
+        texts.append((raw_content, WEIGHTS["content"]))
+
+    if entity.mindmap:
+        mindmap_data = mindmap_codec.loads(
+            frappe.db.get_value("Drive Mindmap", entity.mindmap, "mindmap_data"), {}
+        )
+        for node in (mindmap_data or {}).get("nodes") or []:
+            label = (node.get("data") or {}).get("label") or node.get("label")
+            if isinstance(label, str):
+                texts.append((label, WEIGHTS["mindmap"]))
+
+    # Text extracted from uploads by drive.search.extract
+    extracted = frappe.db.get_value("Drive File Text", entity.name, "content")
+    if extracted:
+        texts.append((extracted, WEIGHTS["extracted"]))
+
+    return texts
+
+
+def index_entity(entity_name):
+    """Rebuild the index rows of one Drive File"""
+    frappe.db.delete("Drive Search Token", {"entity": entity_name})
+    entity = frappe.db.get_value("Drive File", entity_name, ENTITY_FIELDS, as_dict=True)
+    if not entity:
+        return
+
+    scores = weigh(get_entity_texts(entity), MAX_TOKENS_PER_ENTITY)
+    title_tokens = set(tokenize(entity.title))
+    frappe.db.bulk_insert(
+        "Drive Search Token",
+        ["token", "entity", "team", "in_title", "score"],
+        [
+            (token, entity.name, entity.team, int(token in title_tokens), round(score, 3))
+            for token, score in scores.items()
+        ],
+        chunk_size=1000,
+    )
+
+
+def remove_entity(entity_name):
+    frappe.db.delete("Drive Search Token", {"entity": entity_name})
+
+
+def update_search_team(entity_names, team):
+    """Keep the denormalised team in sync when entities move between teams"""
+    if not entity_names:
+        return
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive Search Token`
+        SET team = %(team)s
+        WHERE entity IN %(entities)s
+        """,
+        {"team": team, "entities": tuple(entity_names)},
+    )
+
+
+def queue_index(entity_names):
+    """Schedule Drive Files for re-indexing once the current transaction commits"""
+    entity_names = [n for n in entity_names if n]
+    if not entity_names:
+        return
+    frappe.cache().sadd(PENDING_KEY, *entity_names)
+    frappe.enqueue(
+        flush_search_index,
+        queue="short",
+        job_id=INDEX_JOB,
+        deduplicate=True,
+        enqueue_after_commit=True,
+    )
+
+
+def _pop_pending(count):
+    with frappe.cache().pipeline() as pipe:
+        pipe.spop(frappe.cache().make_key(PENDING_KEY), count)
+        names = pipe.execute()[0]
+    return [n.decode() if isinstance(n, bytes) else n for n in names or []]
+
+
+def flush_search_index():
+    """Background job / scheduler: index every queued entity"""
+    while names := _pop_pending(FLUSH_BATCH):
+        for name in names:
+            try:
+                index_entity(name)
+            except Exception:
+                frappe.db.rollback()
+                frappe.log_error(frappe.get_traceback(), f"Drive search index: {name}")
+        frappe.db.commit()
+
+
+def rebuild_search_index(team=None):
+    """Queue every Drive File (optionally of one team) for indexing"""
+    filters = {"team": team} if team else {}
+    names = frappe.get_all("Drive File", filters=filters, pluck="name")
+    for i in range(0, len(names), 1000):
+        queue_index(names[i : i + 1000])
+
+
+def _token_condition(i, token, params):
+    # Một ký tự: chỉ khớp chính xác, tránh quét gần hết index
+    if len(token) == 1:
+        params[f"t{i}"] = token
+        return f"token = %(t{i})s"
+    params[f"t{i}"] = token.replace("_", "\\_") + "%"
+    return f"token LIKE %(t{i})s"
+
+
+def _access_condition(user, member_teams, params):
+    """
+    SQL over `f` (Drive File): the entity is listed and `user` can read it, the
+    way drive.api.permissions.get_user_access resolves it: owner, non-private
+    file of a team in `member_teams`, or a current read grant to `user`, the
+    public ("") or `$TEAM` on the entity or any ancestor (lineage prefix).
+    """
+    params.update(
+        user=user,
+        member_teams=tuple(member_teams or ()) or ("",),
+        now=frappe.utils.now_datetime(),
+    )
+    return """
+        f.is_active = 1 AND f.parent_entity != ''
+        AND (
+            f.owner = %(user)s
+            OR (f.team IN %(member_teams)s AND f.is_private = 0)
+            OR EXISTS (
+                SELECT 1 FROM `tabDrive Permission` p
+                JOIN `tabDrive File` a ON a.name = p.entity
+                WHERE p.read = 1
+                  AND (p.valid_until IS NULL OR p.valid_until > %(now)s)
+                  AND (p.user IN (%(user)s, '') OR (p.user = '$TEAM' AND f.team IN %(member_teams)s))
+                  AND (
+                      a.name = f.name
+                      OR (IFNULL(a.lineage, '') != '' AND LEFT(f.lineage, CHAR_LENGTH(a.lineage)) = a.lineage)
+                  )
+            )
+        )
+    """
+
+
+def match_entities(
+    query, teams=None, entities=None, title_only=False, limit=CANDIDATE_LIMIT, user=None, member_teams=None
+):
+    """
+    Entities whose index rows match every query token (as prefix).
+
+    :param teams: restrict to these teams (range scans on the (team, token) index)
+    :param entities: or restrict to these entity names (e.g. shared with the user)
+    :param title_only: match title tokens only, for typeahead
+    :param user: keep only entities `user` can see (see `_access_condition`),
+        filtered before `limit` so hidden matches do not crowd out visible ones
+    :param member_teams: teams `user` belongs to, for team and `$TEAM` access
+    :return: {entity_name: (rank, in_title)}, best first
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_TOKENS]
+    if not tokens or not (teams or entities):
+        return {}
+
+    params = {"exact": tuple(tokens), "n": len(tokens)}
+    conditions = [_token_condition(i, t, params) for i, t in enumerate(tokens)]
+    which = " ".join(f"WHEN {c} THEN {i}" for i, c in enumerate(conditions))
+    if teams:
+        params["scope"] = tuple(teams)
+        scope = "team IN %(scope)s"
+    else:
+        params["scope"] = tuple(entities)
+        scope = "entity IN %(scope)s"
+    if title_only:
+        scope += " AND in_title = 1"
+
+    candidates = f"""
+        SELECT entity,
+               SUM(score * CASE WHEN token IN %(exact)s THEN 2 ELSE 1 END) AS `rank`,
+               MAX(in_title) AS in_title,
+               COUNT(DISTINCT CASE {which} END) AS matched
+        FROM `tabDrive Search Token`
+        WHERE {scope} AND ({" OR ".join(conditions)})
+        GROUP BY entity
+        HAVING matched = %(n)s
+    """
+    if user:
+        # Lọc quyền trước LIMIT: kết quả không xem được không chiếm chỗ của kết quả hợp lệ
+        candidates = f"""
+            SELECT m.entity, m.`rank`, m.in_title FROM ({candidates}) m
+            JOIN `tabDrive File` f ON f.name = m.entity
+            WHERE {_access_condition(user, member_teams, params)}
+        """
+    rows = frappe.db.sql(
+        f"{candidates} ORDER BY `rank` DESC LIMIT {int(limit)}",
+        params,
+    )
+    return {entity: (rank, in_title) for entity, rank, in_title, *_ in rows}
+
+
+def title_position(query, title):
+    """0 = exact title, 1 = title prefix, 2 = anywhere (accent-insensitive)"""
+    folded_query, folded_title = fold(query).strip(), fold(title)
+    if folded_title == folded_query:
+        return 0
+    if folded_title.startswith(folded_query):
+        return 1
+    return 2
+
+
+def rank_key(query, title, rank, modified):
+    """Sort key: exact title, title prefix, accents as typed, index score, recency"""
+    return (
+        title_position(query, title),
+        not contains_exact(title, query),
+        -rank,
+        -modified.timestamp(),
+    )
@@ -0,0 +1,60 @@
+"""
+Text normalisation for the Drive search index.
+
+Tokens are folded to lowercase ASCII with Vietnamese diacritics removed
+("Báo cáo Đà Nẵng" -> "bao", "cao", "da", "nang"), so a query typed with or
+without accents matches the same rows. Ranking can still prefer results whose
+original text carries the accents the user typed (see `fold` / `contains_exact`).
+"""
+
+import math
+import re
+import unicodedata
+from collections import Counter
+
+from frappe.utils import strip_html_tags
+
+MAX_TOKEN_LENGTH = 40
+TOKEN_RE = re.compile(r"[^\W_]+")
+
+# Số và từ ngắn vẫn được index (mã hợp đồng, "Q1", "2024"...)
+_FOLD_MAP = str.maketrans({"đ": "d", "Đ": "d"})
+
+
+def fold(text):
+    """Lowercase and strip diacritics: "Đề xuất" -> "de xuat" """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFD", text.translate(_FOLD_MAP).lower())
+    return "".join(c for c in text if unicodedata.category(c) != "Mn")
+
+
+def tokenize(text):
+    """Folded tokens of `text`, in order, HTML stripped"""
+    if not text:
+        return []
+    if "<" in text:
+        text = strip_html_tags(text)
+    return [t[:MAX_TOKEN_LENGTH] for t in TOKEN_RE.findall(fold(text))]
+
+
+def contains_exact(haystack, needle):
+    """Case-insensitive match that keeps diacritics, used as a ranking bonus"""
+    return bool(needle) and needle.lower() in (haystack or "").lower()
+
+
+def weigh(texts, limit):
+    """
+    Build {token: score} for one entity.
+
+    :param texts: iterable of (text, weight) pairs, e.g. title with a high weight
+    :param limit: keep only the `limit` best-scoring tokens
+    """
+    scores = {}
+    for text, weight in texts:
+        counts = Counter(tokenize(text))
+        for token, tf in counts.items():
+            scores[token] = scores.get(token, 0) + weight * (1 + math.log(tf))
+    if len(scores) > limit:
+        scores = dict(sorted(scores.items(), key=lambda kv: kv[1], reverse=True)[:limit])
+    return scores
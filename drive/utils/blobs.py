@@ -0,0 +1,182 @@
+"""
+Orphan blob reaper, behind `bench --site <site> drive-blob-report`.
+
+Storage keys under every team's home folder are streamed page by page (S3
+`list_objects_v2` paginator, or a directory walk for local storage) and each
+page is checked against the database with two queries:
+
+- `<home>/thumbnails/<name>.thumbnail` is live while Drive File `<name>` exists
+- any other key is live while some Drive File has it as `path`
+
+Trashed rows still count as live; their blobs leave with the trash purge
+(drive.api.purge). Keys newer than `GRACE_HOURS`, the chunk staging folder
+`<home>/uploads/` and the keys of open move journals (drive.api.move) are
+skipped so uploads and relocations in flight are never touched. Orphans are
+deleted `S3_DELETE_BATCH` keys at a time and at most `max_per_second` keys per
+second; with `dry_run` only the report is built. The weekly job only reports
+unless the site config sets `drive_reap_orphan_blobs`.
+"""
+
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import frappe
+
+from drive.api.move import get_journal_keys
+from drive.utils.files import S3_DELETE_BATCH, FileManager
+
+GRACE_HOURS = 24
+MAX_DELETES_PER_SECOND = 2000
+SAMPLE_SIZE = 20
+REPORT_KEY = "drive_blob_reaper_last_run"
+THUMBNAIL_FOLDER = "thumbnails"
+THUMBNAIL_SUFFIX = ".thumbnail"
+SKIPPED_FOLDERS = ("uploads",)
+DELETE_CONFIG_KEY = "drive_reap_orphan_blobs"
+
+
+def get_home_prefixes():
+    """Names of the team home folders; every Drive blob lives below one of them"""
+    return frappe.db.sql_list(
+        """
+        SELECT name FROM `tabDrive File`
+        WHERE parent_entity IS NULL AND is_group = 1 AND IFNULL(team, '') != ''
+        """
+    )
+
+
+def iter_storage_pages(manager, home, page_size=S3_DELETE_BATCH):
+    """Yield lists of (key, size, last modified UTC) below `home`, one storage page at a time"""
+    if manager.s3_enabled:
+        paginator = manager.conn.get_paginator("list_objects_v2")
+        for page in paginator.paginate(
+            Bucket=manager.bucket,
+            Prefix=f"{home}/",
+            PaginationConfig={"PageSize": page_size},
+        ):
+            objects = [
+                (o["Key"], o["Size"], o["LastModified"])
+                for o in page.get("Contents", [])
+                if o["Key"].split("/")[1] not in SKIPPED_FOLDERS
+            ]
+            if objects:
+                yield objects
+        return
+
+    root = manager.site_folder / home
+    page = []
+    for folder, subfolders, filenames in os.walk(root):
+        if Path(folder) == root:
+            subfolders[:] = [f for f in subfolders if f not in SKIPPED_FOLDERS]
+        for filename in filenames:
+            full_path = Path(folder) / filename
+            try:
+                stat = full_path.stat()
+            except FileNotFoundError:
+                continue
+            page.append(
+                (
+                    full_path.relative_to(manager.site_folder).as_posix(),
+                    stat.st_size,
+                    datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                )
+            )
+            if len(page) >= page_size:
+                yield page
+                page = []
+    if page:
+        yield page
+
+
+def find_orphans(objects):
+    """The (key, size) pairs of `objects` that no Drive File refers to"""
+    thumbnails, blobs = {}, []
+    for key, size, _ in objects:
+        folder, _, filename = key.rpartition("/")
+        if folder.endswith(f"/{THUMBNAIL_FOLDER}") and filename.endswith(THUMBNAIL_SUFFIX):
+            thumbnails[key] = filename[: -len(THUMBNAIL_SUFFIX)]
+        else:
+            blobs.append(key)
+
+    live = set()
+    if thumbnails:
+        names = set(
+            frappe.db.sql_list(
+                "SELECT name FROM `tabDrive File` WHERE name IN %(names)s",
+                {"names": tuple(set(thumbnails.values()))},
+            )
+        )
+        live.update(key for key, name in thumbnails.items() if name in names)
+    if blobs:
+        live.update(
+            frappe.db.sql_list(
+                "SELECT path FROM `tabDrive File` WHERE path IN %(paths)s",
+                {"paths": tuple(blobs)},
+            )
+        )
+    return [(key, size) for key, size, _ in objects if key not in live]
+
+
+def reap_orphan_blobs(dry_run=True, grace_hours=GRACE_HOURS, max_per_second=MAX_DELETES_PER_SECOND):
+    """
+    Find (and unless `dry_run`, delete) blobs no Drive File refers to.
+
+    :return: report dict with scanned / orphan counts and bytes, deletions and a sample of orphan keys
+    """
+    manager = FileManager()
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=grace_hours)
+    started = time.monotonic()
+    report = frappe._dict(
+        dry_run=bool(dry_run),
+        storage="s3" if manager.s3_enabled else "local",
+        scanned=0,
+        scanned_bytes=0,
+        orphans=0,
+        orphan_bytes=0,
+        deleted=0,
+        failed=0,
+        sample=[],
+    )
+    pending = []
+    in_move = get_journal_keys()
+
+    def flush():
+        batch_started = time.monotonic()
+        failed = manager.delete_files(pending)
+        report.deleted += len(pending) - len(failed)
+        report.failed += len(failed)
+        # Giới hạn tốc độ xoá để không dồn request lên storage
+        wait = len(pending) / max_per_second - (time.monotonic() - batch_started)
+        pending.clear()
+        if wait > 0:
+            time.sleep(wait)
+
+    for home in get_home_prefixes():
+        for page in iter_storage_pages(manager, home):
+            report.scanned += len(page)
+            report.scanned_bytes += sum(size for _, size, _ in page)
+            for key, size in find_orphans([o for o in page if o[2] < cutoff and o[0] not in in_move]):
+                report.orphans += 1
+                report.orphan_bytes += size
+                if len(report.sample) < SAMPLE_SIZE:
+                    report.sample.append(key)
+                if not dry_run:
+                    pending.append(key)
+                    if len(pending) >= S3_DELETE_BATCH:
+                        flush()
+    if pending:
+        flush()
+
+    report.seconds = round(time.monotonic() - started, 1)
+    frappe.cache().set_value(REPORT_KEY, report)
+    frappe.logger().info(
+        f"reap_orphan_blobs: {({k: v for k, v in report.items() if k != 'sample'})}"
+    )
+    return report
+
+
+def reap_orphan_blobs_job():
+    """Weekly scheduler: report orphan blobs; delete them only when the site config opts in"""
+    return reap_orphan_blobs(dry_run=not frappe.conf.get(DELETE_CONFIG_KEY))
@@ -18,3 +18,232 @@ def timing(f):
         return result
 
     return wrap
+
+
+def bench_mindmap_codec(node_count=5000, rounds=5):
+    """
+    Compare plain JSON and the compact mindmap encoding on a synthetic map.
+
+    bench execute drive.utils.dev.bench_mindmap_codec --kwargs "{'node_count': 5000}"
+    """
+    import json
+    from drive.utils import mindmap_codec
+
+    node_count = int(node_count)
+    nodes = [{"id": "root", "data": {"label": "<p>Root</p>", "isRoot": True}}]
+    edges = []
+    for i in range(1, node_count):
+        parent = nodes[(i - 1) // 4]["id"]
+        nodes.append(
+            {
+                "id": f"node-{i}",
+                "type": "mindmap",
+                "position": {"x": i * 12.5, "y": i * 7.25},
+                "data": {"label": f"<p>Nút số {i}</p>", "completed": i % 3 == 0},
+            }
+        )
+        edges.append(
+            {"id": f"edge-{parent}-node-{i}", "source": parent, "target": f"node-{i}"}
+        )
+    data = {"nodes": nodes, "edges": edges, "layout": "horizontal"}
+
+    plain = json.dumps(data, ensure_ascii=False)
+    stored = mindmap_codec.dumps(data)
+    compact = mindmap_codec.encode(data)
+
+    def best_of(fn):
+        best = None
+        for _ in range(int(rounds)):
+            ts = time()
+            fn()
+            best = min(best or float("inf"), time() - ts)
+        return best
+
+    result = {
+        "nodes": node_count,
+        "json_bytes": len(plain.encode("utf-8")),
+        "stored_bytes": len(stored.encode("utf-8")),
+        "compact_bytes": len(compact["payload"]),
+        "json_parse_s": best_of(lambda: json.loads(plain)),
+        "compact_parse_s": best_of(lambda: mindmap_codec.decode(compact)),
+        "compact_header_s": best_of(
+            lambda: mindmap_codec.CompactMindmap(compact).node_count()
+        ),
+    }
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def bench_mindmap_tree(depth=6, width=4, rounds=3):
+    """
+    Time cold and cached mindmap tree/layout reads on a synthetic folder tree.
+    Everything is rolled back at the end.
+
+    bench execute drive.utils.dev.bench_mindmap_tree --kwargs "{'depth': 6, 'width': 4}"
+    """
+    import json
+    import frappe
+    from drive.api.mindmap import (
+        get_mindmap_tree_structure,
+        get_mindmap_tree_with_positions,
+        invalidate_mindmap_tree_cache,
+    )
+
+    depth, width = int(depth), int(width)
+
+    def make(title, parent):
+        doc = frappe.get_doc(
+            {
+                "doctype": "Drive Mindmap",
+                "title": title,
+                "is_group": 1,
+                "parent_mindmap": parent,
+            }
+        ).insert(ignore_permissions=True)
+        return doc.name
+
+    root = make("bench-root", None)
+    level = [root]
+    leaf = root
+    for d in range(depth):
+        next_level = []
+        for parent in level:
+            for w in range(width):
+                next_level.append(make(f"bench-{d}-{w}", parent))
+        level = next_level[: width * 8]
+        leaf = level[0]
+
+    def best_of(fn, reset=None):
+        best = None
+        for _ in range(int(rounds)):
+            if reset:
+                reset()
+            ts = time()
+            fn()
+            best = min(best or float("inf"), time() - ts)
+        return best
+
+    def clear_all():
+        frappe.cache().delete_keys("drive_mindmap_tree:")
+
+    result = {
+        "depth": depth,
+        "width": width,
+        "structure_cold_s": best_of(lambda: get_mindmap_tree_structure(root), clear_all),
+        "structure_warm_s": best_of(lambda: get_mindmap_tree_structure(root)),
+        "structure_after_leaf_edit_s": best_of(
+            lambda: get_mindmap_tree_structure(root),
+            lambda: invalidate_mindmap_tree_cache(leaf),
+        ),
+        "positions_cold_s": best_of(
+            lambda: get_mindmap_tree_with_positions(root), clear_all
+        ),
+        "positions_warm_s": best_of(lambda: get_mindmap_tree_with_positions(root)),
+    }
+    frappe.db.rollback()
+    clear_all()
+    print(json.dumps(result, indent=2))
+    return result
+
+
+def bench_lineage(total=200000, depth=20, rounds=3):
+    """
+    Compare recursive-CTE and lineage subtree queries on a synthetic Drive File
+    tree `depth` levels deep with `total` nodes. Everything is rolled back.
+
+    bench execute drive.utils.dev.bench_lineage --kwargs "{'total': 200000, 'depth': 20}"
+    """
+    import json
+    import frappe
+    from drive.utils.lineage import (
+        count_descendants,
+        get_descendants,
+        is_descendant,
+        make_lineage,
+        move_lineage,
+    )
+
+    total, depth = int(total), int(depth)
+    per_level = max((total - 1) // depth, 1)
+    prefix = frappe.generate_hash(length=6)
+    root = f"{prefix}r"
+    rows = [(root, None, make_lineage(None, root))]
+    levels = [[(root, rows[0][2])]]
+    for d in range(1, depth + 1):
+        parents = levels[-1]
+        level = []
+        for i in range(per_level):
+            parent, parent_lineage = parents[i % len(parents)]
+            name = f"{prefix}{d}x{i}"
+            lineage = make_lineage(parent_lineage, name)
+            level.append((name, lineage))
+            rows.append((name, parent, lineage))
+        levels.append(level)
+
+    frappe.db.bulk_insert(
+        "Drive File",
+        ["name", "title", "parent_entity", "lineage", "is_group", "is_active"],
+        [(name, name, parent, lineage, 1, 1) for name, parent, lineage in rows],
+        chunk_size=5000,
+    )
+
+    def cte_descendants(name):
+        return frappe.db.sql_list(
+            """
+            WITH RECURSIVE descendants AS (
+                SELECT name FROM `tabDrive File` WHERE parent_entity = %(parent)s
+                UNION ALL
+                SELECT f.name FROM `tabDrive File` f
+                JOIN descendants d ON f.parent_entity = d.name
+            )
+            SELECT name FROM descendants
+            """,
+            {"parent": name},
+        )
+
+    def cte_is_under(name, ancestor):
+        return ancestor in frappe.db.sql_list(
+            """
+            WITH RECURSIVE ancestors AS (
+                SELECT name, parent_entity FROM `tabDrive File` WHERE name = %(name)s
+                UNION ALL
+                SELECT f.name, f.parent_entity FROM ancestors a
+                JOIN `tabDrive File` f ON f.name = a.parent_entity
+            )
+            SELECT name FROM ancestors
+            """,
+            {"name": name},
+        )
+
+    def best_of(fn):
+        best = None
+        for _ in range(int(rounds)):
+            ts = time()
+            fn()
+            best = min(best or float("inf"), time() - ts)
+        return best
+
+    mid, deep = levels[depth // 2][0][0], levels[-1][0][0]
+    result = {"nodes": len(rows), "depth": depth}
+    for label, node in (("root", root), ("mid", mid)):
+        result[f"{label}_subtree_size"] = count_descendants(node)
+        result[f"{label}_cte_descendants_s"] = best_of(lambda: cte_descendants(node))
+        result[f"{label}_lineage_descendants_s"] = best_of(lambda: get_descendants(node))
+    result["cte_is_under_s"] = best_of(lambda: cte_is_under(deep, mid))
+    result["lineage_is_under_s"] = best_of(lambda: is_descendant(deep, mid))
+
+    # Di chuyển cây con ở giữa sang một nhánh khác: một câu UPDATE
+    target_name, target_lineage = levels[depth // 2 - 1][-1]
+    before = frappe._dict(lineage=levels[depth // 2][0][1])
+    moved = frappe._dict(
+        name=mid,
+        lineage=make_lineage(target_lineage, mid),
+        get_doc_before_save=lambda: before,
+    )
+    ts = time()
+    move_lineage(moved)
+    result["lineage_move_subtree_s"] = time() - ts
+
+    frappe.db.rollback()
+    print(json.dumps(result, indent=2))
+    return result
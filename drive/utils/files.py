@@ -2,18 +2,25 @@ import frappe
 import os
 from pathlib import Path
 from PIL import Image, ImageOps
-from drive.locks.distributed_lock import DistributedLock
 import cv2
 from pathlib import Path
 import os
 import boto3
 import frappe
-from io import BytesIO
+import shutil
 from botocore.config import Config
+from botocore.exceptions import ClientError
+from concurrent.futures import ThreadPoolExecutor
+
+from drive.utils.lineage import split_lineage
 
 
 DriveFile = frappe.qb.DocType("Drive File")
 
+# S3 delete_objects nhận tối đa 1000 key mỗi lần gọi
+S3_DELETE_BATCH = 1000
+S3_WORKERS = 4
+
 MIME_LIST_MAP = {
     "Image": [
         "image/png",
@@ -199,6 +206,10 @@ class FileManager:
         """
         Moves the file from the current path to another path
         """
+        from drive.search.extract import queue_extraction
+
+        if drive_file:
+            queue_extraction(drive_file.name, drive_file.mime_type)
         if self.s3_enabled:
             self.conn.upload_file(current_path, self.bucket, new_path)
             if drive_file and self.can_create_thumbnail(drive_file):
@@ -234,60 +245,60 @@ class FileManager:
         if not file_path:
             file_path = str((file_path).resolve())
 
-        with DistributedLock(file.path, exclusive=False):
-            try:
-                # Keep image/video thumbnail as `thumbnail` results in very dark thumbnails (albeit better)
-                if file.mime_type.startswith("image"):
-                    with Image.open(file_path).convert("RGB") as image:
-                        image = ImageOps.exif_transpose(image)
-                        image.thumbnail((512, 512))
-                        image.save(str(disk_path), format="webp")
-                elif file.mime_type.startswith("video"):
-                    cap = cv2.VideoCapture(file_path)
-                    frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-                    target_frame = int(frame_count / 2)
-                    cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
-                    _, frame = cap.read()
-                    cap.release()
-                    _, thumbnail_encoded = cv2.imencode(
-                        ".webp",
-                        frame,
-                        [int(cv2.IMWRITE_WEBP_QUALITY), 50],
-                    )
-                    with open(disk_path, "wb") as f:
-                        f.write(thumbnail_encoded)
-                else:
-                    from thumbnail import generate_thumbnail
-
-                    # Word document thumbnail
-                    generate_thumbnail(
-                        file_path,
-                        disk_path,
-                        {
-                            "trim": False,
-                            "height": 512,
-                            "width": 512,
-                            "quality": 100,
-                            "type": "thumbnail",
-                        },
-                    )
-                final_path = Path(disk_path)
-                if self.s3_enabled:
-                    os.remove(file_path)
-                    self.conn.upload_file(
-                        final_path,
-                        self.bucket,
-                        str(save_path.with_suffix(".thumbnail")),
-                    )
-                    final_path.unlink()
-                else:
-                    final_path.rename(final_path.with_suffix(".thumbnail"))
+        # Thumbnail được ghi ra file .png riêng rồi đổi tên, nên không cần khoá file gốc
+        try:
+            # Keep image/video thumbnail as `thumbnail` results in very dark thumbnails (albeit better)
+            if file.mime_type.startswith("image"):
+                with Image.open(file_path).convert("RGB") as image:
+                    image = ImageOps.exif_transpose(image)
+                    image.thumbnail((512, 512))
+                    image.save(str(disk_path), format="webp")
+            elif file.mime_type.startswith("video"):
+                cap = cv2.VideoCapture(file_path)
+                frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+                target_frame = int(frame_count / 2)
+                cap.set(cv2.CAP_PROP_POS_FRAMES, target_frame)
+                _, frame = cap.read()
+                cap.release()
+                _, thumbnail_encoded = cv2.imencode(
+                    ".webp",
+                    frame,
+                    [int(cv2.IMWRITE_WEBP_QUALITY), 50],
+                )
+                with open(disk_path, "wb") as f:
+                    f.write(thumbnail_encoded)
+            else:
+                from thumbnail import generate_thumbnail
+
+                # Word document thumbnail
+                generate_thumbnail(
+                    file_path,
+                    disk_path,
+                    {
+                        "trim": False,
+                        "height": 512,
+                        "width": 512,
+                        "quality": 100,
+                        "type": "thumbnail",
+                    },
+                )
+            final_path = Path(disk_path)
+            if self.s3_enabled:
+                os.remove(file_path)
+                self.conn.upload_file(
+                    final_path,
+                    self.bucket,
+                    str(save_path.with_suffix(".thumbnail")),
+                )
+                final_path.unlink()
+            else:
+                final_path.rename(final_path.with_suffix(".thumbnail"))
 
-            except Exception as e:
-                try:
-                    os.remove(file_path)
-                except FileNotFoundError:
-                    pass
+        except Exception as e:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
 
     def get_file(self, path):
         """
@@ -300,10 +311,13 @@ class FileManager:
 
         # ⚠️ FIX: Check local file first (fast check)
         # If file exists locally, use it directly instead of searching S3
-        if local_path.exists():
-            with DistributedLock(path, exclusive=False):
-                with open(local_path, "rb") as fh:
-                    return BytesIO(fh.read())
+        # Writers never modify a blob in place (new path, or temp file + os.replace),
+        # so an open handle always sees one complete version and needs no lock.
+        # The handle is streamed by send_file instead of being read into memory.
+        try:
+            return open(local_path, "rb")
+        except FileNotFoundError:
+            pass
 
         # If not found locally and S3 is enabled, try S3
         if self.s3_enabled:
@@ -327,15 +341,136 @@ class FileManager:
     def get_thumbnail(self, team, name):
         return self.get_file(str(self.get_thumbnail_path(team, name)))
 
-    def delete_file(self, team, name, path):
-        if self.s3_enabled:
-            self.conn.delete_object(Bucket=self.bucket, Key=path)
-        else:
+    def delete_files(self, paths):
+        """
+        Delete many blobs at once: S3 `delete_objects` with up to 1000 keys per
+        call, batches sent in parallel.
+
+        :return: paths that could not be deleted
+        """
+        paths = [p for p in dict.fromkeys(paths) if p]
+        failed = []
+        if not self.s3_enabled:
+            for path in paths:
+                try:
+                    (self.site_folder / path).unlink()
+                except FileNotFoundError:
+                    pass
+                except OSError:
+                    failed.append(path)
+            return failed
+
+        def delete_batch(batch):
             try:
-                (self.site_folder / path).unlink()
-                self.get_thumbnail_path(team, name).unlink()
-            except FileNotFoundError:
-                pass
+                response = self.conn.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={"Objects": [{"Key": key} for key in batch], "Quiet": True},
+                )
+                return [error["Key"] for error in response.get("Errors", [])]
+            except Exception:
+                return batch
+
+        batches = [
+            paths[i : i + S3_DELETE_BATCH] for i in range(0, len(paths), S3_DELETE_BATCH)
+        ]
+        if not batches:
+            return failed
+        with ThreadPoolExecutor(max_workers=min(S3_WORKERS, len(batches))) as pool:
+            for errors in pool.map(delete_batch, batches):
+                failed.extend(errors)
+        return failed
+
+    def copy_files(self, pairs):
+        """
+        Copy blobs (source, destination) in parallel: S3 server-side copy, or a
+        hard link on local disk (a plain copy across filesystems). An existing
+        destination counts as copied, so a resumed run can repeat pairs.
+
+        :return: sources that could not be copied
+        """
+        pairs = [(src, dst) for src, dst in dict(pairs).items() if src and dst and src != dst]
+
+        def copy_one(pair):
+            src, dst = pair
+            try:
+                if self.s3_enabled:
+                    self.conn.copy({"Bucket": self.bucket, "Key": src}, self.bucket, dst)
+                    return None
+                target = self.site_folder / dst
+                target.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(self.site_folder / src, target)
+                except FileExistsError:
+                    pass
+                except OSError as e:
+                    if isinstance(e, FileNotFoundError):
+                        raise
+                    shutil.copy2(self.site_folder / src, target)
+                return None
+            except Exception:
+                return src
+
+        if not pairs:
+            return []
+        with ThreadPoolExecutor(max_workers=min(S3_WORKERS, len(pairs))) as pool:
+            return [src for src in pool.map(copy_one, pairs) if src]
+
+    def missing_files(self, paths):
+        """
+        The `paths` that have no blob at all (S3 404 / no local file). Other
+        errors count as present, so a transient failure is retried later.
+        """
+
+        def is_missing(path):
+            if not self.s3_enabled:
+                return not (self.site_folder / path).exists()
+            try:
+                self.conn.head_object(Bucket=self.bucket, Key=path)
+            except ClientError as e:
+                return e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound")
+            except Exception:
+                return False
+            return False
+
+        paths = list(paths)
+        if not paths:
+            return []
+        with ThreadPoolExecutor(max_workers=min(S3_WORKERS, len(paths))) as pool:
+            return [p for p, missing in zip(paths, pool.map(is_missing, paths)) if missing]
+
+    def get_thumbnail_paths(self, rows):
+        """Thumbnail keys of `rows` (dicts with name and team), home folders resolved in one query"""
+        homes = get_home_folders({r.team for r in rows if r.team})
+        return [
+            str(Path(homes[r.team]) / "thumbnails" / (r.name + ".thumbnail"))
+            for r in rows
+            if r.team in homes
+        ]
+
+    def delete_file(self, team, name, path):
+        """Delete the blob and its thumbnail; blobs that fail are left to the orphan reaper"""
+        paths = [path]
+        homes = get_home_folders([team])
+        if team in homes:
+            paths.append(str(Path(homes[team]) / "thumbnails" / (name + ".thumbnail")))
+        if path in self.delete_files(paths):
+            frappe.log_error(f"Could not delete blob {path} of {name}", "Drive blob delete")
+
+
+def get_home_folders(teams):
+    """{team: home folder name} for many teams in one query"""
+    teams = [t for t in teams if t]
+    if not teams:
+        return {}
+    return dict(
+        frappe.db.sql(
+            """
+            SELECT team, name FROM `tabDrive File`
+            WHERE team IN %(teams)s AND parent_entity IS NULL
+            """,
+            {"teams": tuple(teams)},
+        )
+    )
 
 
 def get_home_folder(team):
@@ -434,6 +569,8 @@ def generate_upward_path(entity_name, user=None):
     if user is None:
         user = frappe.session.user
     user = frappe.db.escape(user if user != "Guest" else "")
+    # Quyền đã quá valid_until không còn hiệu lực, kể cả khi sweeper chưa xoá
+    now = frappe.db.escape(str(frappe.utils.now_datetime()))
     result = frappe.db.sql(
         f"""WITH RECURSIVE
             generated_path as (
@@ -477,6 +614,7 @@ def generate_upward_path(entity_name, user=None):
             generated_path  as gp
         LEFT JOIN `tabDrive Permission` as p
         ON gp.name = p.entity AND p.user = {user}
+            AND (p.valid_until IS NULL OR p.valid_until > {now})
         ORDER BY gp.level DESC;
     """,
         as_dict=1,
@@ -501,32 +639,107 @@ def get_valid_breadcrumbs(entity, user_access):
     return file_path[-lose_access:]
 
 
+def get_ancestors(entity):
+    """
+    Names of `entity` and every folder above it, nearest first.
+    Read from the materialised lineage; falls back to a recursive query for
+    rows whose lineage is not built yet.
+    """
+    lineage = frappe.db.get_value("Drive File", entity, "lineage")
+    if lineage:
+        return split_lineage(lineage)
+    return frappe.db.sql_list(
+        """
+        WITH RECURSIVE ancestors AS (
+            SELECT name, parent_entity FROM `tabDrive File` WHERE name = %(entity)s
+            UNION ALL
+            SELECT f.name, f.parent_entity
+            FROM ancestors a
+            JOIN `tabDrive File` f ON f.name = a.parent_entity
+        )
+        SELECT name FROM ancestors
+        """,
+        {"entity": entity},
+    )
+
+
 def update_file_size(entity, delta):
     """
     Update file_size cho entity và tất cả parent folders.
-    Sử dụng frappe.db.set_value với update_modified=False để tránh TimestampMismatchError.
+    Tập tổ tiên được lấy bằng một CTE rồi cộng `delta` trong một câu UPDATE:
+    phép cộng chạy trong DB nên các upload đồng thời không ghi đè lẫn nhau,
+    và không cập nhật modified để tránh TimestampMismatchError.
+    Sai lệch (nếu có) được sửa bởi reconcile_folder_sizes.
     """
-    current_entity = entity
-    while current_entity:
-        # Lấy file_size hiện tại từ database
-        current_size = (
-            frappe.db.get_value("Drive File", current_entity, "file_size") or 0
-        )
-        new_size = current_size + delta
+    if not entity or not delta:
+        return
+    ancestors = get_ancestors(entity)
+    if not ancestors:
+        return
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive File`
+        SET file_size = GREATEST(COALESCE(file_size, 0) + %(delta)s, 0)
+        WHERE name IN %(ancestors)s
+        """,
+        {"delta": int(delta), "ancestors": tuple(ancestors)},
+    )
 
-        # Update file_size trực tiếp vào database, không update modified timestamp
-        # Điều này tránh TimestampMismatchError khi có nhiều upload đồng thời
-        frappe.db.set_value(
-            "Drive File", current_entity, "file_size", new_size, update_modified=False
-        )
 
-        # Lấy parent_entity để tiếp tục update
-        current_entity = frappe.db.get_value(
-            "Drive File", current_entity, "parent_entity"
-        )
+def compute_folder_sizes(rows):
+    """
+    Folder sizes recomputed bottom-up from their active children.
 
-    # Commit changes
-    frappe.db.commit()
+    :param rows: Drive File rows with name, parent_entity, is_group, is_active, file_size
+    :return: {folder name: size}
+    """
+    children = {}
+    for row in rows:
+        if row.parent_entity:
+            children.setdefault(row.parent_entity, []).append(row)
+
+    sizes = {}
+    for root in (r for r in rows if r.is_group and not r.parent_entity):
+        # DFS không đệ quy: cây thư mục có thể rất sâu
+        stack = [(root, False)]
+        while stack:
+            folder, visited = stack.pop()
+            if not visited:
+                stack.append((folder, True))
+                stack.extend((c, False) for c in children.get(folder.name, []) if c.is_group)
+                continue
+            sizes[folder.name] = sum(
+                (sizes.get(c.name, 0) if c.is_group else c.file_size or 0)
+                for c in children.get(folder.name, [])
+                if c.is_active == 1
+            )
+    return sizes
+
+
+def reconcile_folder_sizes(team=None):
+    """
+    Daily job: recompute folder sizes from scratch and fix the ones that drifted
+    """
+    teams = [team] if team else frappe.get_all("Drive Team", pluck="name")
+    for team in teams:
+        rows = frappe.get_all(
+            "Drive File",
+            filters={"team": team},
+            fields=["name", "parent_entity", "is_group", "is_active", "file_size"],
+        )
+        stored = {r.name: r.file_size or 0 for r in rows if r.is_group}
+        drifted = {
+            name: size
+            for name, size in compute_folder_sizes(rows).items()
+            if stored.get(name) != size
+        }
+        for name, size in drifted.items():
+            frappe.db.set_value("Drive File", name, "file_size", size, update_modified=False)
+        if drifted:
+            frappe.logger().info(
+                f"reconcile_folder_sizes: fixed {len(drifted)} folders in team {team}"
+            )
+        frappe.db.commit()
 
 
 def if_folder_exists(team, folder_name, parent, personal):
@@ -0,0 +1,129 @@
+"""
+Managed index set for the hot Drive doctypes, and the advisor behind
+`bench --site <site> drive-index-report`.
+
+`DRIVE_INDEXES` lists the composite indexes matched to the query shapes of
+drive.api.list / files / permissions; each doctype's `on_doctype_update`
+applies its entry and the `add_drive_indexes` patch applies all of them on
+existing sites.
+"""
+
+import re
+
+import frappe
+
+DRIVE_INDEXES = {
+    "Drive File": [
+        ["title"],
+        # Liệt kê thư mục con và đếm children
+        ["parent_entity", "is_active"],
+        # Danh sách theo nhóm (files_multi_team)
+        ["team", "is_active", "is_private"],
+        # My Drive / thùng rác của user
+        ["owner", "is_active", "is_private"],
+        ["modified_by", "is_active"],
+        # Cây con: lineage LIKE '/a/b/%' (drive.utils.lineage)
+        ["lineage"],
+        # Đối chiếu blob với dòng (drive.utils.blobs); path là Text nên index theo prefix
+        ["path(255)"],
+    ],
+    "Drive Permission": [
+        # get_user_access, share badges
+        ["entity", "user"],
+        # Shared with me / shared by me
+        ["user", "read"],
+        ["owner", "read"],
+        # Sweeper quyền hết hạn: xoá theo khoảng valid_until
+        ["valid_until"],
+    ],
+    "Drive Entity Log": [
+        ["user", "entity_name"],
+        ["entity_name", "last_interaction"],
+    ],
+    "Drive Recent File": [
+        ["user", "last_accessed"],
+    ],
+    "Drive Shortcut": [
+        ["shortcut_owner", "parent_folder"],
+        ["file", "is_shortcut"],
+    ],
+    "Drive Favourite": [
+        ["user", "entity"],
+    ],
+    "Drive Pin File": [
+        ["user", "drive_file"],
+    ],
+    # Tuổi thùng rác và dọn dẹp hàng loạt (drive.api.purge)
+    "Drive Trash": [
+        ["entity", "trashed_on"],
+        ["entity_shortcut"],
+    ],
+    "Drive Notification": [
+        ["notif_doctype_name"],
+    ],
+    "Drive Entity Activity Log": [
+        ["entity"],
+    ],
+}
+
+SLOW_QUERY_MS = 100
+
+
+def add_drive_indexes(doctype=None):
+    """Create the managed indexes of `doctype` (all doctypes if None); existing ones are skipped"""
+    doctypes = [doctype] if doctype else list(DRIVE_INDEXES)
+    for dt in doctypes:
+        for fields in DRIVE_INDEXES.get(dt, []):
+            frappe.db.add_index(dt, fields)
+
+
+def get_existing_indexes(doctype):
+    """Column lists of every index on the doctype's table"""
+    indexes = {}
+    for row in frappe.db.sql(f"SHOW INDEX FROM `tab{doctype}`", as_dict=True):
+        indexes.setdefault(row.Key_name, []).append((row.Seq_in_index, row.Column_name))
+    return [[column for _, column in sorted(columns)] for columns in indexes.values()]
+
+
+def get_missing_indexes():
+    """[(doctype, fields)] of managed indexes not covered by any existing index prefix"""
+    missing = []
+    for doctype, wanted in DRIVE_INDEXES.items():
+        existing = get_existing_indexes(doctype)
+        for fields in wanted:
+            columns_wanted = [re.sub(r"\(\d+\)$", "", f) for f in fields]
+            if not any(columns[: len(fields)] == columns_wanted for columns in existing):
+                missing.append((doctype, fields))
+    return missing
+
+
+def get_slow_queries(min_ms=SLOW_QUERY_MS, limit=20):
+    """
+    Statement digests touching Drive tables that are slow on average or ran
+    without a usable index, from performance_schema.
+
+    :return: list of dicts, or None if performance_schema is off
+    """
+    if not frappe.db.sql("SELECT @@performance_schema")[0][0]:
+        return None
+    # Timer của performance_schema tính bằng picosecond
+    return frappe.db.sql(
+        f"""
+        SELECT DIGEST_TEXT AS query,
+               COUNT_STAR AS calls,
+               ROUND(AVG_TIMER_WAIT / 1e9, 1) AS avg_ms,
+               ROUND(SUM_TIMER_WAIT / 1e9, 1) AS total_ms,
+               SUM_ROWS_EXAMINED AS rows_examined,
+               SUM_ROWS_SENT AS rows_sent,
+               SUM_NO_INDEX_USED AS no_index,
+               SUM_NO_GOOD_INDEX_USED AS no_good_index
+        FROM performance_schema.events_statements_summary_by_digest
+        WHERE SCHEMA_NAME = %(schema)s
+          AND DIGEST_TEXT LIKE %(tables)s
+          AND (AVG_TIMER_WAIT >= %(min_ps)s OR SUM_NO_INDEX_USED > 0 OR SUM_NO_GOOD_INDEX_USED > 0)
+        ORDER BY SUM_TIMER_WAIT DESC
+        LIMIT {int(limit)}
+        """,
+        {"schema": frappe.conf.db_name, "tables": "%tabDrive %", "min_ps": int(min_ms * 1e9)},
+        as_dict=True,
+    )
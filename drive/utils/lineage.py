@@ -0,0 +1,175 @@
+"""
+Materialised ancestry path of Drive Files.
+
+`Drive File.lineage` holds the names from the root down to the entity itself,
+"/<root>/<folder>/<entity>/". With an index on the column:
+
+- all descendants of X        -> lineage LIKE '<X.lineage>%'  (one range scan)
+- is X under Y                -> X.lineage starts with Y.lineage
+- ancestors of X              -> split X.lineage, no query
+
+The path is set in `DriveFile.before_save`; when an entity moves, the paths of
+its whole subtree are rewritten by one UPDATE in `DriveFile.on_update`.
+Deleted rows take their lineage with them. `rebuild_lineage` recomputes every
+path level by level (patch / repair).
+"""
+
+import frappe
+
+SEPARATOR = "/"
+LINEAGE_LENGTH = 700
+
+
+def make_lineage(parent_lineage, name):
+    return f"{parent_lineage or SEPARATOR}{name}{SEPARATOR}"
+
+
+def split_lineage(lineage):
+    """Names from the entity up to the root, nearest first"""
+    return [n for n in (lineage or "").split(SEPARATOR) if n][::-1]
+
+
+def like_prefix(lineage):
+    return lineage.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def get_lineage(entity_name):
+    return frappe.db.get_value("Drive File", entity_name, "lineage") if entity_name else None
+
+
+def set_lineage(doc):
+    """DriveFile.before_save: compute the path of a new or moved entity"""
+    if doc.lineage and not doc.is_new() and not doc.has_value_changed("parent_entity"):
+        return
+    parent_lineage = get_lineage(doc.parent_entity)
+    if doc.parent_entity and not parent_lineage:
+        # Cha chưa có lineage (dữ liệu trước patch): dựng lại từ chuỗi parent_entity
+        from drive.utils.files import get_ancestors
+
+        parent_lineage = "".join(SEPARATOR + n for n in get_ancestors(doc.parent_entity)[::-1])
+        parent_lineage += SEPARATOR
+    lineage = make_lineage(parent_lineage, doc.name)
+    check_lineage_length(lineage, None if doc.is_new() else doc.lineage)
+    doc.lineage = lineage
+
+
+def check_lineage_length(lineage, old_lineage=None):
+    """
+    Refuse a lineage (and, for a move from `old_lineage`, the rewritten paths of
+    the subtree) longer than the column, instead of failing inside the UPDATE.
+    """
+    longest = len(lineage)
+    if old_lineage:
+        deepest = frappe.db.sql(
+            "SELECT MAX(CHAR_LENGTH(lineage)) FROM `tabDrive File` WHERE lineage LIKE %(prefix)s",
+            {"prefix": like_prefix(old_lineage)},
+        )[0][0]
+        if deepest:
+            longest = max(longest, deepest - len(old_lineage) + len(lineage))
+    if longest > LINEAGE_LENGTH:
+        frappe.throw(
+            frappe._("Folders cannot be nested this deeply (path limit: {0} characters)").format(LINEAGE_LENGTH),
+            frappe.ValidationError,
+        )
+
+
+def move_lineage(doc):
+    """DriveFile.on_update: rewrite the paths of the subtree after a move"""
+    before = doc.get_doc_before_save()
+    if not before or not before.lineage or before.lineage == doc.lineage:
+        return
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive File`
+        SET lineage = CONCAT(%(new)s, SUBSTRING(lineage, %(cut)s))
+        WHERE lineage LIKE %(old)s AND name != %(name)s
+        """,
+        {
+            "new": doc.lineage,
+            "cut": len(before.lineage) + 1,
+            "old": like_prefix(before.lineage),
+            "name": doc.name,
+        },
+    )
+
+
+def _subtree_condition(entity_name, is_active, params):
+    lineage = get_lineage(entity_name)
+    if not lineage:
+        return None
+    params.update({"prefix": like_prefix(lineage), "entity": entity_name, "is_active": is_active})
+    condition = "lineage LIKE %(prefix)s AND name != %(entity)s"
+    if is_active is not None:
+        condition += " AND is_active = %(is_active)s"
+    return condition
+
+
+def get_descendants(entity_name, is_active=None, fields=None):
+    """
+    Every entity below `entity_name` in one range query.
+
+    :param is_active: only rows with this is_active value (all if None)
+    :param fields: columns to return as dicts; names only if None
+    """
+    params = {}
+    condition = _subtree_condition(entity_name, is_active, params)
+    if not condition:
+        return []
+    if not fields:
+        return frappe.db.sql_list(f"SELECT name FROM `tabDrive File` WHERE {condition}", params)
+    columns = ", ".join(f"`{f}`" for f in fields)
+    return frappe.db.sql(
+        f"SELECT {columns} FROM `tabDrive File` WHERE {condition}", params, as_dict=True
+    )
+
+
+def count_descendants(entity_name, is_active=None):
+    params = {}
+    condition = _subtree_condition(entity_name, is_active, params)
+    if not condition:
+        return 0
+    return frappe.db.sql(f"SELECT COUNT(*) FROM `tabDrive File` WHERE {condition}", params)[0][0]
+
+
+def is_descendant(entity_name, ancestor_name):
+    """True if `entity_name` lies strictly below `ancestor_name`"""
+    if not entity_name or not ancestor_name or entity_name == ancestor_name:
+        return False
+    lineages = dict(
+        frappe.db.sql(
+            "SELECT name, lineage FROM `tabDrive File` WHERE name IN %(names)s",
+            {"names": (entity_name, ancestor_name)},
+        )
+    )
+    entity_lineage, ancestor_lineage = lineages.get(entity_name), lineages.get(ancestor_name)
+    if not entity_lineage or not ancestor_lineage:
+        from drive.utils.files import get_ancestors
+
+        return ancestor_name in get_ancestors(entity_name)
+    return entity_lineage.startswith(ancestor_lineage)
+
+
+def rebuild_lineage(max_depth=200):
+    """Recompute every lineage top-down, one UPDATE per tree level"""
+    frappe.db.sql("UPDATE `tabDrive File` SET lineage = NULL")
+    # Gốc: không có cha, hoặc cha không còn tồn tại
+    frappe.db.sql(
+        """
+        UPDATE `tabDrive File` f
+        LEFT JOIN `tabDrive File` p ON p.name = f.parent_entity
+        SET f.lineage = CONCAT('/', f.name, '/')
+        WHERE p.name IS NULL
+        """
+    )
+    for _ in range(max_depth):
+        frappe.db.sql(
+            """
+            UPDATE `tabDrive File` f
+            JOIN `tabDrive File` p ON p.name = f.parent_entity
+            SET f.lineage = CONCAT(p.lineage, f.name, '/')
+            WHERE f.lineage IS NULL AND p.lineage IS NOT NULL
+            """
+        )
+        if not frappe.db.sql("SELECT ROW_COUNT()")[0][0]:
+            break
+    frappe.db.commit()
@@ -0,0 +1,163 @@
+"""
+Encoding helpers for Drive Mindmap `mindmap_data`.
+
+Storage stays JSON (other code searches `mindmap_data` with LIKE), but it is
+written without whitespace. For transfer, clients can opt into a compact
+columnar encoding: every node/edge key is written once with a column of values,
+then the whole document is zlib-compressed and base64-encoded so it fits in a
+regular JSON response.
+"""
+
+import base64
+import json
+import zlib
+from functools import cached_property
+
+COMPACT_ENCODING = "columnar-zlib"
+CODEC_VERSION = 1
+
+
+def dumps(mindmap_data):
+    """
+    Serialise mindmap data for storage in `Drive Mindmap.mindmap_data`
+    """
+    if isinstance(mindmap_data, str):
+        return mindmap_data
+    return json.dumps(mindmap_data, ensure_ascii=False, separators=(",", ":"))
+
+
+def loads(raw, default=None):
+    """
+    Parse stored mindmap data, returning `default` if it is empty or invalid
+    """
+    if not raw:
+        return default
+    if not isinstance(raw, str):
+        return raw
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return default
+
+
+def _to_columns(rows):
+    keys = []
+    seen = set()
+    for row in rows:
+        for key in row:
+            if key not in seen:
+                seen.add(key)
+                keys.append(key)
+
+    cols = {}
+    holes = {}
+    for key in keys:
+        column = []
+        for i, row in enumerate(rows):
+            if key in row:
+                column.append(row[key])
+            else:
+                column.append(None)
+                holes.setdefault(key, []).append(i)
+        cols[key] = column
+
+    block = {"n": len(rows), "keys": keys, "cols": cols}
+    if holes:
+        block["holes"] = holes
+    return block
+
+
+def _from_columns(block):
+    if not block:
+        return []
+    keys = block["keys"]
+    cols = block["cols"]
+    holes = {k: set(v) for k, v in block.get("holes", {}).items()}
+    rows = []
+    for i in range(block["n"]):
+        rows.append(
+            {k: cols[k][i] for k in keys if k not in holes or i not in holes[k]}
+        )
+    return rows
+
+
+def encode(mindmap_data):
+    """
+    Encode mindmap data for transfer using the compact columnar layout.
+
+    :param mindmap_data: dict with `nodes`, `edges` and `layout` (or its JSON string)
+    :return: {"encoding": COMPACT_ENCODING, "payload": base64 string}
+    """
+    mindmap_data = loads(mindmap_data, {}) or {}
+    body = {
+        "v": CODEC_VERSION,
+        "layout": mindmap_data.get("layout"),
+        "nodes": _to_columns(mindmap_data.get("nodes") or []),
+        "edges": _to_columns(mindmap_data.get("edges") or []),
+    }
+    extra = {
+        k: v for k, v in mindmap_data.items() if k not in ("nodes", "edges", "layout")
+    }
+    if extra:
+        body["extra"] = extra
+
+    raw = json.dumps(body, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return {
+        "encoding": COMPACT_ENCODING,
+        "payload": base64.b64encode(zlib.compress(raw, 6)).decode("ascii"),
+    }
+
+
+class CompactMindmap:
+    """
+    Lazily decoded compact mindmap payload.
+
+    The payload is decompressed once; node and edge dicts are only rebuilt
+    from their columns when first accessed.
+    """
+
+    def __init__(self, payload):
+        if isinstance(payload, dict):
+            payload = payload.get("payload")
+        self._body = json.loads(zlib.decompress(base64.b64decode(payload)))
+        if self._body.get("v") != CODEC_VERSION:
+            raise ValueError(f"Unsupported mindmap codec version: {self._body.get('v')}")
+
+    @property
+    def layout(self):
+        return self._body.get("layout")
+
+    @cached_property
+    def nodes(self):
+        return _from_columns(self._body.get("nodes"))
+
+    @cached_property
+    def edges(self):
+        return _from_columns(self._body.get("edges"))
+
+    def node_count(self):
+        return (self._body.get("nodes") or {}).get("n", 0)
+
+    def as_dict(self):
+        data = {"nodes": self.nodes, "edges": self.edges, "layout": self.layout}
+        data.update(self._body.get("extra") or {})
+        return data
+
+
+def decode(value, encoding=None):
+    """
+    Decode an incoming mindmap payload.
+
+    :param value: plain dict, JSON string, or compact payload
+    :param encoding: COMPACT_ENCODING if `value` uses the compact layout
+    :return: dict with `nodes`, `edges` and `layout`
+    """
+    if isinstance(value, str) and not encoding:
+        value = loads(value, value)
+    if isinstance(value, dict) and value.get("encoding") == COMPACT_ENCODING:
+        encoding = COMPACT_ENCODING
+    if encoding == COMPACT_ENCODING:
+        return CompactMindmap(value).as_dict()
+    if encoding:
+        raise ValueError(f"Unknown mindmap encoding: {encoding}")
+    return value
@@ -84,12 +84,14 @@ export function useMindmapPermissions() {
     console.log("   Current entityName:", entityName)
     console.log("   Message entity_name:", message?.entity_name)
     
-    if (!message || !message.entity_name) {
+    // Sự kiện gộp (xoá cả thư mục) mang danh sách entity_names
+    const entityNames = message?.entity_names || (message?.entity_name ? [message.entity_name] : [])
+    if (!message || !entityNames.length) {
       console.log("⚠️ Invalid message format:", message)
       return
     }
     
-    if (message.entity_name !== entityName) {
+    if (!entityNames.includes(entityName)) {
       console.log(`⚠️ Event for different file: ${message.entity_name} (current: ${entityName})`)
       return
     }
@@ -111,7 +113,7 @@ export function useMindmapPermissions() {
     
     handlePermissionChanged({
       reason: message.reason || "Your permission was changed",
-      entity_name: message.entity_name,
+      entity_name: entityName,
       can_edit: canEdit,
       unshared: isUnshared,
       deleted: isDeleted,
@@ -53,6 +53,7 @@ const customPreset = definePreset(Aura, {
 import App from "./App.vue"
 import "./index.css"
 import router from "./router"
+import { notifCount } from "./resources/permissions"
 import { initSocket, RealTimeHandler } from "./socket"
 import store from "./store"
 import translationPlugin from "./translation"
@@ -127,6 +128,12 @@ app.directive("focus", {
   mounted: (el) => el.focus(),
 })
 
+// Số thông báo chưa đọc được server đẩy qua realtime
+socket.on("drive_notification:unread_count", (data) => {
+  notifCount.setData(data.count)
+  store.state.notifCount = data.count
+})
+
 // Đăng ký riêng event upload_file_realtime
 socket.on("upload_file_realtime", (data) => {
   console.log("📥 REALTIME RECEIVED:", data)